@@ -134,3 +134,109 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+
+# Logging
+
+# Log the voting app's messages, such as shadow scoring comparisons, to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'voting': {
+            'handlers': ['console'],
+            'level': os.environ.get("VOTING_LOG_LEVEL", default="INFO"),
+        },
+    },
+}
+
+
+# Voting settings
+
+# When enabled, correlations are only stored once a vote has moved them away from the default,
+# instead of storing a row for every option pair of a ballot as soon as the option is created.
+SPARSE_CORRELATIONS = int(os.environ.get("SPARSE_CORRELATIONS", default=0))
+
+# How votes update correlations, either 'sync' to update them as each vote is saved, 'queue'
+# to queue the update for the process_correlation_updates worker, or 'log' to append the vote to
+# an event log that the worker compacts into the correlations
+CORRELATION_UPDATES = os.environ.get("CORRELATION_UPDATES", default="sync")
+
+# Scoring engine used for suggestions, either 'orm' to score with database annotations, 'sql'
+# to score with a single set-based query, or 'numpy' to score from an in-memory copy of each
+# ballot's correlations
+SCORING_ENGINE = os.environ.get("SCORING_ENGINE", default="orm")
+
+# Scoring engine of specific ballots, overriding SCORING_ENGINE, as comma-separated
+# ballot_id:engine pairs such as "12:numpy,40:sql"
+SCORING_ENGINE_BALLOTS = {
+    int(ballot_id): engine
+    for ballot_id, engine in (
+        pair.split(':')
+        for pair in os.environ.get("SCORING_ENGINE_BALLOTS", default="").split(',')
+        if pair
+    )
+}
+
+# Scoring engine that also ranks a sample of the suggestion requests, logging its latency and how
+# its ranking agrees with that of the scoring engine serving the request. Empty to disable.
+SHADOW_SCORING_ENGINE = os.environ.get("SHADOW_SCORING_ENGINE", default="")
+
+# Share of the suggestion requests ranked by the shadow scoring engine as well, from 0 to 1
+SHADOW_SCORING_RATE = float(os.environ.get("SHADOW_SCORING_RATE", default=0.01))
+
+# Minimum number of seconds between checks of the database for correlation changes by the
+# in-memory scoring engine
+CORRELATION_ENGINE_REFRESH_INTERVAL = float(
+    os.environ.get("CORRELATION_ENGINE_REFRESH_INTERVAL", default=0))
+
+# Number of sessions per ballot whose running score sums are kept by the in-memory scoring engine
+SESSION_SCORES_CACHE_SIZE = int(os.environ.get("SESSION_SCORES_CACHE_SIZE", default=1000))
+
+# When enabled, the in-memory scoring engine ranks a session's next suggestions for both a yes and
+# a no vote on the suggestion it was just given, in background threads, so that the request
+# following the vote can be answered from the result
+SPECULATIVE_SUGGESTIONS = int(os.environ.get("SPECULATIVE_SUGGESTIONS", default=0))
+
+# Number of threads ranking speculative suggestions
+SPECULATIVE_SUGGESTIONS_WORKERS = int(os.environ.get("SPECULATIVE_SUGGESTIONS_WORKERS", default=4))
+
+# Number of seconds speculative suggestions are kept for. Changes to correlations and vetoes by
+# other sessions in the meantime are not reflected in them, they are only dropped early when the
+# engine loads the ballot's options again.
+SPECULATIVE_SUGGESTIONS_TTL = float(os.environ.get("SPECULATIVE_SUGGESTIONS_TTL", default=10))
+
+# Number of options from which the in-memory scoring engine approximates a ballot's correlations
+# with low-rank factors instead of holding every option pair, or 0 to never approximate them
+LOW_RANK_MIN_OPTIONS = int(os.environ.get("LOW_RANK_MIN_OPTIONS", default=0))
+
+# Number of factors of the low-rank approximation. More factors are more accurate, but scoring
+# costs grow linearly with them.
+LOW_RANK_FACTORS = int(os.environ.get("LOW_RANK_FACTORS", default=32))
+
+# Number of sessions per process whose room, ballot and ballot options are kept to resolve tokens
+# and validate votes without querying the database
+SESSION_CONTEXT_CACHE_SIZE = int(os.environ.get("SESSION_CONTEXT_CACHE_SIZE", default=10000))
+
+# Number of seconds a session's context is kept for. Options created by another process are read
+# as soon as a vote names one, but options deleted by another process are only noticed once the
+# context expires.
+SESSION_CONTEXT_TTL = float(os.environ.get("SESSION_CONTEXT_TTL", default=60))
+
+# Number of ballots per process whose mapping between option ids and ordinals is kept, to read
+# and write vote bitmaps without querying the options
+OPTION_ORDINALS_CACHE_SIZE = int(os.environ.get("OPTION_ORDINALS_CACHE_SIZE", default=1000))
+
+# Number of seconds a ballot's ordinal mapping is kept for. Options created by another process are
+# read as soon as one is asked for, while options it deleted are only noticed once the mapping
+# expires.
+OPTION_ORDINALS_TTL = float(os.environ.get("OPTION_ORDINALS_TTL", default=60))
+
+# Directory of the snapshot files that in-memory scoring engines start from, written by the
+# save_engine_snapshots command, or empty to always load engines from the database
+ENGINE_SNAPSHOT_DIR = os.environ.get("ENGINE_SNAPSHOT_DIR", default="")
@@ -0,0 +1,411 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import (
+    F, Sum, Case, When, Value, OuterRef, Subquery, FloatField, ExpressionWrapper
+)
+from django.db.models.functions import Abs, Coalesce
+
+from .engine import get_engine
+from .models import DEFAULT_CORRELATION, BallotOption, OptionCorrelation
+from .scoring import rank_options
+from .session_context import get_session_context
+from .session_votes import get_session_bitmaps, get_session_votes
+from .speculation import get_speculation, submit_speculation
+from .bitmaps import get_ordinals
+from .vetoes import get_room_vetoes
+
+logger = logging.getLogger(__name__)
+
+LIKELIHOOD = 'suggest'
+SIGNIFICANCE = 'explore'
+
+# Scoring backends by name, as set in SCORING_ENGINE
+backends = {}
+
+
+def register_backend(name):
+    """Class decorator registering a scoring backend under a name."""
+    def register(cls):
+        backends[name] = cls()
+        return cls
+    return register
+
+
+def get_backend(name):
+    try:
+        return backends[name]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown scoring engine '{name}'")
+
+
+class ScoringBackend:
+    """Ranks the options of a ballot to suggest to a session."""
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        """Rank the options to suggest to a session, best first, as [{'id', 'score'}].
+
+        The session's ballot is looked up when needed and not given.
+        """
+        raise NotImplementedError
+
+
+@register_backend('orm')
+class OrmBackend(ScoringBackend):
+    """Scores every option with correlated subqueries annotated by the ORM."""
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        votes = get_session_votes(session_token)
+        queryset = BallotOption.objects.filter(
+            ballot__room__votingsession=session_token
+        ).exclude(
+            # Do not offer suggestions that have already been voted on
+            id__in=list(votes)
+        ).annotate(
+            score=self.get_score_annotation(mode, session_token, votes)
+        )
+
+        if mode == LIKELIHOOD:
+            # In likelihood mode, do not include suggestions that another session has voted against.
+            # This isn't a problem in explore mode, since even if we know an option can't be a
+            # consensus choice, suggesting it can provide us with information about the user
+            queryset = queryset.exclude(
+                ordinal__in=get_ordinals(get_session_vetoes(session_token)).tolist()
+            )
+
+        queryset = queryset.values(
+            'id',
+            'score'
+        ).order_by('-score', 'id')
+
+        return queryset if limit is None else queryset[:limit]
+
+    def get_score_annotation(self, mode, session_token, votes):
+        func = {
+            LIKELIHOOD: self.get_likelihood_annotation,
+            SIGNIFICANCE: self.get_significance_annotation
+        }[mode]
+        return func(session_token, votes)
+
+    @staticmethod
+    def get_option_counts(session_token, votes):
+        # Number of options on the session's ballot, and how many of them the session voted on
+        option_count = BallotOption.objects.filter(
+            ballot__room__votingsession=session_token
+        ).count()
+        return option_count, len(votes)
+
+    def get_likelihood_annotation(self, session_token, votes):
+        # Average the correlation value over all rows for predicates this session has not excluded
+        # That is either has not voted on or has voted matching the row
+        # This is equivalent to there not being a vote for the wrong polarity
+
+        # Correlations are not necessarily stored until a vote moves them, and a missing row sits
+        # at the default correlation. So rather than averaging the stored rows, sum how far they
+        # have drifted from the default and spread that over every row that could exist:
+        # unvoted options are predicates for both polarities, voted options only for their vote.
+        option_count, vote_count = self.get_option_counts(session_token, votes)
+        row_count = 2 * (option_count - 1) - vote_count
+        if row_count <= 0:
+            return Value(DEFAULT_CORRELATION, output_field=FloatField())
+
+        likelihood_drift = Subquery(
+            OptionCorrelation.objects.filter(
+                ballot=OuterRef('ballot'),
+                target=OuterRef('pk')
+            ).exclude(
+                predicate_polarity=True,
+                predicate__in=self.get_voted_options(votes, polarity=False)
+            ).exclude(
+                predicate_polarity=False,
+                predicate__in=self.get_voted_options(votes, polarity=True)
+            ).values(
+                'target'
+            ).annotate(
+                drift=Sum(F('correlation') - DEFAULT_CORRELATION)
+            ).values('drift'),
+            output_field=FloatField()
+        )
+
+        return ExpressionWrapper(
+            DEFAULT_CORRELATION + Coalesce(likelihood_drift, 0.0) / float(row_count),
+            output_field=FloatField()
+        )
+
+    def get_significance_annotation(self, session_token, votes):
+        # Calculate the absolute difference in correlation of the two polarities for a given target.
+        # Exclude any correlation that this session has voted for, either as predicate or target.
+        # (Exclude already voted predicates as they cannot be suggestions, and already
+        # voted targets as we want to maximize effect on future suggestions)
+        # e.g., if A has a 0.3 correlation with B, and ~A has a 0.8 correlation with B, then A has
+        # a significance of 0.5 with B
+
+        # We want to weigh the raw significance score by the likelihood of the option being chosen.
+        # This centers around 0.5, so that a likelihood of 0.5 is a 1x multiplier, and drops off to
+        #  0x for 100% or 0% likelihood.
+        # This way, options that may have high impact but are unlikely to provide information about
+        #  the user will be ranked below options that have a more moderate impact, but are more
+        # likely to reveal something about the user's preferences.
+        likelihood_score = (1 - 2 * Abs(
+            0.5 - self.get_likelihood_annotation(session_token, votes)))
+
+        # Every option other than the predicate itself that the session has not voted on is a target
+        option_count, vote_count = self.get_option_counts(session_token, votes)
+        target_count = option_count - 1 - vote_count
+        if target_count <= 0:
+            return Value(0.0, output_field=FloatField())
+
+        def polarity_correlation(polarity):
+            # The stored correlation for the same predicate and target with the given polarity
+            return Subquery(
+                OptionCorrelation.objects.filter(
+                    ballot=OuterRef('ballot'),
+                    predicate=OuterRef('predicate'),
+                    predicate_polarity=polarity,
+                    target=OuterRef('target')
+                ).values('correlation')[:1],
+                output_field=FloatField()
+            )
+
+        # Build a subquery of all correlations for relevant options, excluding options that the
+        # session has voted on as the target, since we want options that are likely to affect
+        # future votes.
+        # A missing row sits at the default correlation, so each pair is counted once: on its
+        # polarity=True row against the polarity=False row, or on its polarity=False row if that
+        # is the only one stored. Pairs with neither row stored have no difference at all.
+        correlation_change = Subquery(OptionCorrelation.objects.filter(
+            ballot=OuterRef('ballot'),
+            predicate=OuterRef('pk')
+        ).exclude(
+            target__in=self.get_voted_options(votes)
+        ).annotate(
+            correlation_false=polarity_correlation(False),
+            correlation_true=polarity_correlation(True)
+        ).values(
+            'predicate'
+        ).annotate(
+            # Then collapse the rows to just the absolute difference up or down
+            correlation_change=Sum(Case(
+                When(
+                    predicate_polarity=True,
+                    then=Abs(
+                        F('correlation') - Coalesce('correlation_false', DEFAULT_CORRELATION)
+                    )
+                ),
+                When(
+                    correlation_true__isnull=True,
+                    then=Abs(F('correlation') - DEFAULT_CORRELATION)
+                ),
+                default=0.0,
+                output_field=FloatField()
+            ))
+        ).values('correlation_change'), output_field=FloatField())
+
+        # Finally, average the absolute differences for all targets of a given predicate
+        return ExpressionWrapper(
+            likelihood_score * Coalesce(correlation_change, 0.0) / float(target_count),
+            output_field=FloatField()
+        )
+
+    @staticmethod
+    def get_voted_options(votes, polarity=None):
+        return [
+            option_id for option_id, vote in votes.items() if polarity is None or vote == polarity
+        ]
+
+
+@register_backend('sql')
+class SqlBackend(ScoringBackend):
+    """Scores every option with one set-based query instead of a correlated subquery each."""
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        bitmaps = get_session_bitmaps(session_token)
+        if bitmaps is None:
+            return []
+
+        voted_for, voted_against = bitmaps
+        return rank_options(
+            int(session_token),
+            get_ordinals(voted_for).tolist(),
+            get_ordinals(voted_against).tolist(),
+            significance=mode == SIGNIFICANCE,
+            # As for the annotations, only exclude vetoed options in likelihood mode
+            vetoed_ordinals=(
+                get_ordinals(get_session_vetoes(session_token)).tolist()
+                if mode == LIKELIHOOD else ()
+            ),
+            limit=limit
+        )
+
+
+@register_backend('numpy')
+class EngineBackend(ScoringBackend):
+    """Scores from the ballot's in-memory correlations rather than in the database."""
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        votes = get_session_votes(session_token)
+
+        if settings.SPECULATIVE_SUGGESTIONS and votes:
+            # The last suggestion may have been ranked ahead of time for the vote just cast
+            suggestions = get_speculation(
+                (session_token, len(votes) - 1, mode),
+                votes,
+                limit
+            )
+            if suggestions is not None:
+                return suggestions
+
+        if ballot_id is None:
+            ballot_id = get_session_ballot(session_token)
+            if ballot_id is None:
+                return []
+
+        engine = get_engine(ballot_id)
+
+        func = {
+            LIKELIHOOD: engine.get_likelihood_scores,
+            SIGNIFICANCE: engine.get_significance_scores
+        }[mode]
+
+        # Do not offer suggestions that have already been voted on
+        excluded = set(votes)
+        # Nor options that another session has voted against, as for the annotations
+        vetoes = get_session_vetoes(session_token) if mode == LIKELIHOOD else None
+
+        # Hold the lock throughout, so that a refresh in between cannot move the indexes the
+        # vetoes, scores and ranking are given by
+        with engine.lock:
+            vetoed = engine.get_vetoed(vetoes) if vetoes is not None else None
+            scores = engine.get_session_scores(votes, session_token)
+            suggestions = engine.rank(func(scores), excluded, limit, vetoed)
+
+        if settings.SPECULATIVE_SUGGESTIONS and suggestions:
+            # Rank what comes after the best suggestion while the session decides on it
+            submit_speculation(
+                (session_token, len(votes), mode),
+                engine,
+                func,
+                scores,
+                excluded,
+                suggestions[0]['id'],
+                limit,
+                vetoed
+            )
+
+        return suggestions
+
+
+def get_session_vetoes(session_token):
+    """Bitmap of the options any session in the same room has voted against, by ordinal."""
+    session = get_session_context(session_token)
+    return get_room_vetoes(session.room_id) if session is not None else b''
+
+
+def get_session_ballot(session_token):
+    session = get_session_context(session_token)
+    return session.ballot_id if session is not None else None
+
+
+def get_suggestions(mode, session_token, limit=None, ballot_id=None):
+    """Rank the options to suggest to a session with the scoring backend of its ballot.
+
+    On a sample of requests, SHADOW_SCORING_ENGINE ranks them as well, to be compared.
+    """
+    if ballot_id is None and settings.SCORING_ENGINE_BALLOTS:
+        ballot_id = get_session_ballot(session_token)
+
+    name = settings.SCORING_ENGINE_BALLOTS.get(ballot_id, settings.SCORING_ENGINE)
+    backend = get_backend(name)
+
+    shadow_name = settings.SHADOW_SCORING_ENGINE
+    if not shadow_name or shadow_name == name or random.random() >= settings.SHADOW_SCORING_RATE:
+        return backend.get_suggestions(mode, session_token, limit, ballot_id)
+
+    return shadow_suggestions(
+        (name, backend),
+        (shadow_name, get_backend(shadow_name)),
+        mode,
+        session_token,
+        limit,
+        ballot_id
+    )
+
+
+def shadow_suggestions(primary, shadow, mode, session_token, limit=None, ballot_id=None):
+    """Rank with both backends, log how they compare and return the primary's ranking.
+
+    The shadow runs after the primary within the same request, and its failures are only
+    logged.
+    """
+    name, backend = primary
+    start = time.perf_counter()
+    # Rank fully now, so that lazy querysets are timed as well
+    suggestions = list(backend.get_suggestions(mode, session_token, limit, ballot_id))
+    latency = (time.perf_counter() - start) * 1000
+
+    shadow_name, shadow_backend = shadow
+    start = time.perf_counter()
+    try:
+        shadow_ranking = list(shadow_backend.get_suggestions(mode, session_token, limit, ballot_id))
+    except Exception:
+        logger.exception("Shadow scoring engine '%s' failed", shadow_name)
+        return suggestions
+    shadow_latency = (time.perf_counter() - start) * 1000
+
+    ids = [suggestion['id'] for suggestion in suggestions]
+    shadow_ids = [suggestion['id'] for suggestion in shadow_ranking]
+    correlation = get_rank_correlation(ids, shadow_ids)
+    overlap = get_overlap(ids, shadow_ids)
+    logger.info(
+        "Shadow scoring of session %s in %s mode: %s took %.1f ms, %s took %.1f ms, "
+        "rank correlation %s, overlap %.3f",
+        session_token,
+        mode,
+        name,
+        latency,
+        shadow_name,
+        shadow_latency,
+        'n/a' if correlation is None else f'{correlation:.3f}',
+        overlap,
+        extra={
+            'scoring_engine': name,
+            'shadow_scoring_engine': shadow_name,
+            'latency_ms': latency,
+            'shadow_latency_ms': shadow_latency,
+            'rank_correlation': correlation,
+            'overlap': overlap
+        }
+    )
+    return suggestions
+
+
+def get_rank_correlation(ids, other_ids):
+    """Spearman's rank correlation of the options both rankings include.
+
+    None when fewer than two options are in both.
+    """
+    other_ranks = {option_id: rank for rank, option_id in enumerate(other_ids)}
+    common = [option_id for option_id in ids if option_id in other_ranks]
+    count = len(common)
+    if count < 2:
+        return None
+
+    # Rank the common options again within each ranking, so that both ranks run from 0 to n - 1
+    other_order = sorted(common, key=other_ranks.get)
+    other_ranks = {option_id: rank for rank, option_id in enumerate(other_order)}
+    squared_difference = sum(
+        (rank - other_ranks[option_id]) ** 2 for rank, option_id in enumerate(common)
+    )
+    return 1 - 6 * squared_difference / (count * (count ** 2 - 1))
+
+
+def get_overlap(ids, other_ids):
+    """Share of the options ranked by either that both rankings include."""
+    ids = set(ids)
+    other_ids = set(other_ids)
+    if not ids and not other_ids:
+        return 1.0
+    return len(ids & other_ids) / len(ids | other_ids)
@@ -0,0 +1,42 @@
+from django.db import transaction
+
+from .correlations import initialize_ballot_correlations
+from .models import Ballot, BallotOption, get_next_ordinal
+from .ordinals import clear_ordinal_mapping
+from .session_context import clear_ballot_options
+
+
+def import_ballot(label, option_labels):
+    """Create a ballot, or add to an existing one, with options created in bulk.
+
+    Options already on the ballot are skipped. Returns the ballot and the number of options
+    created.
+    """
+    with transaction.atomic():
+        ballot, _ = Ballot.objects.get_or_create(label=label)
+        # Lock the ballot so that options created meanwhile do not take the same ordinals
+        list(Ballot.objects.select_for_update().filter(id=ballot.id).values('id'))
+
+        existing_labels = set(BallotOption.objects.filter(
+            ballot=ballot
+        ).values_list('label', flat=True))
+        new_labels = [
+            option_label
+            for option_label in dict.fromkeys(option_labels)
+            if option_label not in existing_labels
+        ]
+
+        # bulk_create does not send post_save, so initialize_correlations does not run for
+        # each option. Their correlations are created in a single statement instead, for the
+        # options numbered from the first ordinal on, which no other option of the ballot can
+        # take while it is locked.
+        first_ordinal = get_next_ordinal(ballot.id)
+        BallotOption.objects.bulk_create(
+            BallotOption(ballot=ballot, label=option_label, ordinal=ordinal)
+            for ordinal, option_label in enumerate(new_labels, start=first_ordinal)
+        )
+        initialize_ballot_correlations(ballot.id, first_ordinal)
+        clear_ballot_options(ballot.id)
+        clear_ordinal_mapping(ballot.id)
+
+    return ballot, len(new_labels)
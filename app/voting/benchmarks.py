@@ -0,0 +1,174 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .ballots import import_ballot
+from .engine import clear_engines
+from .models import BallotOption, Room, UserVote, VotingSession
+from .signals import votes_bulk_created
+
+PERCENTILES = (50, 95, 99)
+
+# Number of hidden traits options have and sessions weigh, for synthetic preferences
+TRAIT_COUNT = 4
+
+
+class Rollback(Exception):
+    pass
+
+
+def generate_ballot(option_count, session_count, votes_per_session, seed=0):
+    """Create a ballot with a vote history drawn from a seeded preference model.
+
+    Options get random traits and sessions random tastes for them, so that votes are correlated
+    the way real preferences are rather than uniformly random. Sessions share rooms in groups of
+    two to four. Returns the ballot.
+    """
+    rng = random.Random(seed)
+
+    ballot, _ = import_ballot(
+        f'Benchmark {option_count} options (seed {seed})',
+        [f'Option {index}' for index in range(option_count)]
+    )
+    options = list(BallotOption.objects.filter(ballot=ballot).order_by('id'))
+    traits = {
+        option.id: [rng.gauss(0, 1) for _ in range(TRAIT_COUNT)]
+        for option in options
+    }
+
+    room = None
+    for index in range(session_count):
+        if room is None or rng.random() < 1 / 3:
+            room = Room.objects.create(ballot=ballot)
+        session = VotingSession.objects.create(room=room)
+        taste = [rng.gauss(0, 1) for _ in range(TRAIT_COUNT)]
+
+        votes = []
+        for option in rng.sample(options, min(votes_per_session, len(options))):
+            affinity = sum(t * w for t, w in zip(traits[option.id], taste))
+            votes.append(UserVote(
+                session=session,
+                option=option,
+                polarity=rng.random() < 1 / (1 + math.exp(-affinity))
+            ))
+        UserVote.objects.bulk_create(votes)
+        votes_bulk_created.send(
+            sender=UserVote,
+            votes=list(UserVote.objects.filter(session=session).order_by('id'))
+        )
+
+    return ballot
+
+
+@contextmanager
+def count_rows(counter):
+    """Add the rows each query returned or affected, as reported by the driver, to a counter."""
+    def execute(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        counter['rows'] += max(context['cursor'].rowcount, 0)
+        return result
+
+    with connection.execute_wrapper(execute):
+        yield
+
+
+def measure(func, samples):
+    """Call func once per sample, and summarize its latency, queries and rows touched."""
+    timings = []
+    queries = []
+    rows = []
+    for sample in range(samples):
+        counter = {'rows': 0}
+        with CaptureQueriesContext(connection) as context, count_rows(counter):
+            start = time.perf_counter()
+            func(sample)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(context.captured_queries))
+        rows.append(counter['rows'])
+
+    return {
+        'samples': samples,
+        **{
+            f'p{percentile}_ms': round(get_percentile(timings, percentile), 3)
+            for percentile in PERCENTILES
+        },
+        'mean_queries': sum(queries) / samples,
+        'mean_rows': sum(rows) / samples
+    }
+
+
+def get_percentile(values, percentile):
+    # Nearest-rank percentile
+    values = sorted(values)
+    return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+
+def benchmark_ballot(ballot, samples, seed=0):
+    rng = random.Random(seed)
+    client = Client()
+    results = {}
+
+    def initialize_correlations(sample):
+        BallotOption.objects.create(ballot=ballot, label=f'Benchmark option {sample}')
+
+    results['initialize_correlations'] = measure(initialize_correlations, samples)
+
+    # Vote on every sample from a fresh session, so that each one correlates with more votes
+    session = VotingSession.objects.create(room=Room.objects.create(ballot=ballot))
+    options = rng.sample(
+        list(BallotOption.objects.filter(ballot=ballot).values_list('id', flat=True)),
+        samples
+    )
+
+    def update_correlations(sample):
+        response = client.post(
+            reverse('uservote-list') + f'?token={session.id}',
+            {'option': options[sample], 'polarity': rng.random() < 0.5},
+            content_type='application/json'
+        )
+        assert response.status_code == 201, response.content
+
+    results['update_correlations'] = measure(update_correlations, samples)
+
+    for mode in ['suggest', 'explore']:
+        def suggest(sample):
+            response = client.get(
+                reverse('suggest-list') + f'?token={session.id}&mode={mode}&limit=1'
+            )
+            assert response.status_code == 200, response.content
+
+        results[f'{mode}_suggestion'] = measure(suggest, samples)
+
+    return results
+
+
+def run_benchmarks(sizes, session_count, votes_per_session, samples, seed=0):
+    """Benchmark each ballot size, then roll back everything the benchmark created.
+
+    Returns {option_count: {operation: summary}}.
+    """
+    results = {}
+    try:
+        # The test client's requests need a host that is allowed
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            for option_count in sizes:
+                ballot = generate_ballot(option_count, session_count, votes_per_session, seed)
+                results[option_count] = benchmark_ballot(
+                    ballot,
+                    min(samples, option_count),
+                    seed
+                )
+            raise Rollback()
+    except Rollback:
+        pass
+    finally:
+        # Engines may have loaded ballots that no longer exist
+        clear_engines()
+
+    return results
@@ -0,0 +1,38 @@
+"""Bitmaps over the options of a ballot, indexed by option ordinal.
+
+Bitmaps are packed bytes with the lowest bit of the first byte for ordinal 0, and only grow as
+far as their last set ordinal.
+"""
+import numpy as np
+
+
+def unpack_bitmap(bitmap):
+    return np.unpackbits(np.frombuffer(bytes(bitmap), dtype=np.uint8), bitorder='little')
+
+
+def get_bits(bitmap, ordinals):
+    """Whether each ordinal is set in a bitmap, ordinals past its end being unset."""
+    bits = unpack_bitmap(bitmap)
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    mask = np.zeros(len(ordinals), dtype=bool)
+    within = ordinals < len(bits)
+    mask[within] = bits[ordinals[within]].astype(bool)
+    return mask
+
+
+def get_ordinals(bitmap):
+    """Ordinals set in a bitmap."""
+    return np.flatnonzero(unpack_bitmap(bitmap))
+
+
+def set_bits(bitmap, ordinals, values):
+    """Return the bitmap with the ordinals set or cleared.
+
+    Trailing empty bytes are dropped, so a bitmap only grows as far as its last set ordinal.
+    """
+    bits = unpack_bitmap(bitmap)
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    if len(ordinals):
+        bits = np.pad(bits, (0, max(int(ordinals.max()) + 1 - len(bits), 0)))
+        bits[ordinals] = values
+    return np.packbits(bits, bitorder='little').tobytes().rstrip(b'\0')
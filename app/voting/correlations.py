@@ -0,0 +1,492 @@
+import csv
+import io
+from collections import defaultdict
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    DEFAULT_CORRELATION,
+    Ballot,
+    BallotOption,
+    CorrelationSnapshot,
+    OptionCorrelation,
+    PendingCorrelationUpdate,
+    UserVote,
+    VoteEvent
+)
+
+# Use Exponential Moving Average to track correlation weights
+# EMA will keep values stable, but allow them to drift in response to changes in patterns.
+# Higher the weight, the slower it will react to changes.
+# Correlation will vary between 0 and 1
+# Values towards 0.5 indicate a lack of correlation
+EMA_WEIGHT = 0.95
+POSITIVE_SCORE = 1
+NEGATIVE_SCORE = 0
+
+
+def get_score(polarity):
+    return POSITIVE_SCORE if polarity else NEGATIVE_SCORE
+
+
+def fold_votes(votes):
+    """Fold votes into a single EMA step per correlation they update.
+
+    Returns {(predicate_id, predicate_polarity, target_id): (steps, offset)}, such that applying
+    the votes one at a time in the order they were cast leaves a correlation of
+    `correlation * EMA_WEIGHT ** steps + offset`.
+    """
+    # A vote correlates with every vote its session cast before it, in both directions.
+    # Those earlier votes are not necessarily part of this fold.
+    session_votes = UserVote.objects.filter(
+        session__in={vote.session_id for vote in votes}
+    ).order_by('session', 'id').values_list('id', 'session', 'option', 'polarity')
+
+    return fold_session_votes(session_votes, {vote.id for vote in votes})
+
+
+def fold_events(events):
+    """Fold vote events from the log into a single EMA step per correlation, as `fold_votes`.
+
+    Earlier votes are read from the log as well, so they are the votes as they were cast.
+    """
+    if not events:
+        return {}
+
+    session_events = VoteEvent.objects.filter(
+        session__in={event.session_id for event in events},
+        id__lte=max(event.id for event in events)
+    ).order_by('session', 'id').values_list('id', 'session', 'option', 'polarity')
+
+    return fold_session_votes(session_events, {event.id for event in events})
+
+
+def fold_session_votes(session_votes, vote_ids):
+    """Fold the votes with the given ids, from (id, session, option, polarity) rows of every
+    vote of their sessions ordered by session and id."""
+    events = []
+    earlier_votes = defaultdict(list)
+    for vote_id, session_id, option_id, polarity in session_votes:
+        earlier = earlier_votes[session_id]
+        if vote_id in vote_ids:
+            for earlier_option_id, earlier_polarity in earlier:
+                events.append((
+                    vote_id,
+                    (earlier_option_id, earlier_polarity, option_id),
+                    get_score(polarity)
+                ))
+                events.append((
+                    vote_id,
+                    (option_id, polarity, earlier_option_id),
+                    get_score(earlier_polarity)
+                ))
+        earlier.append((option_id, polarity))
+
+    # Correlations shared between sessions must be stepped in the order the votes were cast
+    events.sort(key=lambda event: event[0])
+
+    updates = {}
+    for _, key, score in events:
+        steps, offset = updates.get(key, (0, 0.0))
+        updates[key] = (steps + 1, offset * EMA_WEIGHT + score * (1 - EMA_WEIGHT))
+    return updates
+
+
+def apply_correlation_updates(ballot_id, updates, batch_size=1000):
+    """Apply folded EMA steps from `fold_votes` to a ballot's stored correlations in one pass."""
+    if not updates:
+        return
+
+    if settings.SPARSE_CORRELATIONS:
+        OptionCorrelation.objects.bulk_create(
+            (
+                OptionCorrelation(
+                    ballot_id=ballot_id,
+                    predicate_id=predicate_id,
+                    predicate_polarity=predicate_polarity,
+                    target_id=target_id
+                )
+                for predicate_id, predicate_polarity, target_id in updates
+            ),
+            ignore_conflicts=True
+        )
+
+    correlations = OptionCorrelation.objects.filter(
+        ballot=ballot_id,
+        predicate__in={key[0] for key in updates},
+        target__in={key[2] for key in updates}
+    ).only('id', 'predicate', 'predicate_polarity', 'target')
+
+    now = timezone.now()
+    updated = []
+    for correlation in correlations:
+        try:
+            steps, offset = updates[
+                (correlation.predicate_id, correlation.predicate_polarity, correlation.target_id)
+            ]
+        except KeyError:
+            continue
+        # Update relative to the stored value so concurrent writers do not overwrite each other
+        correlation.correlation = F('correlation') * (EMA_WEIGHT ** steps) + offset
+        correlation.updated = now
+        updated.append(correlation)
+
+    OptionCorrelation.objects.bulk_update(
+        updated,
+        ['correlation', 'updated'],
+        batch_size=batch_size
+    )
+
+
+def process_pending_updates(batch_size=1000):
+    """Apply a batch of queued vote updates, one pass per ballot. Returns the number of votes."""
+    with transaction.atomic():
+        # Skip batches another worker has claimed rather than waiting on them
+        pending = list(
+            PendingCorrelationUpdate.objects.select_for_update(
+                skip_locked=True,
+                of=('self',)
+            ).select_related(
+                'vote__option'
+            ).order_by('id')[:batch_size]
+        )
+
+        ballot_votes = defaultdict(list)
+        for update in pending:
+            ballot_votes[update.vote.option.ballot_id].append(update.vote)
+
+        for ballot_id, votes in ballot_votes.items():
+            apply_correlation_updates(ballot_id, fold_votes(votes))
+
+        PendingCorrelationUpdate.objects.filter(
+            id__in=[update.id for update in pending]
+        ).delete()
+
+    return len(pending)
+
+
+def compact_vote_events(batch_size=1000):
+    """Fold a batch of logged vote events into the correlations, one pass per ballot.
+
+    Each ballot's snapshot is advanced in the same transaction as its correlations, so readers
+    always see correlations that match the snapshot. Returns the number of events.
+    """
+    events = list(VoteEvent.objects.filter(
+        id__gt=Coalesce(Subquery(
+            CorrelationSnapshot.objects.filter(
+                ballot=OuterRef('ballot')
+            ).values('last_event_id')
+        ), 0)
+    ).order_by('id')[:batch_size])
+
+    events_by_ballot = defaultdict(list)
+    for event in events:
+        events_by_ballot[event.ballot_id].append(event)
+
+    compacted = 0
+    for ballot_id, ballot_events in events_by_ballot.items():
+        CorrelationSnapshot.objects.get_or_create(ballot_id=ballot_id)
+        with transaction.atomic():
+            # Skip ballots another worker is compacting rather than waiting on them
+            snapshot = CorrelationSnapshot.objects.select_for_update(
+                skip_locked=True
+            ).filter(ballot=ballot_id).first()
+            if snapshot is None:
+                continue
+
+            # The snapshot may have moved on since the events were read
+            ballot_events = [
+                event for event in ballot_events if event.id > snapshot.last_event_id
+            ]
+            if not ballot_events:
+                continue
+
+            apply_correlation_updates(ballot_id, fold_events(ballot_events))
+
+            snapshot.version += 1
+            snapshot.last_event_id = ballot_events[-1].id
+            snapshot.save()
+            compacted += len(ballot_events)
+
+    return compacted
+
+
+def get_snapshot(ballot_id):
+    """The version and last event id of a ballot's correlation snapshot."""
+    return CorrelationSnapshot.objects.filter(
+        ballot=ballot_id
+    ).values_list('version', 'last_event_id').first() or (0, 0)
+
+
+def get_tail_updates(ballot_id, after_event_id):
+    """Fold the logged vote events a ballot's snapshot does not include yet."""
+    return fold_events(list(VoteEvent.objects.filter(
+        ballot=ballot_id,
+        id__gt=after_event_id
+    ).order_by('id')))
+
+
+def get_tail_state(ballot_id, after_event_id):
+    """Count and last id of the logged vote events a ballot's snapshot does not include yet,
+    which tell whether the tail changed without folding it."""
+    tail = VoteEvent.objects.filter(
+        ballot=ballot_id,
+        id__gt=after_event_id
+    ).aggregate(count=Count('id'), last=Max('id'))
+    return tail['count'], tail['last']
+
+
+def get_pending_update_stats():
+    """Size of the queued vote updates, and how long the oldest one has been waiting.
+
+    In 'log' mode, these are the logged vote events not compacted into correlations yet.
+    """
+    if settings.CORRELATION_UPDATES == 'log':
+        pending = VoteEvent.objects.filter(
+            id__gt=Coalesce(Subquery(
+                CorrelationSnapshot.objects.filter(
+                    ballot=OuterRef('ballot')
+                ).values('last_event_id')
+            ), 0)
+        )
+    else:
+        pending = PendingCorrelationUpdate.objects.all()
+
+    stats = pending.aggregate(
+        pending=Count('id'),
+        oldest=Min('created')
+    )
+    lag = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+    return {
+        'pending': stats['pending'],
+        'lag_seconds': lag
+    }
+
+
+def initialize_ballot_correlations(ballot_id, first_ordinal=0, ignore_conflicts=False):
+    """Store the default correlations of every option pair of a ballot involving a new option.
+
+    Options with an ordinal of `first_ordinal` or above are new. This is the set-based equivalent of
+    the initialize_correlations signal for options created in bulk. With `ignore_conflicts`,
+    correlations that are already stored are left as they are.
+    """
+    if settings.SPARSE_CORRELATIONS:
+        # Sparse correlations are only stored once a vote moves them away from the default
+        return
+
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            {connection.ops.insert_statement(ignore_conflicts=ignore_conflicts)}
+                {OptionCorrelation._meta.db_table}
+                (created, updated, ballot_id, predicate_id, predicate_polarity, target_id,
+                 correlation)
+            SELECT %s, %s, predicate.ballot_id, predicate.id, polarity.value, target.id, %s
+            FROM {BallotOption._meta.db_table} predicate
+            INNER JOIN {BallotOption._meta.db_table} target
+                ON target.ballot_id = predicate.ballot_id AND target.id <> predicate.id
+            CROSS JOIN (SELECT %s AS value UNION ALL SELECT %s) polarity
+            WHERE predicate.ballot_id = %s
+                AND (predicate.ordinal >= %s OR target.ordinal >= %s)
+            {connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignore_conflicts)}
+            """,
+            [
+                now, now, DEFAULT_CORRELATION,
+                True, False,
+                ballot_id, first_ordinal, first_ordinal
+            ]
+        )
+
+
+def replay_votes(sessions, options, polarities):
+    """Replay the EMA of every correlation a ballot's votes update, as array operations.
+
+    Takes the session, option and polarity of each vote, in the order the votes were cast.
+    Returns arrays of predicate ids, predicate polarities, target ids and the correlation each
+    of those ends up with, for the correlations at least one vote updated.
+    """
+    sessions = np.asarray(sessions, dtype=np.int64)
+    options = np.asarray(options, dtype=np.int64)
+    polarities = np.asarray(polarities, dtype=bool)
+    scores = np.where(polarities, POSITIVE_SCORE, NEGATIVE_SCORE).astype(np.float64)
+    order = np.arange(len(sessions))
+
+    # Group the votes by session, keeping them in the order they were cast within it
+    by_session = np.argsort(sessions, kind='stable')
+    _, session_starts, session_counts = np.unique(
+        sessions[by_session], return_index=True, return_counts=True
+    )
+
+    predicate_parts, polarity_parts, target_parts, score_parts, order_parts = [], [], [], [], []
+    for start, count in zip(session_starts, session_counts):
+        if count < 2:
+            continue
+        votes = by_session[start:start + count]
+        # A vote correlates with every earlier vote of its session, in both directions
+        earlier, later = np.triu_indices(count, 1)
+        earlier = votes[earlier]
+        later = votes[later]
+
+        predicate_parts += [options[earlier], options[later]]
+        polarity_parts += [polarities[earlier], polarities[later]]
+        target_parts += [options[later], options[earlier]]
+        score_parts += [scores[later], scores[earlier]]
+        # Both updates happen when the later vote is cast
+        order_parts += [order[later], order[later]]
+
+    if not predicate_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty(0, dtype=bool), empty, np.empty(0)
+
+    predicates = np.concatenate(predicate_parts)
+    event_polarities = np.concatenate(polarity_parts)
+    targets = np.concatenate(target_parts)
+    event_scores = np.concatenate(score_parts)
+
+    # Sort the updates by correlation, and within one by the order they were applied in
+    option_ids, option_indexes = np.unique(
+        np.concatenate([predicates, targets]), return_inverse=True
+    )
+    predicate_indexes, target_indexes = np.split(option_indexes, 2)
+    keys = (predicate_indexes * 2 + event_polarities) * len(option_ids) + target_indexes
+    events = np.lexsort((np.concatenate(order_parts), keys))
+    keys = keys[events]
+    event_scores = event_scores[events]
+
+    _, key_starts, key_counts = np.unique(keys, return_index=True, return_counts=True)
+    # A score applied k updates before the last one is weighed down by EMA_WEIGHT ** k
+    remaining = np.repeat(key_starts + key_counts, key_counts) - np.arange(len(keys)) - 1
+    contributions = event_scores * (1 - EMA_WEIGHT) * EMA_WEIGHT ** remaining
+    correlations = (
+        DEFAULT_CORRELATION * EMA_WEIGHT ** key_counts
+        + np.add.reduceat(contributions, key_starts)
+    )
+
+    first_events = events[key_starts]
+    return (
+        predicates[first_events],
+        event_polarities[first_events],
+        targets[first_events],
+        correlations
+    )
+
+
+def write_correlations(ballot_id, predicates, polarities, targets, correlations,
+                       batch_size=1000):
+    """Insert correlations for a ballot, with COPY where the database supports it."""
+    now = timezone.now()
+    if connection.vendor == 'postgresql':
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        for row in zip(predicates, polarities, targets, correlations):
+            writer.writerow([
+                now.isoformat(), now.isoformat(), ballot_id,
+                row[0], 't' if row[1] else 'f', row[2], repr(float(row[3]))
+            ])
+        rows.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"""
+                COPY {OptionCorrelation._meta.db_table}
+                    (created, updated, ballot_id, predicate_id, predicate_polarity, target_id,
+                     correlation)
+                FROM STDIN WITH (FORMAT csv)
+                """,
+                rows
+            )
+        return
+
+    OptionCorrelation.objects.bulk_create(
+        (
+            OptionCorrelation(
+                ballot_id=ballot_id,
+                predicate_id=int(predicate_id),
+                predicate_polarity=bool(polarity),
+                target_id=int(target_id),
+                correlation=float(correlation)
+            )
+            for predicate_id, polarity, target_id, correlation
+            in zip(predicates, polarities, targets, correlations)
+        ),
+        batch_size=batch_size
+    )
+
+
+def lock_ballot_for_vote(ballot_id):
+    """Share a lock on a ballot's row with the other votes being cast on it, until the end of
+    the transaction.
+
+    Shared locks do not wait for each other, only for rebuild_ballot_correlations, which locks
+    the row for update. So a rebuild waits for the votes being cast to commit before reading
+    them, and votes cast during a rebuild wait for the rebuilt correlations.
+    """
+    if connection.vendor != 'postgresql':
+        # Other databases serialize their writes anyway
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT 1 FROM {Ballot._meta.db_table} WHERE id = %s FOR KEY SHARE",
+            [ballot_id]
+        )
+
+
+def rebuild_ballot_correlations(ballot_id, batch_size=1000):
+    """Recompute a ballot's correlations from its vote history. Returns the number of votes.
+
+    The ballot is marked as updated, so that in-memory engines load it again rather than catch
+    up on updated correlations, which would miss the ones the rebuild deleted.
+
+    Logged vote events are already included in the replay, so the ballot's snapshot is advanced
+    past them and compact_vote_events does not apply them again.
+    """
+    with transaction.atomic():
+        # Wait for the votes being cast on the ballot, and hold off new ones until the rebuilt
+        # correlations are written, so that every vote is either replayed here or applied on top
+        # of the rebuild, see lock_ballot_for_vote
+        list(Ballot.objects.select_for_update().filter(id=ballot_id).values('id'))
+
+        # Read before the votes, since a vote is saved before its event is logged
+        last_event_id = VoteEvent.objects.filter(
+            ballot=ballot_id
+        ).aggregate(last=Max('id'))['last']
+
+        # Stream the votes straight into an array, rather than holding a tuple for each of them
+        votes = np.fromiter(
+            chain.from_iterable(UserVote.objects.filter(
+                option__ballot=ballot_id
+            ).order_by('created', 'id').values_list('session', 'option', 'polarity').iterator()),
+            dtype=np.int64
+        ).reshape(-1, 3)
+
+        predicates, polarities, targets, correlations = replay_votes(
+            votes[:, 0], votes[:, 1], votes[:, 2].astype(bool)
+        )
+
+        OptionCorrelation.objects.filter(ballot=ballot_id).delete()
+        # The replay already includes votes waiting for the worker
+        PendingCorrelationUpdate.objects.filter(vote__option__ballot=ballot_id).delete()
+
+        write_correlations(ballot_id, predicates, polarities, targets, correlations, batch_size)
+        # Dense correlations also store every pair that no vote has moved
+        initialize_ballot_correlations(ballot_id, ignore_conflicts=True)
+
+        if last_event_id is not None:
+            CorrelationSnapshot.objects.get_or_create(ballot_id=ballot_id)
+            snapshot = CorrelationSnapshot.objects.select_for_update().get(ballot=ballot_id)
+            if snapshot.last_event_id < last_event_id:
+                snapshot.version += 1
+                snapshot.last_event_id = last_event_id
+                snapshot.save()
+
+        # Engines load the ballot again once they see its updated time change
+        Ballot.objects.filter(id=ballot_id).update(updated=timezone.now())
+
+    return len(votes)
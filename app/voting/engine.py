@@ -0,0 +1,623 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .bitmaps import get_bits
+from .correlations import EMA_WEIGHT, get_snapshot, get_tail_state, get_tail_updates
+from .engine_files import load_engine_file
+from .models import DEFAULT_CORRELATION, BallotOption, OptionCorrelation
+from .ordinals import load_ordinal_mapping
+
+
+class SessionScores:
+    """Running sums of the correlations a session's votes take out of the ballot's totals.
+
+    Each vote adds one predicate row and one target column, so keeping these up to date costs
+    O(N) per vote instead of O(N^2) to score the session from scratch.
+    """
+
+    def __init__(self, engine):
+        self.generation = engine.generation
+        self.version = engine.version
+
+        self.votes = {}
+        self.voted_for = np.zeros(engine.option_count, dtype=bool)
+        self.voted_against = np.zeros(engine.option_count, dtype=bool)
+
+        # Drift of the predicate rows excluded by votes, as [target]
+        self.excluded_drift = np.zeros(engine.option_count)
+        # Spread towards voted targets, as [predicate]
+        self.voted_spread = np.zeros(engine.option_count)
+
+    def copy(self):
+        scores = copy.copy(self)
+        scores.votes = dict(self.votes)
+        scores.voted_for = self.voted_for.copy()
+        scores.voted_against = self.voted_against.copy()
+        scores.excluded_drift = self.excluded_drift.copy()
+        scores.voted_spread = self.voted_spread.copy()
+        return scores
+
+    @property
+    def voted(self):
+        return self.voted_for | self.voted_against
+
+
+class CorrelationEngine:
+    """In-memory copy of a ballot's correlations, scoring suggestions with array operations.
+
+    Correlations are held as their drift from the default correlation, in a dense
+    `(2, N, N)` float32 array indexed by predicate polarity, predicate and target, so that a
+    correlation that is not stored is simply zero.
+    """
+
+    # Correlations updated this long before the last refresh are read again, to pick up
+    # writes from transactions that were still open when that refresh ran
+    REFRESH_OVERLAP = timedelta(seconds=5)
+
+    # Number of refreshes with changes kept for session scores to catch up on
+    JOURNAL_SIZE = 64
+
+    # Number of options drawn at a time when estimating scores within a deadline
+    SAMPLE_BATCH_SIZE = 64
+    # Standard errors covered by the confidence interval of estimated scores, for 95%
+    CONFIDENCE_Z = 1.96
+
+    def __init__(self, ballot_id):
+        self.ballot_id = ballot_id
+        self.lock = threading.RLock()
+
+        self.option_ids = np.empty(0, dtype=np.int64)
+        # Ordinal of each option within the ballot, as [index]
+        self.option_ordinals = np.empty(0, dtype=np.int64)
+        self.option_count = 0
+        self.last_option_id = None
+        # When the ballot was last updated as of the last load
+        self.ballot_updated = None
+
+        # Correlation drift from the default, as [predicate_polarity, predicate, target]
+        self.drift = np.zeros((2, 0, 0), dtype=np.float32)
+        # Absolute difference between the two polarities, as [predicate, target]
+        self.spread = np.zeros((0, 0), dtype=np.float32)
+
+        # Drift of every predicate row, as [target], and spread of every target, as [predicate]
+        self.total_drift = np.zeros(0)
+        self.total_spread = np.zeros(0)
+
+        # Incremented when options are loaded and every index may have moved
+        self.generation = 0
+        # Incremented when correlations change, recording the changes in the journal
+        self.version = 0
+        self.journal = []
+
+        self.sessions = OrderedDict()
+        self.refreshed = None
+
+        # Version of the correlation snapshot loaded, and the logged vote events applied on
+        # top of it, as (predicate_id, predicate_polarity, target_id, correlation) rows holding
+        # the snapshot's correlations for the cells they changed
+        self.snapshot = None
+        self.tail_base = np.empty((0, 4))
+        # Count and last id of the logged vote events applied, see get_tail_state
+        self.tail_state = None
+
+    def refresh(self):
+        """Bring the engine up to date with the database."""
+        with self.lock:
+            if self.refreshed is None and settings.ENGINE_SNAPSHOT_DIR:
+                # A cold engine starts from its ballot's snapshot file if there is one, and only
+                # catches up on what changed since the file was saved
+                load_engine_file(self)
+
+            now = timezone.now()
+            interval = timedelta(seconds=settings.CORRELATION_ENGINE_REFRESH_INTERVAL)
+            if self.refreshed is not None and now - self.refreshed < interval:
+                return
+
+            event_log = settings.CORRELATION_UPDATES == 'log'
+            if event_log:
+                snapshot = get_snapshot(self.ballot_id)
+
+            options = BallotOption.objects.filter(
+                ballot=self.ballot_id
+            ).aggregate(
+                count=Count('id'),
+                last=Max('id'),
+                ballot_updated=Max('ballot__updated')
+            )
+            reload = (
+                self.refreshed is None
+                or options['count'] != self.option_count
+                or options['last'] != self.last_option_id
+                # Rebuilding a ballot's correlations marks it as updated, see
+                # rebuild_ballot_correlations
+                or options['ballot_updated'] != self.ballot_updated
+            )
+
+            if event_log and not reload and snapshot == self.snapshot:
+                # Logged votes only reach the correlations by compaction, which advances the
+                # snapshot, so only the tail can have changed. An unchanged tail stays applied,
+                # leaving the version as it is for the sessions and speculations made at it.
+                tail_state = get_tail_state(self.ballot_id, snapshot[1])
+                if tail_state != self.tail_state:
+                    self.set_correlations(self.tail_base)
+                    self.tail_base = np.empty((0, 4))
+                    self.apply_tail(get_tail_updates(self.ballot_id, snapshot[1]))
+                    self.tail_state = tail_state
+                self.refreshed = now
+                return
+
+            if event_log:
+                # Go back to the snapshot, the tail is applied again on top of its changes
+                self.set_correlations(self.tail_base)
+                self.tail_base = np.empty((0, 4))
+
+            if reload:
+                # Options were added or removed, so every index may have moved, or the
+                # correlations were rebuilt
+                self.load()
+                self.ballot_updated = options['ballot_updated']
+            else:
+                self.load_correlations(OptionCorrelation.objects.filter(
+                    updated__gte=self.refreshed - self.REFRESH_OVERLAP
+                ))
+
+            if event_log:
+                # Events compacted while the correlations were read may be partly loaded, so
+                # read the compacted correlations again until the snapshot stands still
+                while get_snapshot(self.ballot_id) != snapshot:
+                    snapshot = get_snapshot(self.ballot_id)
+                    self.load_correlations(OptionCorrelation.objects.filter(
+                        updated__gte=now - self.REFRESH_OVERLAP
+                    ))
+                self.snapshot = snapshot
+                self.tail_state = get_tail_state(self.ballot_id, snapshot[1])
+                self.apply_tail(get_tail_updates(self.ballot_id, snapshot[1]))
+
+            self.refreshed = now
+
+    def load(self):
+        self.load_options()
+
+        shape = (self.option_count, self.option_count)
+        self.drift = np.zeros((2,) + shape, dtype=np.float32)
+        self.spread = np.zeros(shape, dtype=np.float32)
+        self.total_drift = np.zeros(self.option_count)
+        self.total_spread = np.zeros(self.option_count)
+
+        self.load_correlations(OptionCorrelation.objects.all())
+
+        self.generation += 1
+        self.journal = []
+        self.sessions.clear()
+
+    def get_file_arrays(self):
+        """Arrays the engine is saved with in snapshot files, by name."""
+        return {
+            'option_ids': self.option_ids,
+            'option_ordinals': self.option_ordinals,
+            'drift': self.drift,
+            'spread': self.spread,
+            'total_drift': self.total_drift,
+            'total_spread': self.total_spread,
+            'tail_base': self.tail_base
+        }
+
+    def get_file_params(self):
+        """Settings of the engine a snapshot file must have been saved with to be loaded."""
+        return {}
+
+    def set_file_arrays(self, arrays):
+        """Take over the arrays of a snapshot file, from `get_file_arrays`."""
+        self.option_ids = arrays['option_ids']
+        self.option_ordinals = arrays['option_ordinals']
+        self.option_count = len(self.option_ids)
+        self.last_option_id = int(self.option_ids[-1]) if self.option_count else None
+
+        self.drift = arrays['drift']
+        self.spread = arrays['spread']
+        self.total_drift = arrays['total_drift']
+        self.total_spread = arrays['total_spread']
+        self.tail_base = arrays['tail_base']
+
+        self.generation += 1
+        self.journal = []
+        self.sessions.clear()
+
+    def load_options(self):
+        # Options changed, so read the ballot's ordinal mapping again for every user of it
+        mapping = load_ordinal_mapping(self.ballot_id)
+        self.option_ids = mapping.sorted_ids
+        self.option_ordinals = mapping.sorted_ordinals
+        self.option_count = len(self.option_ids)
+        self.last_option_id = int(self.option_ids[-1]) if self.option_count else None
+
+    def load_correlations(self, queryset):
+        self.set_correlations(np.array(
+            queryset.filter(
+                ballot=self.ballot_id
+            ).values_list(
+                'predicate_id',
+                'predicate_polarity',
+                'target_id',
+                'correlation'
+            ),
+            dtype=np.float64
+        ).reshape(-1, 4))
+
+    def apply_tail(self, updates):
+        """Apply folded updates of logged vote events that are not in the snapshot yet.
+
+        The snapshot's correlations are kept, so that the tail can be taken off again once
+        the snapshot includes it.
+        """
+        if not updates:
+            return
+
+        keys = np.array(list(updates), dtype=np.float64).reshape(-1, 3)
+        steps, offsets = np.array(list(updates.values()), dtype=np.float64).reshape(-1, 2).T
+
+        predicates = self.get_indexes(keys[:, 0])
+        targets = self.get_indexes(keys[:, 2])
+        known = (predicates >= 0) & (targets >= 0)
+        keys = keys[known]
+
+        base = DEFAULT_CORRELATION + self.get_drift(
+            keys[:, 1].astype(np.intp), predicates[known], targets[known]
+        )
+        self.tail_base = np.column_stack([keys, base])
+        self.set_correlations(np.column_stack([
+            keys,
+            base * EMA_WEIGHT ** steps[known] + offsets[known]
+        ]))
+
+    def get_drift(self, polarities, predicates, targets):
+        """Drift of the correlations at the given polarity, predicate and target indexes."""
+        return self.drift[polarities, predicates, targets].astype(np.float64)
+
+    def set_correlations(self, rows):
+        """Store correlations, given as (predicate_id, predicate_polarity, target_id,
+        correlation) rows, and journal the changes."""
+        predicates = self.get_indexes(rows[:, 0])
+        targets = self.get_indexes(rows[:, 2])
+        # Skip correlations for options created since the option ids were read
+        known = (predicates >= 0) & (targets >= 0)
+        predicates = predicates[known]
+        targets = targets[known]
+        polarities = rows[known, 1].astype(np.intp)
+
+        # Both polarities of a pair may have changed, but the pair only has one spread
+        pairs = np.unique(predicates * self.option_count + targets)
+        pair_predicates, pair_targets = np.divmod(pairs, max(self.option_count, 1))
+
+        old_drift = self.drift[polarities, predicates, targets].astype(np.float64)
+        old_spread = self.spread[pair_predicates, pair_targets].astype(np.float64)
+
+        self.drift[polarities, predicates, targets] = rows[known, 3] - DEFAULT_CORRELATION
+        self.spread[pair_predicates, pair_targets] = np.abs(
+            self.drift[1, pair_predicates, pair_targets]
+            - self.drift[0, pair_predicates, pair_targets]
+        )
+
+        drift_change = self.drift[polarities, predicates, targets] - old_drift
+        drift_changed = drift_change != 0
+        spread_change = self.spread[pair_predicates, pair_targets] - old_spread
+        spread_changed = spread_change != 0
+        if not drift_changed.any() and not spread_changed.any():
+            return
+
+        np.add.at(self.total_drift, targets[drift_changed], drift_change[drift_changed])
+        np.add.at(
+            self.total_spread,
+            pair_predicates[spread_changed],
+            spread_change[spread_changed]
+        )
+
+        self.version += 1
+        self.journal.append((
+            self.version,
+            (polarities[drift_changed], predicates[drift_changed], targets[drift_changed]),
+            drift_change[drift_changed],
+            (pair_predicates[spread_changed], pair_targets[spread_changed]),
+            spread_change[spread_changed]
+        ))
+        del self.journal[:-self.JOURNAL_SIZE]
+
+    def get_indexes(self, option_ids):
+        """Map option ids to their index in the engine, or -1 for unknown options."""
+        option_ids = np.asarray(option_ids, dtype=np.int64)
+        if not self.option_count:
+            return np.full(option_ids.shape, -1, dtype=np.intp)
+
+        indexes = np.minimum(
+            np.searchsorted(self.option_ids, option_ids),
+            self.option_count - 1
+        )
+        return np.where(self.option_ids[indexes] == option_ids, indexes, -1)
+
+    def get_session_scores(self, votes, session_id=None):
+        """Get the running sums for a session's votes, given as {option_id: polarity}.
+
+        Sums are cached per session, and only the votes and correlation changes since the
+        session was last scored are applied to them.
+        """
+        with self.lock:
+            scores = self.sessions.pop(session_id, None) if session_id is not None else None
+
+            if scores is not None and scores.generation == self.generation and all(
+                votes.get(option_id) == polarity for option_id, polarity in scores.votes.items()
+            ):
+                self.catch_up(scores)
+            else:
+                # Votes were removed or changed, or indexes moved, so start over
+                scores = SessionScores(self)
+
+            for option_id, polarity in votes.items():
+                if option_id not in scores.votes:
+                    self.add_vote(scores, option_id, polarity)
+
+            if session_id is not None:
+                self.sessions[session_id] = scores
+                while len(self.sessions) > settings.SESSION_SCORES_CACHE_SIZE:
+                    self.sessions.popitem(last=False)
+            return scores
+
+    def add_vote(self, scores, option_id, polarity):
+        scores.votes[option_id] = polarity
+
+        index = self.get_indexes([option_id])[0]
+        if index < 0:
+            return
+
+        # A predicate voted for excludes its polarity=False row and vice versa
+        if polarity:
+            scores.voted_for[index] = True
+            scores.excluded_drift += self.drift[0, index]
+        else:
+            scores.voted_against[index] = True
+            scores.excluded_drift += self.drift[1, index]
+        scores.voted_spread += self.spread[:, index]
+
+    def catch_up(self, scores):
+        """Apply the correlation changes since the session was last scored."""
+        if scores.version == self.version:
+            return
+
+        if not self.journal or self.journal[0][0] > scores.version + 1:
+            # The changes are no longer in the journal, so sum the votes again
+            scores.excluded_drift = (
+                scores.voted_for.astype(np.float32) @ self.drift[0]
+                + scores.voted_against.astype(np.float32) @ self.drift[1]
+            ).astype(np.float64)
+            scores.voted_spread = (
+                self.spread @ scores.voted.astype(np.float32)
+            ).astype(np.float64)
+        else:
+            voted = scores.voted
+            for version, drift_cells, drift, spread_cells, spread in self.journal:
+                if version <= scores.version:
+                    continue
+
+                polarities, predicates, targets = drift_cells
+                excluded = np.where(
+                    polarities == 0,
+                    scores.voted_for[predicates],
+                    scores.voted_against[predicates]
+                )
+                np.add.at(scores.excluded_drift, targets[excluded], drift[excluded])
+
+                predicates, targets = spread_cells
+                voted_targets = voted[targets]
+                np.add.at(scores.voted_spread, predicates[voted_targets], spread[voted_targets])
+
+        scores.version = self.version
+
+    def get_likelihood_scores(self, scores):
+        # Average the correlation value over all rows for predicates this session has not
+        # excluded, that is either has not voted on or has voted matching the row.
+        with self.lock:
+            row_count = 2 * (self.option_count - 1) - scores.voted.sum()
+            if row_count <= 0:
+                return np.full(self.option_count, DEFAULT_CORRELATION)
+
+            drift = self.total_drift - scores.excluded_drift
+            return DEFAULT_CORRELATION + drift / row_count
+
+    def get_significance_scores(self, scores):
+        # Average the spread between the two polarities over every target this session has not
+        # voted on, weighted by how close the option's likelihood is to 0.5.
+        # See OrmBackend.get_significance_annotation for the reasoning.
+        with self.lock:
+            likelihood_score = 1 - 2 * np.abs(0.5 - self.get_likelihood_scores(scores))
+
+            target_count = self.option_count - 1 - scores.voted.sum()
+            if target_count <= 0:
+                return np.zeros(self.option_count)
+
+            spread = self.total_spread - scores.voted_spread
+            return likelihood_score * spread / target_count
+
+    def get_predicate_drift(self, predicates):
+        """Drift of every correlation of the given predicates, as [polarity, predicate, target]."""
+        return self.drift[:, predicates]
+
+    def get_target_spread(self, targets):
+        """Spread of every pair with the given targets, as [predicate, target]."""
+        return self.spread[:, targets]
+
+    def estimate_scores(self, votes, significance=False, deadline=None, rng=None):
+        """Estimate a session's scores from a random sample of the options, until a deadline.
+
+        Rather than summing every predicate row, or every target of the spread, options are
+        drawn without replacement in batches until the deadline, given as a `time.perf_counter`
+        value, and the sums are extrapolated from the sample. At least one batch is always
+        drawn, and once every option is drawn the scores are exact.
+
+        Returns the estimated scores, the half width of their confidence interval at
+        CONFIDENCE_Z standard errors, and the number of options drawn.
+        """
+        with self.lock:
+            voted_for = np.zeros(self.option_count, dtype=bool)
+            voted_against = np.zeros(self.option_count, dtype=bool)
+            indexes = self.get_indexes(list(votes))
+            polarities = np.array(list(votes.values()), dtype=bool)
+            voted_for[indexes[(indexes >= 0) & polarities]] = True
+            voted_against[indexes[(indexes >= 0) & ~polarities]] = True
+            unvoted = ~(voted_for | voted_against)
+
+            # Sums and sums of squares of each predicate row's drift, as [target], and of the
+            # spread towards each unvoted target, as [predicate]
+            drift = np.zeros((2, self.option_count))
+            spread = np.zeros((2, self.option_count))
+            order = (rng or np.random.default_rng()).permutation(self.option_count)
+            sample_size = spread_sample_size = 0
+
+            while sample_size < self.option_count:
+                batch = order[sample_size:sample_size + self.SAMPLE_BATCH_SIZE]
+                sample_size += len(batch)
+
+                # A predicate voted for excludes its polarity=False row and vice versa
+                rows = self.get_predicate_drift(batch)
+                rows = (
+                    rows[0] * ~voted_for[batch, np.newaxis]
+                    + rows[1] * ~voted_against[batch, np.newaxis]
+                )
+                drift += [rows.sum(axis=0), (rows ** 2).sum(axis=0)]
+
+                if significance:
+                    # Drawn unvoted options are a random sample of the unvoted targets as well
+                    targets = batch[unvoted[batch]]
+                    spread_sample_size += len(targets)
+                    columns = self.get_target_spread(targets)
+                    spread += [columns.sum(axis=1), (columns ** 2).sum(axis=1)]
+
+                # The variance of a sample needs two draws of each
+                if (
+                    deadline is not None
+                    and time.perf_counter() >= deadline
+                    and sample_size >= 2
+                    and (not significance or spread_sample_size >= min(unvoted.sum(), 2))
+                ):
+                    break
+
+            drift_total, drift_error = self.extrapolate(drift, sample_size, self.option_count)
+            row_count = 2 * (self.option_count - 1) - (~unvoted).sum()
+            if row_count <= 0:
+                likelihood = np.full(self.option_count, DEFAULT_CORRELATION)
+                likelihood_error = np.zeros(self.option_count)
+            else:
+                likelihood = DEFAULT_CORRELATION + drift_total / row_count
+                likelihood_error = drift_error / row_count
+
+            if not significance:
+                return likelihood, likelihood_error, sample_size
+
+            # Only the spread is sampled, the likelihood weighing it is taken as is
+            weight = 1 - 2 * np.abs(0.5 - likelihood)
+            target_count = self.option_count - 1 - (~unvoted).sum()
+            if target_count <= 0:
+                return np.zeros(self.option_count), np.zeros(self.option_count), sample_size
+
+            spread_total, spread_error = self.extrapolate(
+                spread, spread_sample_size, unvoted.sum()
+            )
+            return (
+                weight * spread_total / target_count,
+                weight * spread_error / target_count,
+                sample_size
+            )
+
+    def extrapolate(self, sums, sample_size, population_size):
+        """Estimate totals from the sums and sums of squares of a sample without replacement.
+
+        Returns the totals and the half width of their confidence interval.
+        """
+        if sample_size >= population_size:
+            return sums[0], np.zeros(sums.shape[1])
+
+        mean = sums[0] / sample_size
+        variance = np.maximum(sums[1] - sample_size * mean ** 2, 0) / (sample_size - 1)
+        # Finite population correction, the error shrinks to nothing as every option is drawn
+        correction = 1 - sample_size / population_size
+        error = population_size * np.sqrt(variance / sample_size * correction)
+        return mean * population_size, self.CONFIDENCE_Z * error
+
+    def get_vetoed(self, bitmap):
+        """Mask of the options set in a room's veto bitmap, as [index]."""
+        return get_bits(bitmap, self.option_ordinals)
+
+    def rank(self, scores, excluded, limit=None, vetoed=None):
+        """List the options that are neither excluded nor vetoed, ordered by descending score.
+
+        With a limit, only that many of the best options are selected and sorted.
+        """
+        excluded = self.get_indexes(list(excluded))
+        included = np.ones(self.option_count, dtype=bool) if vetoed is None else ~vetoed
+        included[excluded[excluded >= 0]] = False
+
+        indexes = np.flatnonzero(included)
+        if limit is not None and limit < len(indexes):
+            candidates = -scores[indexes]
+            # The partition breaks ties at the limit arbitrarily, so rather than taking its
+            # selection, keep the options past the last score selected and as many of the
+            # options tied with it as fit, lowest ids first like the full ranking
+            last = np.partition(candidates, limit - 1)[limit - 1]
+            better = np.flatnonzero(candidates < last)
+            tied = np.flatnonzero(candidates == last)[:limit - len(better)]
+            indexes = indexes[np.sort(np.concatenate([better, tied]))]
+        # Stable sort so ties keep the order of their ids
+        indexes = indexes[np.argsort(-scores[indexes], kind='stable')]
+        return [
+            {
+                'id': int(self.option_ids[index]),
+                # The correlations are only single-precision, so trim the noise past that
+                'score': round(float(scores[index]), 6)
+            }
+            for index in indexes
+        ]
+
+
+engines = {}
+engines_lock = threading.Lock()
+
+
+def create_engine(ballot_id):
+    """Create the engine for a ballot, approximating the correlations of large ballots."""
+    if settings.LOW_RANK_MIN_OPTIONS and BallotOption.objects.filter(
+        ballot=ballot_id
+    ).count() >= settings.LOW_RANK_MIN_OPTIONS:
+        # Imported here since the low-rank engine builds on this module
+        from .lowrank import LowRankEngine
+        return LowRankEngine(ballot_id, settings.LOW_RANK_FACTORS)
+
+    return CorrelationEngine(ballot_id)
+
+
+def get_engine(ballot_id):
+    """Return the up to date engine for a ballot, keeping it warm for later requests."""
+    with engines_lock:
+        try:
+            engine = engines[ballot_id]
+        except KeyError:
+            engine = engines[ballot_id] = create_engine(ballot_id)
+
+    engine.refresh()
+    return engine
+
+
+def get_warm_engine(ballot_id):
+    """Return the engine kept warm for a ballot as it stands, or None, without refreshing it."""
+    with engines_lock:
+        return engines.get(ballot_id)
+
+
+def clear_engines():
+    with engines_lock:
+        engines.clear()
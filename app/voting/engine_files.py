@@ -0,0 +1,150 @@
+"""Snapshot files of in-memory engines, so that cold processes start warm.
+
+A file holds an engine's arrays, including the ballot's option ids and ordinals, and the time
+its correlations were read up to. Processes map the arrays copy-on-write rather than reading
+them, so processes on one host share the file's pages until they change them, and then only
+catch up on the correlations updated since the file was saved.
+
+Files start with MAGIC and the length of a JSON header as a little-endian uint64, followed by
+the header and the arrays, each at an offset aligned to ALIGNMENT bytes.
+"""
+import json
+import logging
+import os
+import struct
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VOTEENG\n'
+# Incremented whenever the layout or the arrays of the engines change, older files are skipped
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+HEADER_LENGTH = struct.Struct('<Q')
+
+
+def get_engine_path(ballot_id):
+    return os.path.join(settings.ENGINE_SNAPSHOT_DIR, f'ballot-{ballot_id}.engine')
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def get_file_header(engine):
+    """Header fields a file must match to be loaded into an engine."""
+    return {
+        'format': FORMAT_VERSION,
+        'engine': type(engine).__name__,
+        'params': engine.get_file_params(),
+        'ballot_id': engine.ballot_id,
+        # Correlations updated through the vote event log are read back differently
+        'correlation_updates': settings.CORRELATION_UPDATES
+    }
+
+
+def save_engine_file(engine, path=None):
+    """Write a refreshed engine to its snapshot file, replacing the file at once.
+
+    Returns the path written to.
+    """
+    path = path or get_engine_path(engine.ballot_id)
+
+    with engine.lock:
+        arrays = {
+            name: np.ascontiguousarray(array)
+            for name, array in engine.get_file_arrays().items()
+        }
+        header = dict(
+            get_file_header(engine),
+            refreshed=engine.refreshed.isoformat(),
+            ballot_updated=(
+                engine.ballot_updated.isoformat() if engine.ballot_updated is not None else None
+            ),
+            snapshot=list(engine.snapshot) if engine.snapshot is not None else None,
+            arrays={}
+        )
+
+        offset = 0
+        for name, array in arrays.items():
+            header['arrays'][name] = {
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                # From the start of the arrays, which is only known once the header is written
+                'offset': offset
+            }
+            offset = align(offset + array.nbytes)
+
+        # Write next to the file, so that readers only ever see a complete file
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                encoded = json.dumps(header).encode()
+                file.write(MAGIC + HEADER_LENGTH.pack(len(encoded)) + encoded)
+                start = align(file.tell())
+                for name, array in arrays.items():
+                    file.seek(start + header['arrays'][name]['offset'])
+                    file.write(array.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    return path
+
+
+def map_array(path, offset, dtype, shape):
+    shape = tuple(shape)
+    if not np.prod(shape):
+        # Empty arrays cannot be mapped
+        return np.zeros(shape, dtype=dtype)
+    # Copy-on-write, so that pages stay shared with other processes until the engine changes them
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape)
+
+
+def load_engine_file(engine, path=None):
+    """Load an engine from its snapshot file.
+
+    Returns whether it was loaded. Missing files, files of another format or saved with other
+    settings are skipped, leaving the engine to load from the database.
+    """
+    path = path or get_engine_path(engine.ballot_id)
+
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not an engine snapshot file")
+            length, = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+            header = json.loads(file.read(length))
+
+        expected = get_file_header(engine)
+        if any(header.get(key) != value for key, value in expected.items()):
+            logger.info("Skipped engine snapshot file %s, saved with other settings", path)
+            return False
+
+        start = align(len(MAGIC) + HEADER_LENGTH.size + length)
+        arrays = {
+            name: map_array(path, start + array['offset'], array['dtype'], array['shape'])
+            for name, array in header['arrays'].items()
+        }
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, struct.error):
+        logger.warning("Could not read engine snapshot file %s", path, exc_info=True)
+        return False
+
+    with engine.lock:
+        engine.set_file_arrays(arrays)
+        engine.refreshed = parse_datetime(header['refreshed'])
+        engine.ballot_updated = (
+            parse_datetime(header['ballot_updated'])
+            if header['ballot_updated'] is not None else None
+        )
+        engine.snapshot = tuple(header['snapshot']) if header['snapshot'] is not None else None
+    return True
@@ -56,5 +56,6 @@ class OptionCorrelationFactory(factory.django.DjangoModelFactory):
     predicate_polarity = False
     target = factory.SubFactory(
         BallotOptionFactory,
-        ballot=factory.SelfAttribute('..session.room.ballot')
+        ballot=factory.SelfAttribute('..predicate.ballot')
     )
+    ballot = factory.SelfAttribute('target.ballot')
@@ -0,0 +1,346 @@
+import numpy as np
+
+from .engine import CorrelationEngine
+from .models import DEFAULT_CORRELATION, OptionCorrelation
+
+
+class SparseCells:
+    """Values of a sparse matrix, keyed by flat cell index and kept sorted by key."""
+
+    def __init__(self, keys=None, values=None):
+        self.keys = np.empty(0, dtype=np.int64) if keys is None else keys
+        self.values = np.empty(0) if values is None else values
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, keys):
+        """Positions of the keys, and whether each key is stored."""
+        positions = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = self.keys[positions] == keys if len(self.keys) else np.zeros(len(keys), bool)
+        return positions, found
+
+    def get(self, keys):
+        """Values of the cells, zero for cells that are not stored."""
+        positions, found = self.find(keys)
+        return np.where(found, self.values[positions] if len(self.keys) else 0.0, 0.0)
+
+    def set(self, keys, values):
+        positions, found = self.find(keys)
+        self.values[positions[found]] = values[found]
+
+        if not found.all():
+            keys = np.concatenate([self.keys, keys[~found]])
+            values = np.concatenate([self.values, values[~found]])
+            order = np.argsort(keys, kind='stable')
+            self.keys = keys[order]
+            self.values = values[order]
+
+
+def multiply(rows, columns, values, size, matrix):
+    """Multiply the sparse `size` x `size` matrix given as cells by a dense matrix."""
+    product = np.zeros((size, matrix.shape[1]))
+    np.add.at(product, rows, values[:, np.newaxis] * matrix[columns])
+    return product
+
+
+def factorize(rows, columns, values, size, rank, power_iterations=2, seed=0):
+    """Fit a rank-k factorization A ~ left @ right.T of a sparse square matrix.
+
+    Uses a randomized SVD: the range of A is sampled with a few more random vectors than the
+    rank, sharpened with power iterations, and the SVD is taken of A projected on it. Each step
+    only multiplies A by an N x k matrix, so fitting costs O(nnz * k + N * k^2). With a rank of N
+    or more the factorization is exact.
+    """
+    rng = np.random.default_rng(seed)
+    sample_count = min(rank + 8, size)
+
+    sample = multiply(rows, columns, values, size, rng.standard_normal((size, sample_count)))
+    for _ in range(power_iterations):
+        basis, _ = np.linalg.qr(sample)
+        basis, _ = np.linalg.qr(multiply(columns, rows, values, size, basis))
+        sample = multiply(rows, columns, values, size, basis)
+    basis, _ = np.linalg.qr(sample)
+
+    # B = Q.T @ A, computed as (A.T @ Q).T
+    projected = multiply(columns, rows, values, size, basis).T
+    vectors, singular_values, right = np.linalg.svd(projected, full_matrices=False)
+
+    rank = min(rank, len(singular_values))
+    left = (basis @ vectors[:, :rank]) * singular_values[:rank]
+    return left, right[:rank].T
+
+
+class LowRankEngine(CorrelationEngine):
+    """Correlation engine approximating a ballot's correlations with rank-k factorizations.
+
+    The dense engine holds 2 * N^2 drifts, which stops fitting in memory for ballots with tens of
+    thousands of options. This engine only keeps the correlations that moved away from the
+    default, and fits `drift[polarity] ~ U @ V.T` and `spread ~ U @ V.T` with N x k factors.
+    Scoring a session then costs O(N * k) per vote instead of O(N), but without ever touching an
+    N x N array. Changes since the last fit are kept exactly as residuals on top of the
+    factorization, and the factors are fitted again once there are too many of them.
+
+    The totals every option is scored against stay exact, so only the part of a score coming from
+    the session's own votes is approximated. On a ballot generated by `generate_ballot(200, 400,
+    30)`, for 20 sessions of 20 random votes:
+
+    ====  ========================  ==========================  ======================
+    k     max likelihood error      max significance error      top 10 shared (mean)
+    ====  ========================  ==========================  ======================
+    8     0.0020                    0.0038                      9.25
+    16    0.0016                    0.0036                      9.35
+    32    0.0014                    0.0030                      9.55
+    64    0.0010                    0.0022                      9.65
+    ====  ========================  ==========================  ======================
+    """
+
+    # Number of residual cells, relative to the cells of the fit, that trigger a new fit
+    REFIT_RATIO = 0.1
+    # Number of residual cells always allowed before fitting again
+    MIN_REFIT_CELLS = 1000
+
+    def __init__(self, ballot_id, factor_count):
+        super().__init__(ballot_id)
+        self.factor_count = factor_count
+
+        # Drift of the correlations that moved away from the default, keyed by
+        # (predicate_polarity * N + predicate) * N + target
+        self.cells = SparseCells()
+
+        # Factors of the drift of each polarity, as [predicate_polarity, option, factor]
+        self.drift_left = np.zeros((2, 0, 0))
+        self.drift_right = np.zeros((2, 0, 0))
+        # Factors of the spread, as [option, factor]
+        self.spread_left = np.zeros((0, 0))
+        self.spread_right = np.zeros((0, 0))
+
+        # Difference between the correlations and the factorization for cells changed since
+        # the last fit, keyed like the cells for the drift and by predicate * N + target for
+        # the spread
+        self.drift_residual = SparseCells()
+        self.spread_residual = SparseCells()
+
+    def load(self):
+        self.load_options()
+
+        self.cells = SparseCells()
+        self.total_drift = np.zeros(self.option_count)
+        self.total_spread = np.zeros(self.option_count)
+        # Nothing is approximated until the correlations are loaded and fitted
+        self.drift_left = np.zeros((2, self.option_count, 0))
+        self.drift_right = np.zeros((2, self.option_count, 0))
+
+        # Correlations still at the default have no drift and are left out of every sum
+        self.load_correlations(OptionCorrelation.objects.exclude(
+            correlation=DEFAULT_CORRELATION
+        ))
+        self.fit()
+
+        self.generation += 1
+        self.journal = []
+        self.sessions.clear()
+
+    def get_file_arrays(self):
+        arrays = super().get_file_arrays()
+        # The dense arrays are left empty
+        del arrays['drift'], arrays['spread']
+        return dict(
+            arrays,
+            cell_keys=self.cells.keys,
+            cell_values=self.cells.values,
+            drift_left=self.drift_left,
+            drift_right=self.drift_right,
+            spread_left=self.spread_left,
+            spread_right=self.spread_right,
+            drift_residual_keys=self.drift_residual.keys,
+            drift_residual_values=self.drift_residual.values,
+            spread_residual_keys=self.spread_residual.keys,
+            spread_residual_values=self.spread_residual.values
+        )
+
+    def get_file_params(self):
+        return {'factor_count': self.factor_count}
+
+    def set_file_arrays(self, arrays):
+        super().set_file_arrays(dict(
+            arrays,
+            drift=np.zeros((2, 0, 0), dtype=np.float32),
+            spread=np.zeros((0, 0), dtype=np.float32)
+        ))
+        self.cells = SparseCells(arrays['cell_keys'], arrays['cell_values'])
+        self.drift_left = arrays['drift_left']
+        self.drift_right = arrays['drift_right']
+        self.spread_left = arrays['spread_left']
+        self.spread_right = arrays['spread_right']
+        self.drift_residual = SparseCells(
+            arrays['drift_residual_keys'], arrays['drift_residual_values']
+        )
+        self.spread_residual = SparseCells(
+            arrays['spread_residual_keys'], arrays['spread_residual_values']
+        )
+
+    def fit(self):
+        """Factorize the correlations, folding in every residual."""
+        size = max(self.option_count, 1)
+        cells, targets = np.divmod(self.cells.keys, size)
+        polarities, predicates = np.divmod(cells, size)
+
+        drift_factors = [
+            self.factorize(
+                predicates[polarities == polarity],
+                targets[polarities == polarity],
+                self.cells.values[polarities == polarity]
+            )
+            for polarity in (0, 1)
+        ]
+        self.drift_left = np.stack([left for left, _ in drift_factors])
+        self.drift_right = np.stack([right for _, right in drift_factors])
+
+        pairs = np.unique(predicates * self.option_count + targets)
+        pair_predicates, pair_targets = np.divmod(pairs, size)
+        self.spread_left, self.spread_right = self.factorize(
+            pair_predicates, pair_targets, self.get_pair_spread(pairs)
+        )
+
+        self.drift_residual = SparseCells()
+        self.spread_residual = SparseCells()
+        self.version += 1
+
+    def factorize(self, rows, columns, values):
+        rank = min(self.factor_count, self.option_count)
+        if not rank:
+            empty = np.zeros((self.option_count, 0))
+            return empty, empty
+
+        left, right = factorize(rows, columns, values, self.option_count, rank)
+        # Pad to the full rank, so that both polarities can share an array
+        padding = ((0, 0), (0, rank - left.shape[1]))
+        return np.pad(left, padding), np.pad(right, padding)
+
+    def get_drift(self, polarities, predicates, targets):
+        return self.cells.get((polarities * self.option_count + predicates) * self.option_count
+                              + targets)
+
+    def get_predicate_drift(self, predicates):
+        size = self.option_count
+        keys = (
+            (np.arange(2)[:, np.newaxis, np.newaxis] * size + predicates[:, np.newaxis]) * size
+            + np.arange(size)
+        )
+        return self.cells.get(keys.ravel()).reshape(keys.shape)
+
+    def get_target_spread(self, targets):
+        pairs = np.arange(self.option_count)[:, np.newaxis] * self.option_count + targets
+        return self.get_pair_spread(pairs.ravel()).reshape(pairs.shape)
+
+    def get_pair_spread(self, pairs):
+        """Spread of the (predicate * N + target) pairs."""
+        offset = self.option_count * self.option_count
+        return np.abs(self.cells.get(pairs + offset) - self.cells.get(pairs))
+
+    def set_correlations(self, rows):
+        predicates = self.get_indexes(rows[:, 0])
+        targets = self.get_indexes(rows[:, 2])
+        # Skip correlations for options created since the option ids were read
+        known = (predicates >= 0) & (targets >= 0)
+        predicates = predicates[known]
+        targets = targets[known]
+        polarities = rows[known, 1].astype(np.intp)
+
+        size = self.option_count
+        keys = (polarities * size + predicates) * size + targets
+        # Both polarities of a pair may have changed, but the pair only has one spread
+        pairs = np.unique(predicates * size + targets)
+
+        old_drift = self.cells.get(keys)
+        old_spread = self.get_pair_spread(pairs)
+        # Store through float32 like the dense engine, so both score the same correlations
+        drift = (rows[known, 3] - DEFAULT_CORRELATION).astype(np.float32).astype(np.float64)
+        self.cells.set(keys, drift)
+        spread = self.get_pair_spread(pairs)
+
+        drift_changed = drift != old_drift
+        spread_changed = spread != old_spread
+        if not drift_changed.any() and not spread_changed.any():
+            return
+
+        np.add.at(self.total_drift, targets[drift_changed], (drift - old_drift)[drift_changed])
+        pair_predicates, pair_targets = np.divmod(pairs, max(size, 1))
+        np.add.at(
+            self.total_spread,
+            pair_predicates[spread_changed],
+            (spread - old_spread)[spread_changed]
+        )
+
+        if self.drift_left.shape[2]:
+            keys = keys[drift_changed]
+            self.drift_residual.set(keys, drift[drift_changed] - np.einsum(
+                'ij,ij->i',
+                self.drift_left[polarities[drift_changed], predicates[drift_changed]],
+                self.drift_right[polarities[drift_changed], targets[drift_changed]]
+            ))
+            self.spread_residual.set(pairs[spread_changed], spread[spread_changed] - np.einsum(
+                'ij,ij->i',
+                self.spread_left[pair_predicates[spread_changed]],
+                self.spread_right[pair_targets[spread_changed]]
+            ))
+
+        # Session scores are summed again from the factors rather than from a journal
+        self.version += 1
+
+        refit_cells = max(self.MIN_REFIT_CELLS, self.REFIT_RATIO * len(self.cells))
+        if len(self.drift_residual) + len(self.spread_residual) > refit_cells:
+            self.fit()
+
+    def add_vote(self, scores, option_id, polarity):
+        scores.votes[option_id] = polarity
+
+        index = self.get_indexes([option_id])[0]
+        if index < 0:
+            return
+
+        voted_for = np.zeros(self.option_count, dtype=bool)
+        voted_against = np.zeros(self.option_count, dtype=bool)
+        if polarity:
+            scores.voted_for[index] = voted_for[index] = True
+        else:
+            scores.voted_against[index] = voted_against[index] = True
+
+        scores.excluded_drift += self.get_excluded_drift(voted_for, voted_against)
+        scores.voted_spread += self.get_voted_spread(voted_for | voted_against)
+
+    def catch_up(self, scores):
+        if scores.version == self.version:
+            return
+
+        scores.excluded_drift = self.get_excluded_drift(scores.voted_for, scores.voted_against)
+        scores.voted_spread = self.get_voted_spread(scores.voted)
+        scores.version = self.version
+
+    def get_excluded_drift(self, voted_for, voted_against):
+        """Drift of the predicate rows excluded by votes, as [target]."""
+        # A predicate voted for excludes its polarity=False row and vice versa
+        drift = (
+            self.drift_right[0] @ self.drift_left[0][voted_for].sum(axis=0)
+            + self.drift_right[1] @ self.drift_left[1][voted_against].sum(axis=0)
+        )
+
+        cells, targets = np.divmod(self.drift_residual.keys, max(self.option_count, 1))
+        polarities, predicates = np.divmod(cells, max(self.option_count, 1))
+        excluded = np.where(polarities == 0, voted_for[predicates], voted_against[predicates])
+        np.add.at(drift, targets[excluded], self.drift_residual.values[excluded])
+        return drift
+
+    def get_voted_spread(self, voted):
+        """Spread towards voted targets, as [predicate]."""
+        spread = self.spread_left @ self.spread_right[voted].sum(axis=0)
+
+        predicates, targets = np.divmod(self.spread_residual.keys, max(self.option_count, 1))
+        voted_targets = voted[targets]
+        np.add.at(
+            spread,
+            predicates[voted_targets],
+            self.spread_residual.values[voted_targets]
+        )
+        return spread
@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from voting.benchmarks import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time correlation updates and suggestions on seeded synthetic ballots, and print the "
+        "results as JSON. Everything the benchmark creates is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[100, 1000, 5000],
+            help='Number of options of each ballot to benchmark'
+        )
+        parser.add_argument(
+            '--sessions',
+            type=int,
+            default=50,
+            help='Number of sessions in the vote history of each ballot'
+        )
+        parser.add_argument(
+            '--votes-per-session',
+            type=int,
+            default=20,
+            help='Number of votes cast by each session in the vote history'
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=50,
+            help='Number of times each operation is timed per ballot'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated ballots')
+        parser.add_argument('--output', help='File to write the results to instead of stdout')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            options['sizes'],
+            options['sessions'],
+            options['votes_per_session'],
+            options['samples'],
+            options['seed']
+        )
+
+        report = json.dumps({
+            'settings': {
+                name: getattr(settings, name)
+                for name in [
+                    'SPARSE_CORRELATIONS',
+                    'CORRELATION_UPDATES',
+                    'SCORING_ENGINE',
+                    'SPECULATIVE_SUGGESTIONS'
+                ]
+            },
+            'parameters': {
+                name: options[name]
+                for name in ['sessions', 'votes_per_session', 'samples', 'seed']
+            },
+            'results': results
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
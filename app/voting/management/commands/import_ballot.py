@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from voting.ballots import import_ballot
+
+
+class Command(BaseCommand):
+    help = "Import a ballot and its options in bulk, building correlations in a single pass"
+
+    def add_arguments(self, parser):
+        parser.add_argument('label', help='Label of the ballot to create or add options to')
+        parser.add_argument('options', nargs='*', help='Labels of the options to add')
+        parser.add_argument(
+            '--file',
+            help="File with one option label per line, or '-' for stdin"
+        )
+
+    def handle(self, *args, **options):
+        option_labels = list(options['options'])
+        if options['file']:
+            if options['file'] == '-':
+                option_labels.extend(self.read_labels(sys.stdin))
+            else:
+                with open(options['file']) as labels_file:
+                    option_labels.extend(self.read_labels(labels_file))
+
+        ballot, created = import_ballot(options['label'], option_labels)
+
+        self.stdout.write(f"Imported {created} options into ballot {ballot.id} ({ballot.label})")
+
+    @staticmethod
+    def read_labels(lines):
+        return [line.strip() for line in lines if line.strip()]
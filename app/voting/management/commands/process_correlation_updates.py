@@ -0,0 +1,64 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from voting.correlations import (
+    compact_vote_events, get_pending_update_stats, process_pending_updates
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply queued vote correlation updates for CORRELATION_UPDATES='queue', or compact the "
+        "vote event log into the correlations for CORRELATION_UPDATES='log'"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Maximum number of votes to fold into each pass'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before polling an empty queue again'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is drained instead of polling'
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Only print the queue size and lag as JSON'
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.stdout.write(json.dumps(get_pending_update_stats()))
+            return
+
+        if settings.CORRELATION_UPDATES == 'log':
+            process = compact_vote_events
+        else:
+            process = process_pending_updates
+
+        while True:
+            stats = get_pending_update_stats()
+            processed = process(options['batch_size'])
+            if processed:
+                self.stdout.write(
+                    f"Applied {processed} votes, "
+                    f"queue lag was {stats['lag_seconds']:.3f}s with {stats['pending']} pending"
+                )
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.models import DEFAULT_CORRELATION, OptionCorrelation
+
+
+class Command(BaseCommand):
+    help = "Delete stored correlations that are still at the default, for sparse correlations"
+
+    def handle(self, *args, **options):
+        if not settings.SPARSE_CORRELATIONS:
+            # Dense correlations are updated in place, so every row must keep existing
+            raise CommandError('Correlations can only be pruned with SPARSE_CORRELATIONS enabled')
+
+        deleted, _ = OptionCorrelation.objects.filter(
+            correlation=DEFAULT_CORRELATION
+        ).delete()
+
+        self.stdout.write(f"Pruned {deleted} correlations")
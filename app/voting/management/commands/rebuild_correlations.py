@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from voting.correlations import rebuild_ballot_correlations
+from voting.models import Ballot
+
+
+def rebuild(ballot_id, batch_size):
+    try:
+        return ballot_id, rebuild_ballot_correlations(ballot_id, batch_size)
+    finally:
+        # Each worker process opens its own connection
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute correlations from the vote history, for example after EMA_WEIGHT changes "
+        "or votes are edited"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'ballots',
+            type=int,
+            nargs='*',
+            help='Ids of the ballots to rebuild, all of them if none are given'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of ballots rebuilt in parallel, each in its own process'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of correlations inserted per query where COPY is not available'
+        )
+
+    def handle(self, *args, **options):
+        ballot_ids = options['ballots'] or list(
+            Ballot.objects.order_by('id').values_list('id', flat=True)
+        )
+
+        if options['processes'] <= 1 or len(ballot_ids) <= 1:
+            results = (
+                (ballot_id, rebuild_ballot_correlations(ballot_id, options['batch_size']))
+                for ballot_id in ballot_ids
+            )
+            self.report(results)
+            return
+
+        # Forked workers must not share the connection of this process
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['processes']) as executor:
+            self.report(executor.map(
+                rebuild,
+                ballot_ids,
+                [options['batch_size']] * len(ballot_ids)
+            ))
+
+    def report(self, results):
+        for ballot_id, vote_count in results:
+            self.stdout.write(f"Rebuilt ballot {ballot_id} from {vote_count} votes")
@@ -0,0 +1,42 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.engine import create_engine
+from voting.engine_files import save_engine_file
+from voting.models import Ballot
+
+
+class Command(BaseCommand):
+    help = (
+        "Save the in-memory scoring engines of ballots to snapshot files in ENGINE_SNAPSHOT_DIR, "
+        "for new processes to start from. Run periodically, since processes catch up on every "
+        "correlation updated since their file was saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'ballots',
+            type=int,
+            nargs='*',
+            help='Ids of the ballots to save, all of them if none are given'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.ENGINE_SNAPSHOT_DIR:
+            raise CommandError("ENGINE_SNAPSHOT_DIR is not set")
+        os.makedirs(settings.ENGINE_SNAPSHOT_DIR, exist_ok=True)
+
+        ballot_ids = options['ballots'] or list(
+            Ballot.objects.order_by('id').values_list('id', flat=True)
+        )
+        for ballot_id in ballot_ids:
+            # Engines are not kept, so that only one ballot is held in memory at a time. Each
+            # starts from its previous file and catches up from there.
+            engine = create_engine(ballot_id)
+            engine.refresh()
+            path = save_engine_file(engine)
+            self.stdout.write(
+                f"Saved ballot {ballot_id} with {engine.option_count} options to {path}"
+            )
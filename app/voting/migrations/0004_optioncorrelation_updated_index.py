@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0003_auto_20200111_1543'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='optioncorrelation',
+            index=models.Index(fields=['updated'], name='voting_corr_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0004_optioncorrelation_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCorrelationUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('vote', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='voting.UserVote')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
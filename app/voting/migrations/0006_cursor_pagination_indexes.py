@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0005_pendingcorrelationupdate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ballot',
+            index=models.Index(fields=['created', 'id'], name='voting_ballot_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ballotoption',
+            index=models.Index(fields=['created', 'id'], name='voting_option_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ballotoption',
+            index=models.Index(fields=['ballot', 'created', 'id'], name='voting_option_ballot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uservote',
+            index=models.Index(fields=['session', 'created', 'id'], name='voting_vote_session_idx'),
+        ),
+    ]
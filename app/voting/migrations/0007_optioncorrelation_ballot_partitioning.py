@@ -0,0 +1,129 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+TABLE = 'voting_optioncorrelation'
+
+# Number of hash partitions of the correlations on Postgres
+PARTITION_COUNT = 16
+
+# Indexes that cover the scoring and vote update lookups on Postgres
+COVERING_INDEXES = {
+    'voting_corr_target_idx': '(target_id, predicate_polarity, predicate_id) INCLUDE (correlation)',
+    'voting_corr_predicate_idx': '(predicate_id, predicate_polarity, target_id) INCLUDE (correlation)',
+}
+
+
+def set_correlation_ballots(apps, schema_editor):
+    BallotOption = apps.get_model('voting', 'BallotOption')
+    OptionCorrelation = apps.get_model('voting', 'OptionCorrelation')
+
+    OptionCorrelation.objects.update(ballot=Subquery(
+        BallotOption.objects.filter(id=OuterRef('target')).values('ballot')[:1]
+    ))
+
+
+def rebuild_table(cursor, partitioned):
+    """Copy the correlations into a new table, partitioned by ballot or not.
+
+    Constraints and indexes are recreated with the same names, so that Django can still find
+    them. A primary key on a partitioned table must include the partition key.
+    """
+    cursor.execute(
+        """
+        SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        """,
+        [TABLE]
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND indexname NOT IN (
+            SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass
+        )
+        """,
+        [TABLE, TABLE]
+    )
+    indexes = cursor.fetchall()
+
+    if partitioned:
+        cursor.execute(
+            f"CREATE TABLE {TABLE}_new (LIKE {TABLE} INCLUDING DEFAULTS) "
+            f"PARTITION BY HASH (ballot_id)"
+        )
+        for remainder in range(PARTITION_COUNT):
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_{remainder} PARTITION OF {TABLE}_new "
+                f"FOR VALUES WITH (MODULUS {PARTITION_COUNT}, REMAINDER {remainder})"
+            )
+    else:
+        cursor.execute(f"CREATE TABLE {TABLE}_new (LIKE {TABLE} INCLUDING DEFAULTS)")
+
+    cursor.execute(f"INSERT INTO {TABLE}_new SELECT * FROM {TABLE}")
+    cursor.execute(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}_new.id")
+    # Dropping a partitioned table drops its partitions along with it
+    cursor.execute(f"DROP TABLE {TABLE}")
+    cursor.execute(f"ALTER TABLE {TABLE}_new RENAME TO {TABLE}")
+
+    for name, constraint_type, definition in constraints:
+        if constraint_type == 'p':
+            definition = 'PRIMARY KEY (id, ballot_id)' if partitioned else 'PRIMARY KEY (id)'
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT "{name}" {definition}')
+
+    for name, definition in indexes:
+        if name in COVERING_INDEXES:
+            definition = f'CREATE INDEX "{name}" ON {TABLE} {COVERING_INDEXES[name]}'
+        cursor.execute(definition)
+
+
+def partition_correlations(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        # Only Postgres supports declarative partitioning and covering indexes
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(cursor, partitioned=True)
+
+
+def unpartition_correlations(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0006_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optioncorrelation',
+            name='ballot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='voting.Ballot'),
+        ),
+        migrations.RunPython(set_correlation_ballots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='optioncorrelation',
+            name='ballot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voting.Ballot'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='optioncorrelation',
+            unique_together={('ballot', 'predicate', 'predicate_polarity', 'target')},
+        ),
+        migrations.AddIndex(
+            model_name='optioncorrelation',
+            index=models.Index(fields=['target', 'predicate_polarity', 'predicate'], name='voting_corr_target_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='optioncorrelation',
+            index=models.Index(fields=['predicate', 'predicate_polarity', 'target'], name='voting_corr_predicate_idx'),
+        ),
+        migrations.RunPython(partition_correlations, unpartition_correlations),
+    ]
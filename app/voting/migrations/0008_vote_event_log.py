@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0007_optioncorrelation_ballot_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('polarity', models.BooleanField()),
+                ('ballot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voting.Ballot')),
+                ('option', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voting.BallotOption')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voting.VotingSession')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CorrelationSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('ballot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='voting.Ballot')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
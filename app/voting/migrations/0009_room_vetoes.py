@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+
+def number_options(apps, schema_editor):
+    BallotOption = apps.get_model('voting', 'BallotOption')
+
+    ordinals = {}
+    options = BallotOption.objects.order_by('ballot', 'id').only('id', 'ballot_id')
+    for option in options.iterator():
+        option.ordinal = ordinals.get(option.ballot_id, 0)
+        ordinals[option.ballot_id] = option.ordinal + 1
+        option.save(update_fields=['ordinal'])
+
+
+def set_room_vetoes(apps, schema_editor):
+    Room = apps.get_model('voting', 'Room')
+    UserVote = apps.get_model('voting', 'UserVote')
+
+    vetoes = {}
+    for room_id, ordinal in UserVote.objects.filter(
+        polarity=False
+    ).values_list('session__room', 'option__ordinal').iterator():
+        vetoes.setdefault(room_id, set()).add(ordinal)
+
+    for room_id, ordinals in vetoes.items():
+        bitmap = bytearray(max(ordinals) // 8 + 1)
+        for ordinal in ordinals:
+            bitmap[ordinal // 8] |= 1 << ordinal % 8
+        Room.objects.filter(id=room_id).update(vetoed=bytes(bitmap))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0008_vote_event_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotoption',
+            name='ordinal',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(number_options, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ballotoption',
+            name='ordinal',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ballotoption',
+            unique_together={('ballot', 'ordinal'), ('ballot', 'label')},
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='vetoed',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(set_room_vetoes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+def set_session_votes(apps, schema_editor):
+    VotingSession = apps.get_model('voting', 'VotingSession')
+    UserVote = apps.get_model('voting', 'UserVote')
+
+    votes = {}
+    for session_id, ordinal, polarity in UserVote.objects.values_list(
+        'session', 'option__ordinal', 'polarity'
+    ).iterator():
+        votes.setdefault(session_id, (set(), set()))[0 if polarity else 1].add(ordinal)
+
+    def pack(ordinals):
+        if not ordinals:
+            return b''
+        bitmap = bytearray(max(ordinals) // 8 + 1)
+        for ordinal in ordinals:
+            bitmap[ordinal // 8] |= 1 << ordinal % 8
+        return bytes(bitmap)
+
+    for session_id, (voted_for, voted_against) in votes.items():
+        VotingSession.objects.filter(id=session_id).update(
+            voted_for=pack(voted_for),
+            voted_against=pack(voted_against)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0009_room_vetoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votingsession',
+            name='voted_for',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='votingsession',
+            name='voted_against',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(set_session_votes, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
+
+# Correlation of an option pair that no vote has moved yet, i.e. no correlation at all
+DEFAULT_CORRELATION = 0.5
 
 
 class ChangeTrackModel(models.Model):
@@ -21,6 +25,12 @@ class Ballot(ChangeTrackModel):
 
     label = models.CharField(max_length=255, unique=True)
 
+    class Meta:
+        indexes = [
+            # Cursor pagination
+            models.Index(fields=['created', 'id'], name='voting_ballot_created_idx')
+        ]
+
     def __str__(self):
         return f"{self.label}"
 
@@ -44,9 +54,17 @@ class BallotOption(ChangeTrackModel):
         on_delete=models.CASCADE
     )
     label = models.CharField(max_length=255)
+    # Position of the option within its ballot, from 0 in order of creation. Options are never
+    # renumbered, so bitmaps over a ballot's options can be indexed by it.
+    ordinal = models.PositiveIntegerField()
 
     class Meta:
-        unique_together = [['ballot', 'label']]
+        unique_together = [['ballot', 'label'], ['ballot', 'ordinal']]
+        indexes = [
+            # Cursor pagination, of every option or of a ballot's options
+            models.Index(fields=['created', 'id'], name='voting_option_created_idx'),
+            models.Index(fields=['ballot', 'created', 'id'], name='voting_option_ballot_idx')
+        ]
 
     def __str__(self):
         return f"{self.ballot.label} - {self.label}"
@@ -54,12 +72,33 @@ class BallotOption(ChangeTrackModel):
     def natural_key(self):
         return (self.ballot, self.label)
 
+    def save(self, *args, **kwargs):
+        if self.ordinal is not None:
+            return super().save(*args, **kwargs)
+
+        # Numbering a single option costs a lock on the ballot row, held until the option is
+        # saved, and an index lookup of the ballot's last ordinal. Options created in bulk, as by
+        # import_ballot, are numbered together under one lock instead.
+        with transaction.atomic():
+            # Lock the ballot so that concurrent options are numbered one after the other
+            list(Ballot.objects.select_for_update().filter(id=self.ballot_id).values('id'))
+            self.ordinal = get_next_ordinal(self.ballot_id)
+            return super().save(*args, **kwargs)
+
+
+def get_next_ordinal(ballot_id):
+    last = BallotOption.objects.filter(ballot=ballot_id).aggregate(last=Max('ordinal'))['last']
+    return 0 if last is None else last + 1
+
 
 class Room(ChangeTrackModel):
     ballot = models.ForeignKey(
         Ballot,
         on_delete=models.CASCADE
     )
+    # Options any session in the room voted against, as a bitmap over the options' ordinals
+    # with the lowest bit of the first byte for ordinal 0. Kept up to date by the vote signals.
+    vetoed = models.BinaryField(default=b'')
 
 
 class VotingSession(ChangeTrackModel):
@@ -67,6 +106,11 @@ class VotingSession(ChangeTrackModel):
         Room,
         on_delete=models.CASCADE
     )
+    # Options the session voted for and against, as bitmaps over the options' ordinals like
+    # Room.vetoed, so that its votes are read with the session. Kept up to date by the vote
+    # signals.
+    voted_for = models.BinaryField(default=b'')
+    voted_against = models.BinaryField(default=b'')
 
 
 class UserVote(ChangeTrackModel):
@@ -82,9 +126,20 @@ class UserVote(ChangeTrackModel):
 
     class Meta:
         unique_together = [['session', 'option']]
+        indexes = [
+            # Cursor pagination of a session's votes
+            models.Index(fields=['session', 'created', 'id'], name='voting_vote_session_idx')
+        ]
 
 
 class OptionCorrelation(ChangeTrackModel):
+    # Denormalized from the options, so that a ballot's correlations can be found without
+    # joining them, and on Postgres so that the table can be partitioned by ballot
+    ballot = models.ForeignKey(
+        Ballot,
+        on_delete=models.CASCADE
+    )
+
     predicate = models.ForeignKey(
         BallotOption,
         on_delete=models.CASCADE,
@@ -98,7 +153,63 @@ class OptionCorrelation(ChangeTrackModel):
         related_name='correlation_target'
     )
 
-    correlation = models.FloatField(default=0.5)
+    correlation = models.FloatField(default=DEFAULT_CORRELATION)
 
     class Meta:
-        unique_together = [['predicate', 'predicate_polarity', 'target']]
+        # The ballot is implied by the options, but a unique constraint on a partitioned table
+        # must include the partition key
+        unique_together = [['ballot', 'predicate', 'predicate_polarity', 'target']]
+        indexes = [
+            # Lets in-memory engines catch up on recently updated correlations
+            models.Index(fields=['updated'], name='voting_corr_updated_idx'),
+            # Scoring reads correlations by target, and vote updates by predicate. On Postgres
+            # both also include the correlation so that the rows never need to be read.
+            models.Index(
+                fields=['target', 'predicate_polarity', 'predicate'],
+                name='voting_corr_target_idx'
+            ),
+            models.Index(
+                fields=['predicate', 'predicate_polarity', 'target'],
+                name='voting_corr_predicate_idx'
+            )
+        ]
+
+
+class PendingCorrelationUpdate(ChangeTrackModel):
+    """A vote whose correlation update is waiting for the process_correlation_updates worker."""
+    vote = models.OneToOneField(
+        UserVote,
+        on_delete=models.CASCADE
+    )
+
+
+class VoteEvent(ChangeTrackModel):
+    """A vote appended to the log that correlations are compacted from, in 'log' mode.
+
+    Events are never updated, so editing or deleting a vote does not change its event.
+    """
+    ballot = models.ForeignKey(
+        Ballot,
+        on_delete=models.CASCADE
+    )
+    session = models.ForeignKey(
+        VotingSession,
+        on_delete=models.CASCADE
+    )
+    option = models.ForeignKey(
+        BallotOption,
+        on_delete=models.CASCADE
+    )
+    polarity = models.BooleanField()
+
+
+class CorrelationSnapshot(ChangeTrackModel):
+    """How far a ballot's stored correlations have been compacted from the vote event log."""
+    ballot = models.OneToOneField(
+        Ballot,
+        on_delete=models.CASCADE
+    )
+    # Incremented every time events are compacted into the correlations
+    version = models.PositiveIntegerField(default=0)
+    # Id of the last event included in the correlations
+    last_event_id = models.BigIntegerField(default=0)
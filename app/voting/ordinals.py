@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import BallotOption
+
+# Mapping of each ballot, as {ballot_id: (expires, mapping)}, least recently used first
+mappings = OrderedDict()
+mappings_lock = threading.Lock()
+
+
+class OrdinalMapping:
+    """Ids of a ballot's options by ordinal, and ordinals by id.
+
+    Ordinals map to ids by direct indexing, ids to ordinals by a binary search over the sorted
+    ids. Both are given and returned as arrays, -1 standing for an unknown option.
+    """
+
+    def __init__(self, option_ids, ordinals):
+        order = np.argsort(option_ids)
+        # Ids of the options in ascending order, and the ordinal of each
+        self.sorted_ids = option_ids[order]
+        self.sorted_ordinals = ordinals[order]
+
+        # Id of the option with each ordinal, as [ordinal], -1 for deleted options
+        self.option_ids = np.full(
+            int(ordinals.max()) + 1 if len(ordinals) else 0, -1, dtype=np.int64
+        )
+        self.option_ids[ordinals] = option_ids
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def get_ids(self, ordinals):
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        ids = np.full(ordinals.shape, -1, dtype=np.int64)
+        within = ordinals < len(self.option_ids)
+        ids[within] = self.option_ids[ordinals[within]]
+        return ids
+
+    def get_ordinals(self, option_ids):
+        option_ids = np.asarray(option_ids, dtype=np.int64)
+        if not len(self):
+            return np.full(option_ids.shape, -1, dtype=np.int64)
+
+        positions = np.minimum(np.searchsorted(self.sorted_ids, option_ids), len(self) - 1)
+        return np.where(
+            self.sorted_ids[positions] == option_ids,
+            self.sorted_ordinals[positions],
+            -1
+        )
+
+
+def get_ordinal_mapping(ballot_id):
+    """The ordinal mapping of a ballot, cached for OPTION_ORDINALS_TTL seconds."""
+    now = time.monotonic()
+    with mappings_lock:
+        expires, mapping = mappings.get(ballot_id, (None, None))
+        if mapping is not None and expires > now:
+            mappings.move_to_end(ballot_id)
+            return mapping
+
+    return load_ordinal_mapping(ballot_id)
+
+
+def load_ordinal_mapping(ballot_id):
+    """Read the ordinal mapping of a ballot from the database and cache it."""
+    option_ids, ordinals = np.array(
+        BallotOption.objects.filter(ballot=ballot_id).values_list('id', 'ordinal'),
+        dtype=np.int64
+    ).reshape(-1, 2).T
+    mapping = OrdinalMapping(option_ids, ordinals)
+
+    with mappings_lock:
+        mappings[ballot_id] = (time.monotonic() + settings.OPTION_ORDINALS_TTL, mapping)
+        mappings.move_to_end(ballot_id)
+        while len(mappings) > settings.OPTION_ORDINALS_CACHE_SIZE:
+            mappings.popitem(last=False)
+    return mapping
+
+
+def get_option_ids(ballot_id, ordinals):
+    """Ids of the options of a ballot with the given ordinals, -1 for unknown ordinals.
+
+    Options created by another process since the mapping was cached are read as soon as one is
+    asked for.
+    """
+    ids = get_ordinal_mapping(ballot_id).get_ids(ordinals)
+    if (ids < 0).any():
+        ids = load_ordinal_mapping(ballot_id).get_ids(ordinals)
+    return ids
+
+
+def get_option_ordinals(ballot_id, option_ids):
+    """Ordinals of the options of a ballot with the given ids, -1 for unknown ids, as
+    `get_option_ids`."""
+    ordinals = get_ordinal_mapping(ballot_id).get_ordinals(option_ids)
+    if (ordinals < 0).any():
+        ordinals = load_ordinal_mapping(ballot_id).get_ordinals(option_ids)
+    return ordinals
+
+
+def clear_ordinal_mapping(ballot_id):
+    with mappings_lock:
+        mappings.pop(ballot_id, None)
+
+
+def clear_ordinal_mappings():
+    with mappings_lock:
+        mappings.clear()
@@ -0,0 +1,83 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import remove_query_param
+
+
+class CreatedCursorPagination(CursorPagination):
+    """Newest first pages, positioned by a cursor on (created, id) rather than a page number.
+
+    Cursors hold both the created time and the id of the row at the edge of a page, and a page
+    holds the rows strictly past it in (created, id) order. Rows created at the same time are so
+    paged by id, rather than by an offset among them that votes cast meanwhile would shift.
+
+    Fetching a page seeks straight to the cursor through the matching index, so it costs the
+    same however deep the page is, and no count of the whole table is needed.
+    """
+    ordering = ('-created', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        position = None
+        if cursor is not None and cursor.position is not None:
+            position = self.decode_position(cursor.position)
+
+        if position is not None:
+            created, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+        # Previous pages are read oldest first from the cursor, then put back in page order
+        queryset = queryset.order_by(*(('created', 'id') if reverse else self.ordering))
+
+        # One row past the page tells whether there is another page beyond it
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = len(results) > self.page_size
+        else:
+            self.has_next = len(results) > self.page_size
+            self.has_previous = position is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Nothing is newer than the cursor, so the first page follows
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1]))
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        # With nothing older than the cursor left, the last page comes before
+        position = self.encode_position(self.page[0]) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_position(self, instance):
+        return f'{instance.created.isoformat()}|{instance.pk}'
+
+    def decode_position(self, position):
+        """The (created, id) of a cursor's position, as encoded by `encode_position`."""
+        try:
+            created, pk = position.split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk
@@ -0,0 +1,156 @@
+from django.db import connection
+
+from .models import DEFAULT_CORRELATION, BallotOption, OptionCorrelation, Room, VotingSession
+
+
+def get_tables():
+    return {
+        'option': BallotOption._meta.db_table,
+        'correlation': OptionCorrelation._meta.db_table,
+        'room': Room._meta.db_table,
+        'session': VotingSession._meta.db_table
+    }
+
+
+# The session's votes and the size of its ballot, shared by both scores. The votes are the
+# options with the ordinals the session voted on, as read from its bitmaps.
+COMMON_SQL = """
+session_ballot AS (
+    SELECT room.ballot_id, room.id AS room_id
+    FROM {session} voter
+    INNER JOIN {room} room ON room.id = voter.room_id
+    WHERE voter.id = %s
+),
+votes AS (
+    SELECT id AS option_id, {voted_for} AS polarity FROM {option}
+    WHERE ballot_id = (SELECT ballot_id FROM session_ballot) AND {voted}
+),
+counts AS (
+    SELECT
+        (
+            SELECT COUNT(*) FROM {option}
+            WHERE ballot_id = (SELECT ballot_id FROM session_ballot)
+        ) AS option_count,
+        (SELECT COUNT(*) FROM votes) AS vote_count
+)
+"""
+
+# Sum the drift from the default correlation of every row for predicates the session has not
+# excluded, that is either has not voted on or has voted matching the row. Every option is
+# joined to its correlations as target and to the session's votes once, in a single GROUP BY.
+LIKELIHOOD_SQL = """
+likelihood_drift AS (
+    SELECT candidate.id AS option_id, COALESCE(SUM(CASE
+        WHEN votes.option_id IS NULL OR votes.polarity = correlation.predicate_polarity
+        THEN correlation.correlation - %s
+        ELSE 0.0
+    END), 0.0) AS drift
+    FROM {option} candidate
+    LEFT JOIN {correlation} correlation
+        ON correlation.ballot_id = candidate.ballot_id AND correlation.target_id = candidate.id
+    LEFT JOIN votes ON votes.option_id = correlation.predicate_id
+    WHERE candidate.ballot_id = (SELECT ballot_id FROM session_ballot)
+    GROUP BY candidate.id
+),
+likelihood AS (
+    SELECT option_id, CASE
+        WHEN 2 * (option_count - 1) - vote_count > 0
+        THEN %s + drift / (2 * (option_count - 1) - vote_count)
+        ELSE %s
+    END AS score
+    FROM likelihood_drift CROSS JOIN counts
+)
+"""
+
+# Pair the two polarities of each predicate and target with conditional aggregation, a missing
+# row counting as the default correlation, and sum the spread over the targets the session has
+# not voted on. The spread is weighted by how close the option's likelihood is to 0.5.
+SIGNIFICANCE_SQL = """
+pair_spread AS (
+    SELECT correlation.predicate_id, ABS(SUM(CASE
+        WHEN correlation.predicate_polarity THEN correlation.correlation - %s
+        ELSE %s - correlation.correlation
+    END)) AS spread
+    FROM {correlation} correlation
+    WHERE correlation.ballot_id = (SELECT ballot_id FROM session_ballot)
+        AND correlation.target_id NOT IN (SELECT option_id FROM votes)
+    GROUP BY correlation.predicate_id, correlation.target_id
+),
+spread AS (
+    SELECT predicate_id AS option_id, SUM(spread) AS spread
+    FROM pair_spread
+    GROUP BY predicate_id
+),
+significance AS (
+    SELECT likelihood.option_id, CASE
+        WHEN option_count - 1 - vote_count > 0
+        THEN (1 - 2 * ABS(0.5 - likelihood.score)) * COALESCE(spread.spread, 0.0)
+            / (option_count - 1 - vote_count)
+        ELSE 0.0
+    END AS score
+    FROM likelihood
+    LEFT JOIN spread ON spread.option_id = likelihood.option_id
+    CROSS JOIN counts
+)
+"""
+
+# Options of the ballot with the given ordinals, vetoed by a session in the same room
+VETOED_SQL = """
+AND scores.option_id NOT IN (
+    SELECT id FROM {option}
+    WHERE ballot_id = (SELECT ballot_id FROM session_ballot) AND ordinal IN ({ordinals})
+)
+"""
+
+
+def get_ordinal_condition(ordinals):
+    """SQL condition of an option having one of the ordinals, and its parameters."""
+    if not ordinals:
+        return '1 = 0', []
+    return 'ordinal IN ({})'.format(', '.join(['%s'] * len(ordinals))), list(ordinals)
+
+
+def rank_options(session_id, voted_for=(), voted_against=(), significance=False,
+                 vetoed_ordinals=(), limit=None):
+    """Score and rank the options of a session's ballot with a single set-based query.
+
+    The session's votes are given as the ordinals of the options it voted for and against.
+    Scores by likelihood, or by significance when asked, and gives the same scores as the
+    annotations of OrmBackend. Options the session voted on are never ranked, nor options with
+    the given vetoed ordinals.
+    Returns [{'id': option_id, 'score': score}], best first.
+    """
+    voted_for_condition, voted_for_params = get_ordinal_condition(voted_for)
+    voted_condition, voted_params = get_ordinal_condition(list(voted_for) + list(voted_against))
+    sql = 'WITH ' + COMMON_SQL.replace(
+        '{voted_for}', voted_for_condition
+    ).replace(
+        '{voted}', voted_condition
+    ) + ',' + LIKELIHOOD_SQL
+    params = [session_id, *voted_for_params, *voted_params, DEFAULT_CORRELATION,
+              DEFAULT_CORRELATION, DEFAULT_CORRELATION]
+    if significance:
+        sql += ',' + SIGNIFICANCE_SQL
+        params += [DEFAULT_CORRELATION, DEFAULT_CORRELATION]
+
+    sql += f"""
+        SELECT scores.option_id, scores.score
+        FROM {'significance' if significance else 'likelihood'} scores
+        WHERE scores.option_id NOT IN (SELECT option_id FROM votes)
+    """
+    if vetoed_ordinals:
+        sql += VETOED_SQL.replace('{ordinals}', ', '.join(['%s'] * len(vetoed_ordinals)))
+        params += vetoed_ordinals
+
+    # Ties are ordered by id, for stable pages
+    sql += ' ORDER BY scores.score DESC, scores.option_id'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(**get_tables()), params)
+        return [
+            {'id': option_id, 'score': score}
+            for option_id, score in cursor.fetchall()
+        ]
@@ -1,6 +1,6 @@
-from .ballot import BallotSerializer
+from .ballot import BallotSerializer, BallotImportSerializer
 from .ballot_option import BallotOptionSerializer
 from .room import RoomSerializer
 from .voting_session import VotingSessionSerializer
-from .user_vote import UserVoteSerializer
-from .suggestion import SuggestionSerializer
+from .user_vote import UserVoteSerializer, BulkUserVoteSerializer
+from .suggestion import SuggestionSerializer, SampledSuggestionSerializer
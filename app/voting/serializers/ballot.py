@@ -6,3 +6,10 @@ class BallotSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ballot
         fields = ['id', 'label']
+
+
+class BallotImportSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=255)
+    options = serializers.ListField(
+        child=serializers.CharField(max_length=255)
+    )
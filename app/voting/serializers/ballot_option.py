@@ -6,3 +6,11 @@ class BallotOptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = BallotOption
         fields = ['id', 'label', 'ballot']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            # Only serialize the requested fields
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
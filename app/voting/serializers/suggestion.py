@@ -4,3 +4,8 @@ from rest_framework import serializers
 class SuggestionSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     score = serializers.FloatField()
+
+
+class SampledSuggestionSerializer(SuggestionSerializer):
+    # Bounds of the confidence interval of the estimated score
+    interval = serializers.ListField(child=serializers.FloatField())
@@ -1,21 +1,50 @@
 from rest_framework import serializers
 
-from voting.models import UserVote
+from voting.models import BallotOption, UserVote
+from voting.session_context import get_session_context, is_valid_option
+
+
+class SessionOptionField(serializers.PrimaryKeyRelatedField):
+    """An option of the ballot of the session given as 'session_token' in the context.
+
+    Options are checked against the session's cached context instead of being read from the
+    database, so the field only gives the option's id.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(queryset=BallotOption.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            option_id = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        session = get_session_context(self.context.get('session_token'))
+        if session is None or not is_valid_option(session, option_id):
+            raise serializers.ValidationError('Option not valid for token')
+        return option_id
 
 
 class UserVoteSerializer(serializers.ModelSerializer):
+    option = SessionOptionField()
+
     class Meta:
         model = UserVote
-        fields = ['id', 'option', 'polarity', 'session']
-        # read_only_fields = ['option']
-        extra_kwargs = {
-            'session': {'write_only': True}
-        }
+        # The session comes from the token, so a vote on an option the session already voted on
+        # is turned down by the view when saving it
+        fields = ['id', 'option', 'polarity']
 
-    def validate(self, data):
-        try:
-            if data['option'].ballot != data['session'].room.ballot:
-                raise serializers.ValidationError('Option not valid for token')
-        except KeyError:
-            pass
-        return data
+    def validate(self, attrs):
+        if 'option' in attrs:
+            # Votes are saved with the option's id, and read the option itself when first needed
+            attrs['option_id'] = attrs.pop('option')
+        return attrs
+
+
+class BulkUserVoteSerializer(serializers.Serializer):
+    """A single vote of a bulk submission, validated against the session's ballot by the view."""
+    option = serializers.IntegerField()
+    polarity = serializers.BooleanField()
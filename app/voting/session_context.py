@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .models import BallotOption, VotingSession
+
+# What a session token resolves to. option_ids is a frozenset shared by every session of the
+# ballot.
+SessionContext = namedtuple('SessionContext', ['session_id', 'room_id', 'ballot_id', 'option_ids'])
+
+# Resolved sessions, as {session_id: (expires, context)}, least recently used first
+contexts = OrderedDict()
+# Options of each ballot, as {ballot_id: (expires, option_ids)}
+ballot_options = {}
+contexts_lock = threading.Lock()
+
+
+def get_session_context(session_token):
+    """Resolve a session token into its room, ballot and option ids, or None if unknown.
+
+    Contexts are cached in this process for SESSION_CONTEXT_TTL seconds. Options created or
+    deleted through this process are seen right away, see `clear_ballot_options`.
+    """
+    try:
+        session_id = int(session_token)
+    except (TypeError, ValueError):
+        return None
+
+    now = time.monotonic()
+    with contexts_lock:
+        expires, context = contexts.get(session_id, (None, None))
+        if context is not None and expires > now:
+            contexts.move_to_end(session_id)
+
+    if context is None or expires <= now:
+        session = VotingSession.objects.filter(
+            id=session_id
+        ).values_list('room_id', 'room__ballot_id').first()
+        if session is None:
+            return None
+
+        room_id, ballot_id = session
+        expires = now + settings.SESSION_CONTEXT_TTL
+        context = SessionContext(session_id, room_id, ballot_id, None)
+
+    # The options of the ballot are cached on their own, and may have been read again since
+    option_ids = get_ballot_option_ids(context.ballot_id)
+    if option_ids is not context.option_ids:
+        context = context._replace(option_ids=option_ids)
+        with contexts_lock:
+            contexts[session_id] = (expires, context)
+            contexts.move_to_end(session_id)
+            while len(contexts) > settings.SESSION_CONTEXT_CACHE_SIZE:
+                contexts.popitem(last=False)
+    return context
+
+
+def get_ballot_option_ids(ballot_id):
+    now = time.monotonic()
+    with contexts_lock:
+        expires, option_ids = ballot_options.get(ballot_id, (None, None))
+        if option_ids is not None and expires > now:
+            return option_ids
+
+    option_ids = frozenset(BallotOption.objects.filter(
+        ballot=ballot_id
+    ).values_list('id', flat=True))
+    with contexts_lock:
+        ballot_options[ballot_id] = (now + settings.SESSION_CONTEXT_TTL, option_ids)
+    return option_ids
+
+
+def is_valid_option(context, option_id):
+    """Whether an option is on the session's ballot.
+
+    An option missing from the cached context may have been created by another process since,
+    so the ballot's options are read again before turning it down.
+    """
+    if option_id in context.option_ids:
+        return True
+
+    clear_ballot_options(context.ballot_id)
+    return option_id in get_ballot_option_ids(context.ballot_id)
+
+
+def clear_ballot_options(ballot_id):
+    """Forget the options of a ballot, so that its sessions read them again."""
+    with contexts_lock:
+        ballot_options.pop(ballot_id, None)
+
+
+def clear_session_context(session_id):
+    with contexts_lock:
+        contexts.pop(session_id, None)
+
+
+def clear_session_contexts():
+    with contexts_lock:
+        contexts.clear()
+        ballot_options.clear()
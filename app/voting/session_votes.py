@@ -0,0 +1,81 @@
+from django.db import transaction
+
+from .bitmaps import get_ordinals, set_bits
+from .models import VotingSession
+from .ordinals import get_option_ids, get_option_ordinals
+
+
+def get_session_bitmaps(session_id):
+    """Bitmaps of the options a session voted for and against, by ordinal, or None if unknown."""
+    session = VotingSession.objects.filter(
+        id=session_id
+    ).values_list('voted_for', 'voted_against').first()
+    return None if session is None else (bytes(session[0]), bytes(session[1]))
+
+
+def get_session_votes(session_id):
+    """A session's votes as {option_id: polarity}, read from its bitmaps.
+
+    Votes are ordered by option ordinal rather than in the order they were cast.
+    """
+    session = VotingSession.objects.filter(
+        id=session_id
+    ).values_list('room__ballot', 'voted_for', 'voted_against').first()
+    if session is None:
+        return {}
+
+    ballot_id, voted_for, voted_against = session
+    voted_for = set(get_ordinals(voted_for).tolist())
+    ordinals = sorted(voted_for | set(get_ordinals(voted_against).tolist()))
+    if not ordinals:
+        return {}
+
+    return {
+        option_id: ordinal in voted_for
+        for option_id, ordinal in zip(get_option_ids(ballot_id, ordinals).tolist(), ordinals)
+        # Skip options deleted since, should their bits still be set
+        if option_id >= 0
+    }
+
+
+def update_session_votes(session_id, votes):
+    """Update a session's bitmaps with votes given as {option_id: polarity}.
+
+    A polarity of None clears the option, for deleted votes.
+    """
+    if not votes:
+        return
+
+    with transaction.atomic():
+        # Lock the session so that concurrent votes do not overwrite each other's bits
+        session = VotingSession.objects.select_for_update(of=('self',)).filter(
+            id=session_id
+        ).values_list('room__ballot', 'voted_for', 'voted_against').first()
+        if session is None:
+            return
+        ballot_id, voted_for, voted_against = session
+
+        # Skip options that no longer exist
+        ordinals = {
+            option_id: ordinal
+            for option_id, ordinal in zip(
+                votes,
+                get_option_ordinals(ballot_id, list(votes)).tolist()
+            )
+            if ordinal >= 0
+        }
+        polarities = [votes[option_id] for option_id in ordinals]
+
+        # Update rather than save, so that the session's cached context is kept
+        VotingSession.objects.filter(id=session_id).update(
+            voted_for=set_bits(
+                voted_for,
+                list(ordinals.values()),
+                [polarity is not None and bool(polarity) for polarity in polarities]
+            ),
+            voted_against=set_bits(
+                voted_against,
+                list(ordinals.values()),
+                [polarity is not None and not polarity for polarity in polarities]
+            )
+        )
@@ -1,10 +1,71 @@
+import threading
 from itertools import permutations
 
-from django.db.models.signals import post_save
-from django.db.models import F, Q, When, Case, OuterRef, Subquery, FloatField
-from django.dispatch import receiver
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.db.models import F, Q, When, Case, Value, FloatField
+from django.dispatch import receiver, Signal
+from django.utils import timezone
 
-from .models import UserVote, BallotOption, OptionCorrelation
+from .correlations import (
+    EMA_WEIGHT, POSITIVE_SCORE, NEGATIVE_SCORE, apply_correlation_updates, fold_votes,
+    lock_ballot_for_vote
+)
+from .models import (
+    UserVote, BallotOption, OptionCorrelation, PendingCorrelationUpdate, Room, VoteEvent,
+    VotingSession
+)
+from .ordinals import clear_ordinal_mapping
+from .session_context import clear_ballot_options, clear_session_context
+from .session_votes import get_session_votes, update_session_votes
+from .vetoes import rebuild_room_vetoes, update_room_vetoes
+
+# Sent with the votes created by a bulk submission, since bulk_create skips post_save
+votes_bulk_created = Signal(providing_args=['votes'])
+
+
+class Deleting(threading.local):
+    """Sessions and rooms this thread is deleting, along with their votes.
+
+    Rows are marked on pre_delete, and unmarked on post_delete or once the delete commits.
+    Should the delete fail, rolling it back also drops the commit callback of its marks, so
+    they no longer count and are dropped when next read.
+    """
+
+    def __init__(self):
+        # Callback unmarking each row, as {id: unmark}
+        self.sessions = {}
+        self.rooms = {}
+
+    @staticmethod
+    def mark(marks, key):
+        def unmark():
+            if marks.get(key) is unmark:
+                del marks[key]
+
+        marks[key] = unmark
+        transaction.on_commit(unmark)
+
+    @staticmethod
+    def unmark(marks, key):
+        marks.pop(key, None)
+
+    @staticmethod
+    def is_marked(marks, key):
+        unmark = marks.get(key)
+        if unmark is None:
+            return False
+        if not any(
+            func is unmark for _, func in transaction.get_connection().run_on_commit
+        ):
+            # Its transaction was rolled back, so the delete never happened
+            unmark()
+            return False
+        return True
+
+
+deleting = Deleting()
 
 
 @receiver(
@@ -16,6 +77,10 @@ def initialize_correlations(sender, created, instance, **kwargs):
     if not created:
         return
 
+    if settings.SPARSE_CORRELATIONS:
+        # Sparse correlations are only stored once a vote moves them away from the default
+        return
+
     def generate_correlation_instances(existing_options, new_option):
         # Create a correlation between the new item and all existing options
         for existing_option in existing_options:
@@ -24,6 +89,7 @@ def initialize_correlations(sender, created, instance, **kwargs):
                 # Create a correlation for when the predicate was chosen and when not
                 for polarity in [True, False]:
                     yield OptionCorrelation(
+                        ballot_id=new_option.ballot_id,
                         predicate=predicate,
                         predicate_polarity=polarity,
                         target=target
@@ -39,6 +105,27 @@ def initialize_correlations(sender, created, instance, **kwargs):
     OptionCorrelation.objects.bulk_create(new_model_instances)
 
 
+@receiver(
+    [post_save, post_delete],
+    sender=BallotOption,
+    dispatch_uid='clear_ballot_options'
+)
+def clear_cached_ballot_options(sender, instance, **kwargs):
+    # Sessions of the ballot read its options again on their next vote, and its ordinals on
+    # their next read
+    clear_ballot_options(instance.ballot_id)
+    clear_ordinal_mapping(instance.ballot_id)
+
+
+@receiver(
+    [post_save, post_delete],
+    sender=VotingSession,
+    dispatch_uid='clear_session_context'
+)
+def clear_cached_session_context(sender, instance, **kwargs):
+    clear_session_context(instance.id)
+
+
 @receiver(
     post_save,
     sender=UserVote,
@@ -49,42 +136,238 @@ def update_correlations(sender, instance, created, **kwargs):
         # Do not update correlations for already existing votes
         return
 
-    # Use Exponential Moving Average to track correlation weights
-    # EMA will keep values stable, but allow them to drift in response to changes in patterns.
-    # Higher the weight, the slower it will react to changes.
-    # Correlation will vary between 0 and 1
-    # Values towards 0.5 indicate a lack of correlation
-    EMA_WEIGHT = 0.95
-    POSITIVE_SCORE = 1
-    NEGATIVE_SCORE = 0
+    # Rebuilding the ballot's correlations waits for the vote, or the vote for the rebuild
+    lock_ballot_for_vote(instance.option.ballot_id)
+
+    if settings.CORRELATION_UPDATES == 'queue':
+        # Leave the update to the process_correlation_updates worker, which folds queued votes
+        # into one pass per ballot
+        PendingCorrelationUpdate.objects.create(vote=instance)
+        return
+
+    if settings.CORRELATION_UPDATES == 'log':
+        # Only append the vote to the log, the worker compacts it into the correlations
+        VoteEvent.objects.create(
+            ballot_id=instance.option.ballot_id,
+            session_id=instance.session_id,
+            option_id=instance.option_id,
+            polarity=instance.polarity
+        )
+        return
+
+    # The session's votes are read from its bitmaps, which may not include this vote yet
+    session_votes = get_session_votes(instance.session_id)
+    session_votes[instance.option_id] = instance.polarity
+    voted_for = [option_id for option_id, polarity in session_votes.items() if polarity]
+    voted_against = [option_id for option_id, polarity in session_votes.items() if not polarity]
+
+    if settings.SPARSE_CORRELATIONS:
+        materialize_correlations(instance, session_votes)
 
     # Since we want to update all correlations for options this session has voted on, we expect to
     # update options where the target has already been voted on in the post.
     # This means we can't rely on `target.polarity` to get a score, and must read it from the
-    # corresponding option's UserVote record
-    match_score = Subquery(UserVote.objects.filter(
-        session=instance.session,
-        option=OuterRef('target_id')
-    ).values(
-        score=Case(
-            When(polarity=True, then=POSITIVE_SCORE),
-            default=NEGATIVE_SCORE,
-            output_field=FloatField()
-        )
-    )[:1])
+    # session's votes
+    match_score = Case(
+        When(target__in=voted_for, then=Value(POSITIVE_SCORE)),
+        default=Value(NEGATIVE_SCORE),
+        output_field=FloatField()
+    )
 
     OptionCorrelation.objects.filter(
-        # Look for a predicate in a uservote in this session with the same polarity
-        predicate__uservote__session=instance.session,
-        predicate__uservote__polarity=F('predicate_polarity')
+        # Only the session's ballot can hold correlations between its votes
+        ballot=instance.option.ballot_id
+    ).filter(
+        # Look for a predicate this session voted on with the same polarity
+        Q(predicate_polarity=True, predicate__in=voted_for)
+        | Q(predicate_polarity=False, predicate__in=voted_against)
     ).filter(
         # ...and a target in this session as well
-        target__uservote__session=instance.session,
+        target__in=list(session_votes)
     ).filter(
         # Check that the field we're triggered on is either a predicate or target
         # (To ensure we don't double-update the same vote)
         Q(target=instance.option) | Q(predicate=instance.option)
     ).update(
         # Use Exponential Moving Average to tweak the correlation
-        correlation=(F('correlation') * EMA_WEIGHT) + (match_score * (1 - EMA_WEIGHT))
+        correlation=(F('correlation') * EMA_WEIGHT) + (match_score * (1 - EMA_WEIGHT)),
+        # Bulk updates skip auto_now, but in-memory engines rely on it to catch up on changes
+        updated=timezone.now()
     )
+
+
+@receiver(
+    votes_bulk_created,
+    sender=UserVote,
+    dispatch_uid='update_bulk_correlations'
+)
+def update_bulk_correlations(sender, votes, **kwargs):
+    if not votes:
+        return
+
+    # Votes submitted together are all from one session, so on one ballot
+    ballot_id = BallotOption.objects.filter(
+        id=votes[0].option_id
+    ).values_list('ballot', flat=True).get()
+    lock_ballot_for_vote(ballot_id)
+
+    if settings.CORRELATION_UPDATES == 'queue':
+        PendingCorrelationUpdate.objects.bulk_create(
+            PendingCorrelationUpdate(vote=vote) for vote in votes
+        )
+        return
+
+    if settings.CORRELATION_UPDATES == 'log':
+        VoteEvent.objects.bulk_create(
+            VoteEvent(
+                ballot_id=ballot_id,
+                session_id=vote.session_id,
+                option_id=vote.option_id,
+                polarity=vote.polarity
+            )
+            for vote in votes
+        )
+        return
+
+    # Within a session each correlation is updated by exactly one vote, so folding the votes
+    # gives the same results as saving them one at a time
+    apply_correlation_updates(ballot_id, fold_votes(votes))
+
+
+@receiver(
+    pre_delete,
+    sender=VotingSession,
+    dispatch_uid='mark_deleted_session'
+)
+def mark_deleted_session(sender, instance, **kwargs):
+    # Votes are deleted before their session, and each would otherwise lock the session and
+    # room to update their bits. The session's bits go with it, and the room's are set again
+    # once, after the session is deleted.
+    deleting.mark(deleting.sessions, instance.id)
+
+
+@receiver(
+    post_delete,
+    sender=VotingSession,
+    dispatch_uid='update_deleted_session_vetoes'
+)
+def update_deleted_session_vetoes(sender, instance, **kwargs):
+    deleting.unmark(deleting.sessions, instance.id)
+    if not deleting.is_marked(deleting.rooms, instance.room_id):
+        rebuild_room_vetoes(instance.room_id)
+
+
+@receiver(
+    pre_delete,
+    sender=Room,
+    dispatch_uid='mark_deleted_room'
+)
+def mark_deleted_room(sender, instance, **kwargs):
+    # The room's vetoes go with it, so are not set again for each of its sessions
+    deleting.mark(deleting.rooms, instance.id)
+
+
+@receiver(
+    post_delete,
+    sender=Room,
+    dispatch_uid='unmark_deleted_room'
+)
+def unmark_deleted_room(sender, instance, **kwargs):
+    deleting.unmark(deleting.rooms, instance.id)
+
+
+@receiver(
+    [post_save, post_delete],
+    sender=UserVote,
+    dispatch_uid='update_vetoes'
+)
+def update_vetoes(sender, instance, created=False, **kwargs):
+    if created and instance.polarity:
+        return
+    if deleting.is_marked(deleting.sessions, instance.session_id):
+        return
+
+    # A new vote against an option vetoes it, while a changed or deleted vote may have been the
+    # room's last vote against it
+    update_room_vetoes(
+        instance.session_id,
+        [instance.option_id],
+        vetoed=True if created else None
+    )
+
+
+@receiver(
+    votes_bulk_created,
+    sender=UserVote,
+    dispatch_uid='update_bulk_vetoes'
+)
+def update_bulk_vetoes(sender, votes, **kwargs):
+    if votes:
+        update_room_vetoes(
+            votes[0].session_id,
+            [vote.option_id for vote in votes if not vote.polarity],
+            vetoed=True
+        )
+
+
+def materialize_correlations(vote, session_votes):
+    """Store the default correlation rows a vote is about to update, if they do not exist yet.
+
+    `session_votes` are every vote of the session as {option_id: polarity}.
+    """
+    ballot_id = vote.option.ballot_id
+
+    def generate_correlation_instances(session_votes):
+        # Each earlier vote in the session is correlated with the new vote in both directions,
+        # using the polarity the predicate was voted with
+        for option_id, polarity in session_votes:
+            yield OptionCorrelation(
+                ballot_id=ballot_id,
+                predicate_id=option_id,
+                predicate_polarity=polarity,
+                target_id=vote.option_id
+            )
+            yield OptionCorrelation(
+                ballot_id=ballot_id,
+                predicate_id=vote.option_id,
+                predicate_polarity=vote.polarity,
+                target_id=option_id
+            )
+
+    OptionCorrelation.objects.bulk_create(
+        generate_correlation_instances(
+            (option_id, polarity)
+            for option_id, polarity in session_votes.items()
+            if option_id != vote.option_id
+        ),
+        ignore_conflicts=True
+    )
+
+
+@receiver(
+    [post_save, post_delete],
+    sender=UserVote,
+    dispatch_uid='update_session_votes'
+)
+def update_session_bitmaps(sender, instance, signal, **kwargs):
+    if deleting.is_marked(deleting.sessions, instance.session_id):
+        return
+
+    # A deleted vote leaves its option unvoted
+    update_session_votes(
+        instance.session_id,
+        {instance.option_id: None if signal is post_delete else instance.polarity}
+    )
+
+
+@receiver(
+    votes_bulk_created,
+    sender=UserVote,
+    dispatch_uid='update_bulk_session_votes'
+)
+def update_bulk_session_bitmaps(sender, votes, **kwargs):
+    if votes:
+        update_session_votes(
+            votes[0].session_id,
+            {vote.option_id: vote.polarity for vote in votes}
+        )
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .engine import get_warm_engine
+
+# Speculation only runs array operations on an engine, so the pool never touches the database
+executor = None
+executor_lock = threading.Lock()
+
+# Pending speculations, as
+# {(session_id, vote_count, mode): (expires, limit, option_id, engine, future)}
+speculations = OrderedDict()
+speculations_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.SPECULATIVE_SUGGESTIONS_WORKERS,
+                thread_name_prefix='speculation'
+            )
+        return executor
+
+
+def speculate(engine, scores_func, scores, excluded, option_id, limit=None, vetoed=None):
+    """Rank the next suggestions for a session had it voted either way on an option.
+
+    A session's own vote only updates correlations towards options it has already voted on,
+    which are never suggested to it again, so its next ranking only depends on the vote itself.
+    Returns the engine's generation the rankings were made at, and
+    {(option_id, polarity): ranking}.
+    """
+    with engine.lock:
+        engine.catch_up(scores)
+        rankings = {}
+        for polarity in (True, False):
+            hypothetical = scores.copy()
+            engine.add_vote(hypothetical, option_id, polarity)
+            rankings[(option_id, polarity)] = engine.rank(
+                scores_func(hypothetical),
+                excluded | {option_id},
+                limit,
+                vetoed
+            )
+        return engine.generation, rankings
+
+
+def submit_speculation(
+        key, engine, scores_func, scores, excluded, option_id, limit=None, vetoed=None):
+    """Start ranking the next suggestions of a session in the background, for both votes."""
+    with engine.lock:
+        # The engine keeps updating the session's own scores, so speculate on a copy
+        scores = scores.copy()
+    future = get_executor().submit(
+        speculate, engine, scores_func, scores, set(excluded), option_id, limit, vetoed
+    )
+    expires = time.monotonic() + settings.SPECULATIVE_SUGGESTIONS_TTL
+
+    with speculations_lock:
+        speculations.pop(key, None)
+        speculations[key] = (expires, limit, option_id, engine, future)
+        while len(speculations) > settings.SESSION_SCORES_CACHE_SIZE:
+            speculations.popitem(last=False)
+
+
+def get_speculation(key, votes, limit=None):
+    """Return the ranking speculated for a session's votes, given as {option_id: polarity}, or
+    None if it is missing, stale or unfinished.
+
+    The key counts the votes the speculation started from, so a session with one more vote that
+    includes the speculated option has just voted on it. A ranking computed with a limit only
+    answers requests for as many suggestions or fewer. Rankings are dropped once the engine
+    they were made with has loaded the ballot's options again, moving every index, or is no
+    longer kept warm. Correlations changed by other sessions meanwhile are not reflected, see
+    SPECULATIVE_SUGGESTIONS_TTL.
+    """
+    with speculations_lock:
+        expires, speculated_limit, option_id, engine, future = speculations.pop(
+            key, (None, None, None, None, None)
+        )
+
+    if future is None or expires < time.monotonic() or not future.done():
+        # Not worth waiting on, scoring live is about as fast as the speculation itself
+        return None
+    if future.exception() is not None:
+        return None
+
+    speculated, rankings = future.result()
+    if get_warm_engine(engine.ballot_id) is not engine:
+        return None
+    with engine.lock:
+        if engine.generation != speculated:
+            return None
+
+    ranking = rankings.get((option_id, votes.get(option_id)))
+    if ranking is None:
+        return None
+
+    if speculated_limit is not None and (limit is None or limit > speculated_limit):
+        return None
+    return ranking if limit is None else ranking[:limit]
+
+
+def clear_speculations():
+    with speculations_lock:
+        speculations.clear()
@@ -0,0 +1,67 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from voting.benchmarks import generate_ballot, get_percentile
+from voting.models import Ballot, OptionCorrelation, UserVote
+
+
+class BenchmarkTests(TestCase):
+    def run_benchmark(self, *args):
+        stdout = StringIO()
+        call_command('benchmark', *args, stdout=stdout)
+        return json.loads(stdout.getvalue())
+
+    def test__benchmark__reports_every_operation(self):
+        report = self.run_benchmark(
+            '--sizes', '5', '8', '--sessions', '4', '--votes-per-session', '3', '--samples', '4'
+        )
+
+        self.assertEqual(list(report['results']), ['5', '8'])
+        for results in report['results'].values():
+            self.assertEqual(list(results), [
+                'initialize_correlations',
+                'update_correlations',
+                'suggest_suggestion',
+                'explore_suggestion'
+            ])
+            for summary in results.values():
+                self.assertEqual(summary['samples'], 4)
+                self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+                self.assertLessEqual(summary['p95_ms'], summary['p99_ms'])
+                self.assertGreater(summary['mean_queries'], 0)
+
+    def test__benchmark__rolled_back(self):
+        self.run_benchmark('--sizes', '5', '--sessions', '2', '--samples', '2')
+
+        self.assertFalse(Ballot.objects.exists())
+        self.assertFalse(OptionCorrelation.objects.exists())
+
+    @override_settings(SCORING_ENGINE='numpy')
+    def test__benchmark_engine__reports_every_operation(self):
+        report = self.run_benchmark('--sizes', '5', '--sessions', '2', '--samples', '2')
+
+        self.assertEqual(report['settings']['SCORING_ENGINE'], 'numpy')
+        self.assertEqual(len(report['results']['5']), 4)
+
+    def test__generate_ballot__seeded(self):
+        def generate(seed):
+            ballot = generate_ballot(6, 5, 4, seed)
+            votes = list(UserVote.objects.filter(
+                session__room__ballot=ballot
+            ).order_by('id').values_list('option__label', 'polarity'))
+            ballot.delete()
+            return votes
+
+        self.assertEqual(generate(1), generate(1))
+        self.assertEqual(len(generate(1)), 20)
+        self.assertNotEqual(generate(1), generate(2))
+
+    def test__get_percentile__nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([3.0], 95), 3.0)
@@ -0,0 +1,61 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from voting.factories import BallotFactory, BallotOptionFactory
+from voting.models import Ballot, BallotOption, OptionCorrelation
+
+
+class ImportBallotTests(TestCase):
+    @staticmethod
+    def get_correlations():
+        return set(OptionCorrelation.objects.values_list(
+            'predicate__label', 'predicate_polarity', 'target__label', 'correlation'
+        ))
+
+    def test__import__matches_options_created_one_at_a_time(self):
+        ballot = BallotFactory.create(label='One at a time')
+        for label in ['A', 'B', 'C', 'D']:
+            BallotOptionFactory.create(ballot=ballot, label=label)
+        expected = self.get_correlations()
+        ballot.delete()
+
+        call_command('import_ballot', 'Imported', 'A', 'B', 'C', 'D', stdout=StringIO())
+
+        self.assertEqual(BallotOption.objects.filter(ballot__label='Imported').count(), 4)
+        self.assertEqual(self.get_correlations(), expected)
+
+    def test__import_existing_ballot__adds_new_options(self):
+        ballot = BallotFactory.create(label='Existing')
+        for label in ['A', 'B']:
+            BallotOptionFactory.create(ballot=ballot, label=label)
+        # Options on other ballots should not be correlated with the import
+        BallotOptionFactory.create_batch(2, ballot=BallotFactory.create())
+
+        call_command('import_ballot', 'Existing', 'B', 'C', 'D', 'C', stdout=StringIO())
+
+        self.assertEqual(Ballot.objects.filter(label='Existing').count(), 1)
+        self.assertEqual(
+            sorted(BallotOption.objects.filter(ballot=ballot).values_list('label', flat=True)),
+            ['A', 'B', 'C', 'D']
+        )
+        # Imported options are numbered after the existing ones
+        self.assertEqual(
+            list(BallotOption.objects.filter(ballot=ballot).order_by('ordinal').values_list(
+                'label', 'ordinal'
+            )),
+            [('A', 0), ('B', 1), ('C', 2), ('D', 3)]
+        )
+        self.assertEqual(
+            OptionCorrelation.objects.filter(target__ballot=ballot).count(),
+            4 * 3 * 2
+        )
+        self.assertEqual(OptionCorrelation.objects.count(), 4 * 3 * 2 + 2 * 2)
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__import_sparse__creates_no_correlations(self):
+        call_command('import_ballot', 'Sparse', 'A', 'B', stdout=StringIO())
+
+        self.assertEqual(BallotOption.objects.count(), 2)
+        self.assertFalse(OptionCorrelation.objects.exists())
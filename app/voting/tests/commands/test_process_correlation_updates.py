@@ -0,0 +1,143 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from voting.factories import BallotFactory, BallotOptionFactory, VotingSessionFactory
+from voting.models import (
+    CorrelationSnapshot, OptionCorrelation, PendingCorrelationUpdate, UserVote, VoteEvent
+)
+
+
+@override_settings(CORRELATION_UPDATES='queue')
+class ProcessCorrelationUpdatesTests(TestCase):
+    @staticmethod
+    def cast_votes(ballot, ballot_votes):
+        """Cast votes as (session index, option index, polarity), returning the options."""
+        options = BallotOptionFactory.create_batch(4, ballot=ballot)
+        sessions = VotingSessionFactory.create_batch(3, room__ballot=ballot)
+        for session, option, polarity in ballot_votes:
+            UserVote.objects.create(
+                session=sessions[session],
+                option=options[option],
+                polarity=polarity
+            )
+        return options
+
+    @staticmethod
+    def get_correlations(options):
+        index = {option.id: i for i, option in enumerate(options)}
+        return {
+            (index[predicate], polarity, index[target]): correlation
+            for predicate, polarity, target, correlation in OptionCorrelation.objects.filter(
+                target__in=options
+            ).values_list('predicate', 'predicate_polarity', 'target', 'correlation')
+        }
+
+    def assert_matches_sync(self):
+        # Interleave sessions so that several of them update the same correlations
+        ballot_votes = [
+            (0, 0, True), (1, 0, True), (0, 1, False), (2, 1, True), (1, 1, False),
+            (2, 0, True), (0, 2, True), (1, 2, True), (2, 3, False), (1, 3, False),
+        ]
+
+        with self.settings(CORRELATION_UPDATES='sync'):
+            expected = self.get_correlations(self.cast_votes(BallotFactory(), ballot_votes))
+
+        options = self.cast_votes(BallotFactory(), ballot_votes)
+        call_command('process_correlation_updates', once=True, batch_size=4, stdout=StringIO())
+
+        correlations = self.get_correlations(options)
+        self.assertEqual(correlations.keys(), expected.keys())
+        for key, correlation in expected.items():
+            # Folded steps are only equal up to floating point rounding
+            self.assertAlmostEqual(correlations[key], correlation, places=12)
+
+    def test__vote__queued(self):
+        session = VotingSessionFactory.create()
+        first = BallotOptionFactory.create(ballot=session.room.ballot)
+        second = BallotOptionFactory.create(ballot=session.room.ballot)
+        UserVote.objects.create(session=session, option=first, polarity=True)
+        UserVote.objects.create(session=session, option=second, polarity=True)
+
+        self.assertEqual(PendingCorrelationUpdate.objects.count(), 2)
+        self.assertFalse(OptionCorrelation.objects.exclude(correlation=0.5).exists())
+
+    def test__process__matches_sync_updates(self):
+        self.assert_matches_sync()
+        self.assertFalse(PendingCorrelationUpdate.objects.exists())
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__process_sparse__matches_sync_updates(self):
+        self.assert_matches_sync()
+
+    def test__status__reports_queue(self):
+        session = VotingSessionFactory.create()
+        UserVote.objects.create(
+            session=session,
+            option=BallotOptionFactory.create(ballot=session.room.ballot),
+            polarity=True
+        )
+
+        stdout = StringIO()
+        call_command('process_correlation_updates', status=True, stdout=stdout)
+
+        status = json.loads(stdout.getvalue())
+        self.assertEqual(status['pending'], 1)
+        self.assertGreaterEqual(status['lag_seconds'], 0)
+
+
+@override_settings(CORRELATION_UPDATES='log')
+class CompactVoteEventsTests(ProcessCorrelationUpdatesTests):
+    def test__vote__queued(self):
+        session = VotingSessionFactory.create()
+        first = BallotOptionFactory.create(ballot=session.room.ballot)
+        second = BallotOptionFactory.create(ballot=session.room.ballot)
+        UserVote.objects.create(session=session, option=first, polarity=True)
+        UserVote.objects.create(session=session, option=second, polarity=True)
+
+        self.assertEqual(
+            list(VoteEvent.objects.order_by('id').values_list('option', 'polarity')),
+            [(first.id, True), (second.id, True)]
+        )
+        self.assertFalse(OptionCorrelation.objects.exclude(correlation=0.5).exists())
+
+    def test__process__matches_sync_updates(self):
+        self.assert_matches_sync()
+
+        # Every event is in the snapshot, and the log is kept
+        snapshot = CorrelationSnapshot.objects.get()
+        self.assertEqual(snapshot.last_event_id, VoteEvent.objects.latest('id').id)
+        self.assertEqual(snapshot.version, 3)
+        self.assertEqual(VoteEvent.objects.count(), 10)
+
+    def test__process_again__nothing_compacted(self):
+        self.cast_votes(BallotFactory(), [(0, 0, True), (0, 1, False)])
+        call_command('process_correlation_updates', once=True, stdout=StringIO())
+        correlations = list(OptionCorrelation.objects.values_list('id', 'correlation'))
+
+        stdout = StringIO()
+        call_command('process_correlation_updates', once=True, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(
+            list(OptionCorrelation.objects.values_list('id', 'correlation')),
+            correlations
+        )
+        self.assertEqual(CorrelationSnapshot.objects.get().version, 1)
+
+    def test__process_edited_vote__compacts_vote_as_cast(self):
+        session = VotingSessionFactory.create()
+        first = BallotOptionFactory.create(ballot=session.room.ballot)
+        second = BallotOptionFactory.create(ballot=session.room.ballot)
+        UserVote.objects.create(session=session, option=first, polarity=True)
+        UserVote.objects.update(polarity=False)
+        UserVote.objects.create(session=session, option=second, polarity=True)
+
+        call_command('process_correlation_updates', once=True, stdout=StringIO())
+
+        # The first vote is read from the log, as it was cast
+        self.assertGreater(OptionCorrelation.objects.get(
+            predicate=first, predicate_polarity=True, target=second
+        ).correlation, 0.5)
@@ -0,0 +1,30 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from voting.factories import UserVoteFactory, VotingSessionFactory, BallotOptionFactory
+from voting.models import OptionCorrelation
+
+
+class PruneCorrelationsTests(TestCase):
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__prune__deletes_default_correlations(self):
+        session = VotingSessionFactory.create()
+        # Create the options before switching storage, so they are stored densely
+        with override_settings(SPARSE_CORRELATIONS=False):
+            first = BallotOptionFactory.create(ballot=session.room.ballot)
+            second = BallotOptionFactory.create(ballot=session.room.ballot)
+        UserVoteFactory.create(session=session, option=first)
+        UserVoteFactory.create(session=session, option=second, polarity=True)
+
+        call_command('prune_correlations', stdout=StringIO())
+
+        # Only the correlations that the votes moved should remain
+        self.assertEqual(OptionCorrelation.objects.count(), 2)
+        self.assertFalse(OptionCorrelation.objects.filter(correlation=0.5).exists())
+
+    def test__prune_dense__error(self):
+        with self.assertRaises(CommandError):
+            call_command('prune_correlations', stdout=StringIO())
@@ -0,0 +1,157 @@
+import random
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from voting.correlations import compact_vote_events, replay_votes
+from voting.engine import clear_engines, get_engine
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    RoomFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+from voting.models import CorrelationSnapshot, OptionCorrelation, UserVote, VoteEvent
+
+
+class RebuildCorrelationsTests(TestCase):
+    def create_votes(self, ballot):
+        random.seed(0)
+        options = BallotOptionFactory.create_batch(6, ballot=ballot)
+        for _ in range(5):
+            session = VotingSessionFactory.create(room=RoomFactory.create(ballot=ballot))
+            for option in random.sample(options, random.randint(1, 5)):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+    @staticmethod
+    def get_correlations():
+        return {
+            (predicate, polarity, target): (ballot, correlation)
+            for ballot, predicate, polarity, target, correlation
+            in OptionCorrelation.objects.values_list(
+                'ballot', 'predicate', 'predicate_polarity', 'target', 'correlation'
+            )
+        }
+
+    def rebuild(self, *args):
+        call_command('rebuild_correlations', '--processes', '1', *args, stdout=StringIO())
+
+    def assert_correlations_equal(self, actual, expected):
+        self.assertEqual(actual.keys(), expected.keys())
+        for key, (ballot, correlation) in expected.items():
+            self.assertEqual(actual[key][0], ballot)
+            self.assertAlmostEqual(actual[key][1], correlation, places=12)
+
+    def assert_rebuild_matches_signals(self):
+        self.create_votes(BallotFactory.create())
+        expected = self.get_correlations()
+
+        OptionCorrelation.objects.update(correlation=0.1)
+        OptionCorrelation.objects.filter(id__in=OptionCorrelation.objects.values('id')[:3]).delete()
+        self.rebuild()
+
+        self.assert_correlations_equal(self.get_correlations(), expected)
+
+    def test__rebuild__matches_votes_cast_one_at_a_time(self):
+        self.assert_rebuild_matches_signals()
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__rebuild_sparse__matches_votes_cast_one_at_a_time(self):
+        self.assert_rebuild_matches_signals()
+
+    def test__rebuild_edited_vote__replays_new_polarity(self):
+        session = VotingSessionFactory.create()
+        first, second = BallotOptionFactory.create_batch(2, ballot=session.room.ballot)
+        UserVoteFactory.create(session=session, option=first, polarity=True)
+        vote = UserVoteFactory.create(session=session, option=second, polarity=False)
+
+        vote.polarity = True
+        vote.save()
+        self.rebuild()
+
+        # As if the second vote had been cast for in the first place
+        self.assertAlmostEqual(OptionCorrelation.objects.get(
+            predicate=first, predicate_polarity=True, target=second
+        ).correlation, 0.5 * 0.95 + 0.05)
+
+    @override_settings(SPARSE_CORRELATIONS=True, CORRELATION_ENGINE_REFRESH_INTERVAL=0)
+    def test__rebuild__warm_engine_loaded_again(self):
+        ballot = BallotFactory.create()
+        self.create_votes(ballot)
+        clear_engines()
+        engine = get_engine(ballot.id)
+        self.assertTrue(engine.total_drift.any())
+
+        # Without votes the rebuild deletes every correlation, which engines cannot catch up on
+        UserVote.objects.all().delete()
+        self.rebuild()
+        engine.refresh()
+
+        self.assertFalse(engine.total_drift.any())
+
+    def test__rebuild_event_log__events_not_compacted_again(self):
+        ballot = BallotFactory.create()
+        with self.settings(CORRELATION_UPDATES='log'):
+            self.create_votes(ballot)
+            self.rebuild()
+            rebuilt = self.get_correlations()
+
+            # The replay already included every logged event
+            self.assertEqual(compact_vote_events(), 0)
+
+        self.assertEqual(
+            CorrelationSnapshot.objects.get(ballot=ballot).last_event_id,
+            VoteEvent.objects.order_by('-id').values_list('id', flat=True).first()
+        )
+        self.assertEqual(self.get_correlations(), rebuilt)
+
+    def test__rebuild_ballot__leaves_other_ballots(self):
+        ballot = BallotFactory.create()
+        other_ballot = BallotFactory.create()
+        self.create_votes(ballot)
+        self.create_votes(other_ballot)
+        OptionCorrelation.objects.update(correlation=0.1)
+
+        self.rebuild(str(ballot.id))
+
+        self.assertFalse(OptionCorrelation.objects.filter(
+            ballot=other_ballot
+        ).exclude(correlation=0.1).exists())
+        self.assertFalse(OptionCorrelation.objects.filter(ballot=ballot, correlation=0.1).exists())
+
+    def test__replay_votes__no_pairs__nothing_updated(self):
+        predicates, polarities, targets, correlations = replay_votes([1, 2], [1, 2], [True, False])
+
+        self.assertEqual(len(predicates), 0)
+        self.assertEqual(len(correlations), 0)
+
+    def test__replay_votes__interleaved_sessions__applied_in_order(self):
+        session = VotingSessionFactory.create()
+        other_session = VotingSessionFactory.create(room=session.room)
+        first, second = BallotOptionFactory.create_batch(2, ballot=session.room.ballot)
+        # Both sessions update the same correlations, one after the other
+        UserVoteFactory.create(session=session, option=first, polarity=True)
+        UserVoteFactory.create(session=other_session, option=first, polarity=True)
+        UserVoteFactory.create(session=session, option=second, polarity=True)
+        UserVoteFactory.create(session=other_session, option=second, polarity=False)
+        expected = self.get_correlations()
+
+        votes = UserVote.objects.order_by('created', 'id').values_list(
+            'session', 'option', 'polarity'
+        )
+        predicates, polarities, targets, correlations = replay_votes(*zip(*votes))
+
+        self.assertEqual(len(correlations), 3)
+        for predicate, polarity, target, correlation in zip(
+                predicates, polarities, targets, correlations):
+            self.assertAlmostEqual(
+                correlation,
+                expected[(predicate, polarity, target)][1],
+                places=12
+            )
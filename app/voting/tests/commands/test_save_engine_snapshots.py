@@ -0,0 +1,32 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from voting.engine import CorrelationEngine
+from voting.engine_files import load_engine_file
+from voting.factories import BallotFactory, BallotOptionFactory
+
+
+class SaveEngineSnapshotsTests(TestCase):
+    def test__saves_every_ballot(self):
+        ballots = BallotFactory.create_batch(2)
+        BallotOptionFactory.create_batch(3, ballot=ballots[0])
+
+        with tempfile.TemporaryDirectory() as directory:
+            directory = os.path.join(directory, 'engines')
+            with self.settings(ENGINE_SNAPSHOT_DIR=directory):
+                call_command('save_engine_snapshots', stdout=StringIO())
+
+                self.assertEqual(len(os.listdir(directory)), 2)
+                engine = CorrelationEngine(ballots[0].id)
+                self.assertTrue(load_engine_file(engine))
+                self.assertEqual(engine.option_count, 3)
+
+    def test__no_directory__error(self):
+        with self.settings(ENGINE_SNAPSHOT_DIR=''):
+            with self.assertRaises(CommandError):
+                call_command('save_engine_snapshots', stdout=StringIO())
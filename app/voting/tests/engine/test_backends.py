@@ -0,0 +1,92 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from voting.backends import (
+    ScoringBackend,
+    backends,
+    get_backend,
+    get_overlap,
+    get_rank_correlation,
+    register_backend
+)
+from voting.engine import clear_engines
+from voting.factories import BallotOptionFactory, UserVoteFactory, VotingSessionFactory
+
+
+class FixedBackend(ScoringBackend):
+    """Ranks every ballot the same, to tell which backend served a request."""
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        return [{'id': 1, 'score': 1.0}, {'id': 2, 'score': 0.5}][:limit]
+
+
+class FailingBackend(ScoringBackend):
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        raise RuntimeError("Scoring failed")
+
+
+class ScoringBackendTests(TestCase):
+    def setUp(self):
+        clear_engines()
+        register_backend('fixed')(FixedBackend)
+        register_backend('failing')(FailingBackend)
+
+        self.session = VotingSessionFactory.create()
+        options = BallotOptionFactory.create_batch(4, ballot=self.session.room.ballot)
+        UserVoteFactory.create(session=self.session, option=options[0], polarity=True)
+
+    def tearDown(self):
+        del backends['fixed']
+        del backends['failing']
+
+    def get_results(self):
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={self.session.id}&mode=suggest&limit=10')
+        return response.json()['results']
+
+    def test__get_backend__unknown__error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_backend('unknown')
+
+    def test__ballot_engine__overrides_default(self):
+        with self.settings(SCORING_ENGINE_BALLOTS={self.session.room.ballot.id: 'fixed'}):
+            self.assertEqual(len(self.get_results()), 2)
+        with self.settings(SCORING_ENGINE_BALLOTS={self.session.room.ballot.id + 1: 'fixed'}):
+            self.assertEqual(len(self.get_results()), 3)
+
+    @override_settings(SHADOW_SCORING_ENGINE='numpy', SHADOW_SCORING_RATE=1)
+    def test__shadow__logs_comparison(self):
+        with self.assertLogs('voting.backends', 'INFO') as logs:
+            results = self.get_results()
+
+        self.assertEqual(len(results), 3)
+        record, = logs.records
+        self.assertEqual(record.scoring_engine, 'orm')
+        self.assertEqual(record.shadow_scoring_engine, 'numpy')
+        self.assertAlmostEqual(record.rank_correlation, 1.0)
+        self.assertEqual(record.overlap, 1.0)
+
+    @override_settings(SHADOW_SCORING_ENGINE='failing', SHADOW_SCORING_RATE=1)
+    def test__shadow_fails__primary_served(self):
+        with self.assertLogs('voting.backends', 'ERROR'):
+            results = self.get_results()
+
+        self.assertEqual(len(results), 3)
+
+    @override_settings(SHADOW_SCORING_ENGINE='fixed', SHADOW_SCORING_RATE=0)
+    def test__shadow_rate_zero__not_run(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('voting.backends', 'INFO'):
+                self.get_results()
+
+    def test__rank_correlation(self):
+        self.assertEqual(get_rank_correlation([1, 2, 3], [1, 2, 3]), 1)
+        self.assertEqual(get_rank_correlation([1, 2, 3], [3, 2, 1]), -1)
+        # Only the options in both rankings are compared
+        self.assertEqual(get_rank_correlation([1, 2, 3, 4], [5, 2, 3]), 1)
+        self.assertIsNone(get_rank_correlation([1, 2], [2, 3]))
+
+    def test__overlap(self):
+        self.assertEqual(get_overlap([1, 2, 3], [3, 4, 2]), 0.5)
+        self.assertEqual(get_overlap([], []), 1.0)
@@ -0,0 +1,362 @@
+import random
+
+import numpy as np
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from voting.correlations import compact_vote_events
+from voting.engine import clear_engines, get_engine
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    RoomFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+
+
+class CorrelationEngineTests(TestCase):
+    def setUp(self):
+        clear_engines()
+
+    def test__get_engine__kept_warm(self):
+        ballot = BallotFactory.create()
+
+        self.assertIs(get_engine(ballot.id), get_engine(ballot.id))
+
+    def test__refresh__loads_updated_correlations(self):
+        session = VotingSessionFactory.create()
+        first = BallotOptionFactory.create(ballot=session.room.ballot)
+        second = BallotOptionFactory.create(ballot=session.room.ballot)
+        engine = get_engine(session.room.ballot.id)
+
+        UserVoteFactory.create(session=session, option=first, polarity=True)
+        UserVoteFactory.create(session=session, option=second, polarity=True)
+        engine.refresh()
+
+        # The first option voted for now predicts the second one
+        scores = engine.get_likelihood_scores(engine.get_session_scores({first.id: True}))
+        self.assertGreater(scores[engine.get_indexes([second.id])[0]], 0.5)
+
+    def test__refresh__loads_new_options(self):
+        ballot = BallotFactory.create()
+        BallotOptionFactory.create(ballot=ballot)
+        engine = get_engine(ballot.id)
+
+        option = BallotOptionFactory.create(ballot=ballot)
+        engine.refresh()
+
+        self.assertEqual(engine.option_count, 2)
+        self.assertEqual(engine.get_indexes([option.id])[0], 1)
+
+    def test__rank_limit__matches_full_ranking(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(6, ballot=ballot)
+        engine = get_engine(ballot.id)
+        scores = np.array([0.3, 0.9, 0.1, 0.9, 0.5, 0.7])
+
+        ranking = engine.rank(scores, {options[5].id})
+
+        self.assertEqual(engine.rank(scores, {options[5].id}, limit=3), ranking[:3])
+        self.assertEqual(
+            [result['id'] for result in ranking[:3]],
+            [options[1].id, options[3].id, options[4].id]
+        )
+
+    def test__rank_limit_tied_at_limit__lowest_ids(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(40, ballot=ballot)
+        engine = get_engine(ballot.id)
+        # Enough ties around the limit for the partition to leave them out of id order
+        scores = np.array([0.2, 0.9] + [0.5] * 38)
+
+        ranking = engine.rank(scores, set())
+
+        for limit in range(1, 40):
+            self.assertEqual(engine.rank(scores, set(), limit=limit), ranking[:limit])
+        self.assertEqual(
+            [result['id'] for result in ranking[:3]],
+            [options[1].id, options[2].id, options[3].id]
+        )
+
+    @override_settings(CORRELATION_ENGINE_REFRESH_INTERVAL=60)
+    def test__refresh_interval__not_elapsed__skipped(self):
+        ballot = BallotFactory.create()
+        engine = get_engine(ballot.id)
+
+        BallotOptionFactory.create(ballot=ballot)
+        engine.refresh()
+
+        self.assertEqual(engine.option_count, 0)
+
+
+class CorrelationEngineParityTests(TestCase):
+    """The engine should score every option the same as the database annotations."""
+
+    def setUp(self):
+        clear_engines()
+
+    def create_votes(self):
+        random.seed(0)
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(8, ballot=ballot)
+        room = RoomFactory.create(ballot=ballot)
+
+        # Build up correlations from sessions in this and other rooms
+        for index in range(6):
+            session = VotingSessionFactory.create(
+                room=room if index % 2 else RoomFactory.create(ballot=ballot)
+            )
+            for option in random.sample(options, random.randint(2, 6)):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+        self.session = VotingSessionFactory.create(room=room)
+        for option in random.sample(options, 2):
+            UserVoteFactory.create(
+                session=self.session,
+                option=option,
+                polarity=random.random() < 0.5
+            )
+
+    def get_scores(self, mode):
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={self.session.id}&mode={mode}')
+        return {
+            result['id']: result['score']
+            for result in response.json()['results']
+        }
+
+    def assert_parity(self, mode):
+        self.create_votes()
+        expected = self.get_scores(mode)
+        with self.settings(SCORING_ENGINE='numpy'):
+            actual = self.get_scores(mode)
+
+        self.assertTrue(expected)
+        self.assertEqual(actual.keys(), expected.keys())
+        for option_id, score in expected.items():
+            self.assertAlmostEqual(actual[option_id], score, places=5)
+
+    def test__likelihood__matches_annotations(self):
+        self.assert_parity('suggest')
+
+    def test__significance__matches_annotations(self):
+        self.assert_parity('explore')
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__sparse_likelihood__matches_annotations(self):
+        self.assert_parity('suggest')
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__sparse_significance__matches_annotations(self):
+        self.assert_parity('explore')
+
+
+class SessionScoresTests(TestCase):
+    def setUp(self):
+        clear_engines()
+
+        self.session = VotingSessionFactory.create()
+        self.other_session = VotingSessionFactory.create(room=self.session.room)
+        self.options = BallotOptionFactory.create_batch(6, ballot=self.session.room.ballot)
+        self.engine = get_engine(self.session.room.ballot.id)
+
+    def vote(self, session, index, polarity):
+        UserVoteFactory.create(session=session, option=self.options[index], polarity=polarity)
+        self.engine.refresh()
+
+    def get_votes(self, session):
+        return dict(session.uservote_set.values_list('option', 'polarity'))
+
+    def assert_matches_fresh(self, scores):
+        # Scores without a session id are always summed from scratch
+        fresh = self.engine.get_session_scores(self.get_votes(self.session))
+
+        np.testing.assert_allclose(
+            self.engine.get_likelihood_scores(scores),
+            self.engine.get_likelihood_scores(fresh)
+        )
+        np.testing.assert_allclose(
+            self.engine.get_significance_scores(scores),
+            self.engine.get_significance_scores(fresh)
+        )
+
+    def get_cached_scores(self):
+        return self.engine.get_session_scores(self.get_votes(self.session), self.session.id)
+
+    def test__cached__follows_votes_and_correlation_changes(self):
+        self.vote(self.other_session, 1, True)
+        self.vote(self.session, 0, True)
+        scores = self.get_cached_scores()
+
+        # Other sessions move correlations involving the options this session voted on
+        self.vote(self.other_session, 0, False)
+        self.vote(self.other_session, 2, True)
+        self.vote(self.session, 3, False)
+        self.vote(self.session, 1, True)
+
+        self.assertIs(self.get_cached_scores(), scores)
+        self.assert_matches_fresh(scores)
+
+    def test__journal_truncated__summed_again(self):
+        self.engine.JOURNAL_SIZE = 1
+        self.vote(self.session, 0, True)
+        self.vote(self.other_session, 1, True)
+        scores = self.get_cached_scores()
+
+        self.vote(self.other_session, 0, True)
+        self.vote(self.other_session, 2, False)
+
+        self.assertIs(self.get_cached_scores(), scores)
+        self.assert_matches_fresh(scores)
+
+    def test__changed_vote__summed_again(self):
+        self.vote(self.session, 0, True)
+        scores = self.get_cached_scores()
+
+        self.session.uservote_set.update(polarity=False)
+
+        self.assertIsNot(self.get_cached_scores(), scores)
+        self.assert_matches_fresh(self.get_cached_scores())
+
+    @override_settings(SESSION_SCORES_CACHE_SIZE=1)
+    def test__cache_size__evicts_least_recently_used(self):
+        self.engine.get_session_scores({}, self.session.id)
+        self.engine.get_session_scores({}, self.other_session.id)
+
+        self.assertEqual(list(self.engine.sessions), [self.other_session.id])
+
+
+@override_settings(CORRELATION_UPDATES='log')
+class EventLogEngineTests(TestCase):
+    """The engine should score the snapshot with the uncompacted events applied on top."""
+
+    def setUp(self):
+        clear_engines()
+
+        self.session = VotingSessionFactory.create()
+        self.other_session = VotingSessionFactory.create(room=self.session.room)
+        self.options = BallotOptionFactory.create_batch(5, ballot=self.session.room.ballot)
+
+    def vote(self, session, index, polarity):
+        UserVoteFactory.create(session=session, option=self.options[index], polarity=polarity)
+
+    def get_scores(self):
+        engine = get_engine(self.session.room.ballot.id)
+        scores = engine.get_session_scores(
+            dict(self.session.uservote_set.values_list('option', 'polarity'))
+        )
+        return engine.get_likelihood_scores(scores), engine.get_significance_scores(scores)
+
+    def assert_scores_equal(self, actual, expected):
+        for actual_scores, expected_scores in zip(actual, expected):
+            np.testing.assert_allclose(actual_scores, expected_scores, atol=1e-6)
+
+    def test__tail__matches_compacted(self):
+        self.vote(self.other_session, 0, True)
+        self.vote(self.other_session, 1, True)
+        compact_vote_events()
+        self.vote(self.session, 0, True)
+        self.vote(self.other_session, 2, False)
+        self.vote(self.other_session, 3, True)
+
+        with_tail = self.get_scores()
+        compact_vote_events()
+
+        self.assert_scores_equal(self.get_scores(), with_tail)
+
+    def test__compacted_between_refreshes__tail_not_applied_twice(self):
+        self.vote(self.session, 0, True)
+        self.vote(self.other_session, 0, True)
+        self.vote(self.other_session, 1, False)
+        self.get_scores()
+
+        compact_vote_events(batch_size=2)
+        partly_compacted = self.get_scores()
+        compact_vote_events()
+        clear_engines()
+
+        self.assert_scores_equal(self.get_scores(), partly_compacted)
+
+    def test__tail__moves_scores(self):
+        self.vote(self.session, 0, True)
+        before = self.get_scores()
+
+        self.vote(self.other_session, 0, True)
+        self.vote(self.other_session, 1, True)
+
+        # Option 1 is now likelier for a session that voted for option 0
+        self.assertGreater(self.get_scores()[0][1], before[0][1])
+
+    def test__tail_unchanged__version_kept(self):
+        self.vote(self.other_session, 0, True)
+        self.vote(self.other_session, 1, True)
+        engine = get_engine(self.session.room.ballot.id)
+        version = engine.version
+
+        engine.refresh()
+        self.assertEqual(engine.version, version)
+
+        self.vote(self.other_session, 2, False)
+        engine.refresh()
+        self.assertGreater(engine.version, version)
+
+
+class EstimatedScoresTests(TestCase):
+    def setUp(self):
+        clear_engines()
+
+        random.seed(3)
+        ballot = BallotFactory.create()
+        self.options = BallotOptionFactory.create_batch(20, ballot=ballot)
+        for _ in range(10):
+            session = VotingSessionFactory.create(room=RoomFactory.create(ballot=ballot))
+            for option in random.sample(self.options, 6):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+        self.engine = get_engine(ballot.id)
+        self.votes = {self.options[0].id: True, self.options[1].id: False}
+
+    def test__every_option_drawn__exact(self):
+        scores = self.engine.get_session_scores(self.votes)
+        for significance, expected in (
+                (False, self.engine.get_likelihood_scores(scores)),
+                (True, self.engine.get_significance_scores(scores))):
+            estimate, error, sample_size = self.engine.estimate_scores(self.votes, significance)
+
+            self.assertEqual(sample_size, 20)
+            np.testing.assert_allclose(estimate, expected, atol=1e-6)
+            np.testing.assert_array_equal(error, 0)
+
+    def test__larger_sample__narrower_interval(self):
+        errors = []
+        for batch_size in (4, 12):
+            self.engine.SAMPLE_BATCH_SIZE = batch_size
+            _, error, sample_size = self.engine.estimate_scores(
+                self.votes, deadline=0, rng=np.random.default_rng(0)
+            )
+            self.assertEqual(sample_size, batch_size)
+            errors.append(error.mean())
+
+        self.assertLess(errors[1], errors[0])
+
+    def test__significance__draws_two_unvoted_targets(self):
+        self.engine.SAMPLE_BATCH_SIZE = 1
+        votes = {option.id: True for option in self.options[:18]}
+
+        _, error, sample_size = self.engine.estimate_scores(
+            votes, significance=True, deadline=0, rng=np.random.default_rng(0)
+        )
+
+        # Draws go on past the deadline until both unvoted options are drawn, which leaves
+        # nothing of the spread to estimate
+        self.assertGreater(sample_size, 2)
+        np.testing.assert_array_equal(error, 0)
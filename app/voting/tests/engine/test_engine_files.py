@@ -0,0 +1,122 @@
+import random
+import tempfile
+
+import numpy as np
+from django.test import TestCase, override_settings
+
+from voting.engine import CorrelationEngine, create_engine
+from voting.engine_files import get_engine_path, save_engine_file
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    RoomFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+from voting.lowrank import LowRankEngine
+
+
+@override_settings(CORRELATION_ENGINE_REFRESH_INTERVAL=0)
+class EngineFileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(ENGINE_SNAPSHOT_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.ballot = BallotFactory.create()
+        self.options = BallotOptionFactory.create_batch(8, ballot=self.ballot)
+        self.rng = random.Random(0)
+        self.create_votes(4)
+
+    def create_votes(self, session_count):
+        for _ in range(session_count):
+            session = VotingSessionFactory.create(room=RoomFactory.create(ballot=self.ballot))
+            for option in self.rng.sample(self.options, 4):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=self.rng.random() < 0.5
+                )
+
+    def save_engine(self):
+        engine = create_engine(self.ballot.id)
+        engine.refresh()
+        save_engine_file(engine)
+
+    def assert_scores_match_database(self, engine):
+        fresh = type(engine)(self.ballot.id, *engine.get_file_params().values())
+        with self.settings(ENGINE_SNAPSHOT_DIR=''):
+            fresh.refresh()
+
+        votes = {self.options[0].id: True, self.options[1].id: False}
+        for func in ('get_likelihood_scores', 'get_significance_scores'):
+            np.testing.assert_allclose(
+                getattr(engine, func)(engine.get_session_scores(votes)),
+                getattr(fresh, func)(fresh.get_session_scores(votes)),
+                atol=1e-6
+            )
+
+    def test__cold_engine__mapped_from_file(self):
+        self.save_engine()
+
+        engine = create_engine(self.ballot.id)
+        engine.refresh()
+
+        self.assertIsInstance(engine.drift, np.memmap)
+        self.assert_scores_match_database(engine)
+
+    def test__votes_since_saved__caught_up(self):
+        self.save_engine()
+        self.create_votes(2)
+
+        engine = create_engine(self.ballot.id)
+        engine.refresh()
+
+        self.assertIsInstance(engine.drift, np.memmap)
+        self.assert_scores_match_database(engine)
+
+    def test__options_since_saved__loaded_from_database(self):
+        self.save_engine()
+        BallotOptionFactory.create(ballot=self.ballot)
+
+        engine = create_engine(self.ballot.id)
+        engine.refresh()
+
+        self.assertNotIsInstance(engine.drift, np.memmap)
+        self.assertEqual(engine.option_count, 9)
+
+    # With as many factors as options the approximation is exact
+    @override_settings(LOW_RANK_MIN_OPTIONS=1, LOW_RANK_FACTORS=8)
+    def test__low_rank__mapped_from_file(self):
+        self.save_engine()
+        self.create_votes(1)
+
+        engine = create_engine(self.ballot.id)
+        engine.refresh()
+
+        self.assertIsInstance(engine, LowRankEngine)
+        self.assertIsInstance(engine.drift_left, np.memmap)
+        self.assert_scores_match_database(engine)
+
+    def test__other_settings__skipped(self):
+        with self.settings(LOW_RANK_MIN_OPTIONS=1, LOW_RANK_FACTORS=4):
+            self.save_engine()
+
+        engine = CorrelationEngine(self.ballot.id)
+        with self.assertLogs('voting.engine_files', 'INFO'):
+            engine.refresh()
+
+        self.assertNotIsInstance(engine.drift, np.memmap)
+        self.assert_scores_match_database(engine)
+
+    def test__corrupt_file__skipped(self):
+        with open(get_engine_path(self.ballot.id), 'wb') as file:
+            file.write(b'not an engine')
+
+        engine = create_engine(self.ballot.id)
+        with self.assertLogs('voting.engine_files', 'WARNING'):
+            engine.refresh()
+
+        self.assert_scores_match_database(engine)
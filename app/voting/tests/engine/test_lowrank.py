@@ -0,0 +1,142 @@
+import random
+
+import numpy as np
+from django.test import TestCase, override_settings
+
+from voting.engine import CorrelationEngine, clear_engines, get_engine
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    RoomFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+from voting.lowrank import LowRankEngine, SparseCells, factorize
+from voting.tests.engine import test_correlation_engine
+
+
+# With at least as many factors as options the approximation is exact
+@override_settings(LOW_RANK_MIN_OPTIONS=1, LOW_RANK_FACTORS=8)
+class LowRankParityTests(test_correlation_engine.CorrelationEngineParityTests):
+    pass
+
+
+@override_settings(LOW_RANK_MIN_OPTIONS=1, LOW_RANK_FACTORS=6)
+class LowRankSessionScoresTests(test_correlation_engine.SessionScoresTests):
+    def test__engine__low_rank(self):
+        self.assertIsInstance(self.engine, LowRankEngine)
+
+
+@override_settings(LOW_RANK_MIN_OPTIONS=1, LOW_RANK_FACTORS=5)
+class LowRankEventLogEngineTests(test_correlation_engine.EventLogEngineTests):
+    pass
+
+
+class LowRankEngineTests(TestCase):
+    def setUp(self):
+        clear_engines()
+
+    @override_settings(LOW_RANK_MIN_OPTIONS=3)
+    def test__get_engine__low_rank_from_min_options(self):
+        small_ballot = BallotFactory.create()
+        BallotOptionFactory.create_batch(2, ballot=small_ballot)
+        large_ballot = BallotFactory.create()
+        BallotOptionFactory.create_batch(3, ballot=large_ballot)
+
+        self.assertNotIsInstance(get_engine(small_ballot.id), LowRankEngine)
+        self.assertIsInstance(get_engine(large_ballot.id), LowRankEngine)
+
+    def test__factorize__low_rank_matrix__recovered(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.standard_normal((30, 3)) @ rng.standard_normal((3, 30))
+        rows, columns = np.nonzero(matrix)
+
+        left, right = factorize(rows, columns, matrix[rows, columns], 30, 3)
+
+        np.testing.assert_allclose(left @ right.T, matrix, atol=1e-8)
+
+    def test__sparse_cells__set__inserts_and_updates(self):
+        cells = SparseCells()
+        cells.set(np.array([5, 2]), np.array([0.5, 0.2]))
+        cells.set(np.array([2, 9]), np.array([-0.2, 0.9]))
+
+        np.testing.assert_array_equal(cells.keys, [2, 5, 9])
+        np.testing.assert_allclose(cells.get(np.array([9, 2, 7, 5])), [0.9, -0.2, 0.0, 0.5])
+
+    def create_votes(self, ballot, options, session_count):
+        rng = random.Random(0)
+        for _ in range(session_count):
+            session = VotingSessionFactory.create(room=RoomFactory.create(ballot=ballot))
+            for option in rng.sample(options, 5):
+                UserVoteFactory.create(session=session, option=option, polarity=rng.random() < 0.5)
+
+    def get_scores(self, engine, votes):
+        scores = engine.get_session_scores(votes)
+        return engine.get_likelihood_scores(scores), engine.get_significance_scores(scores)
+
+    def test__refresh__changes_kept_as_residuals(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(10, ballot=ballot)
+        self.create_votes(ballot, options, 4)
+        engine = LowRankEngine(ballot.id, 2)
+        engine.refresh()
+        votes = {options[0].id: True, options[1].id: False}
+        fitted = self.get_scores(engine, votes)
+
+        self.create_votes(ballot, options, 2)
+        engine.refresh()
+        self.assertTrue(len(engine.drift_residual))
+        with_residuals = self.get_scores(engine, votes)
+
+        # The residuals make up for the factors being fitted to the old correlations
+        fresh = LowRankEngine(ballot.id, 2)
+        fresh.refresh()
+        self.assertFalse(len(fresh.drift_residual))
+        for actual, expected in zip(with_residuals, self.get_scores(fresh, votes)):
+            np.testing.assert_allclose(actual, expected, atol=0.05)
+        self.assertFalse(np.allclose(with_residuals[0], fitted[0]))
+
+    def test__residuals__refit_past_limit(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(10, ballot=ballot)
+        self.create_votes(ballot, options, 2)
+        engine = LowRankEngine(ballot.id, 2)
+        engine.MIN_REFIT_CELLS = 0
+        engine.REFIT_RATIO = 0
+        engine.refresh()
+
+        self.create_votes(ballot, options, 1)
+        engine.refresh()
+
+        self.assertFalse(len(engine.drift_residual))
+        self.assertFalse(len(engine.spread_residual))
+
+    def test__few_factors__close_to_exact(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(30, ballot=ballot)
+        self.create_votes(ballot, options, 20)
+        exact = CorrelationEngine(ballot.id)
+        exact.refresh()
+        engine = LowRankEngine(ballot.id, 10)
+        engine.refresh()
+
+        votes = {option.id: index % 2 == 0 for index, option in enumerate(options[:5])}
+        for actual, expected in zip(self.get_scores(engine, votes), self.get_scores(exact, votes)):
+            np.testing.assert_allclose(actual, expected, atol=0.02)
+
+    def test__estimate_scores__drawn_from_exact_correlations(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(12, ballot=ballot)
+        self.create_votes(ballot, options, 6)
+        exact = CorrelationEngine(ballot.id)
+        exact.refresh()
+        engine = LowRankEngine(ballot.id, 1)
+        engine.refresh()
+
+        votes = {options[0].id: True, options[1].id: False}
+        for significance in (False, True):
+            np.testing.assert_allclose(
+                engine.estimate_scores(votes, significance)[0],
+                exact.estimate_scores(votes, significance)[0],
+                atol=1e-9
+            )
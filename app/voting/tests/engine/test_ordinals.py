@@ -0,0 +1,55 @@
+from django.test import TestCase
+
+from voting.factories import BallotFactory, BallotOptionFactory
+from voting.models import BallotOption
+from voting.ordinals import (
+    clear_ordinal_mappings,
+    get_option_ids,
+    get_option_ordinals,
+    get_ordinal_mapping
+)
+
+
+class OrdinalMappingTests(TestCase):
+    def setUp(self):
+        clear_ordinal_mappings()
+        self.ballot = BallotFactory.create()
+        self.options = BallotOptionFactory.create_batch(4, ballot=self.ballot)
+
+    def test__mapping__both_ways(self):
+        deleted_id = self.options[1].id
+        self.options[1].delete()
+        mapping = get_ordinal_mapping(self.ballot.id)
+
+        self.assertEqual(
+            mapping.get_ids([3, 0, 1, 7]).tolist(),
+            [self.options[3].id, self.options[0].id, -1, -1]
+        )
+        self.assertEqual(
+            mapping.get_ordinals([self.options[2].id, deleted_id, 0]).tolist(),
+            [2, -1, -1]
+        )
+
+    def test__mapping__cached(self):
+        get_ordinal_mapping(self.ballot.id)
+
+        with self.assertNumQueries(0):
+            ids = get_option_ids(self.ballot.id, [0, 1])
+        self.assertEqual(ids.tolist(), [self.options[0].id, self.options[1].id])
+
+    def test__option_created_elsewhere__read_on_miss(self):
+        get_ordinal_mapping(self.ballot.id)
+        # Created without signals, as another process would
+        BallotOption.objects.bulk_create([BallotOption(ballot=self.ballot, label='New', ordinal=4)])
+        option = BallotOption.objects.get(label='New')
+
+        self.assertEqual(get_option_ids(self.ballot.id, [4]).tolist(), [option.id])
+        self.assertEqual(get_option_ordinals(self.ballot.id, [option.id]).tolist(), [4])
+
+    def test__option_created__mapping_cleared(self):
+        get_ordinal_mapping(self.ballot.id)
+        option = BallotOptionFactory.create(ballot=self.ballot)
+
+        with self.assertNumQueries(1):
+            ordinals = get_option_ordinals(self.ballot.id, [option.id])
+        self.assertEqual(ordinals.tolist(), [4])
@@ -0,0 +1,186 @@
+import random
+import time
+from concurrent.futures import Future
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from voting.engine import clear_engines, get_engine
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    RoomFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+from voting.speculation import clear_speculations, get_speculation, speculations
+
+
+@override_settings(SCORING_ENGINE='numpy', SPECULATIVE_SUGGESTIONS=1)
+class SpeculativeSuggestionTests(TestCase):
+    def setUp(self):
+        clear_engines()
+        clear_speculations()
+
+        random.seed(0)
+        ballot = BallotFactory.create()
+        self.options = BallotOptionFactory.create_batch(8, ballot=ballot)
+        room = RoomFactory.create(ballot=ballot)
+
+        for index in range(6):
+            session = VotingSessionFactory.create(
+                room=room if index % 2 else RoomFactory.create(ballot=ballot)
+            )
+            for option in random.sample(self.options, random.randint(2, 6)):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+    def get_suggestions(self, session, mode, limit=None):
+        url = reverse('suggest-list') + f'?token={session.id}&mode={mode}'
+        if limit is not None:
+            url += f'&limit={limit}'
+        return self.client.get(url).json()['results']
+
+    def vote(self, session, option_id, polarity):
+        url = reverse('uservote-list')
+        self.client.post(url + f'?token={session.id}', {
+            'option': option_id,
+            'polarity': polarity
+        }, content_type='application/json')
+
+    def wait_for_speculation(self, session, vote_count, mode):
+        _, _, _, _, future = speculations[(session.id, vote_count, mode)]
+        future.result()
+
+    def assert_speculation_matches_live(self, mode, polarity):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        UserVoteFactory.create(session=session, option=self.options[0], polarity=True)
+
+        suggestion = self.get_suggestions(session, mode, limit=3)[0]
+        self.wait_for_speculation(session, 1, mode)
+        self.vote(session, suggestion['id'], polarity)
+
+        # Only the votes are read, everything else comes from the speculation
+        with self.assertNumQueries(1):
+            speculated = self.get_suggestions(session, mode, limit=3)
+        with self.settings(SPECULATIVE_SUGGESTIONS=0):
+            live = self.get_suggestions(session, mode, limit=3)
+
+        self.assertTrue(live)
+        self.assertEqual(speculated, live)
+
+    def test__likelihood_yes__matches_live(self):
+        self.assert_speculation_matches_live('suggest', True)
+
+    def test__likelihood_no__matches_live(self):
+        self.assert_speculation_matches_live('suggest', False)
+
+    def test__significance_yes__matches_live(self):
+        self.assert_speculation_matches_live('explore', True)
+
+    def test__significance_no__matches_live(self):
+        self.assert_speculation_matches_live('explore', False)
+
+    def test__token_written_differently__same_speculation(self):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        UserVoteFactory.create(session=session, option=self.options[0], polarity=True)
+
+        url = reverse('suggest-list') + f'?token=0{session.id}&mode=suggest&limit=3'
+        suggestion = self.client.get(url).json()['results'][0]
+        self.wait_for_speculation(session, 1, 'suggest')
+        self.vote(session, suggestion['id'], True)
+
+        # Only the votes are read, everything else comes from the speculation
+        with self.assertNumQueries(1):
+            self.get_suggestions(session, 'suggest', limit=3)
+
+    def test__other_option_voted__falls_back(self):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+
+        suggestion = self.get_suggestions(session, 'suggest', limit=1)[0]
+        self.wait_for_speculation(session, 0, 'suggest')
+        other = next(option for option in self.options if option.id != suggestion['id'])
+        self.vote(session, other.id, True)
+
+        with self.settings(SPECULATIVE_SUGGESTIONS=0):
+            live = self.get_suggestions(session, 'suggest', limit=1)
+        self.assertEqual(self.get_suggestions(session, 'suggest', limit=1), live)
+
+    def test__get_speculation__unfinished__none(self):
+        key = ('session', 0, 'suggest')
+        speculations[key] = (time.monotonic() + 60, None, 1, None, Future())
+
+        self.assertIsNone(get_speculation(key, {1: True}))
+
+    def test__get_speculation__expired__none(self):
+        key = ('session', 0, 'suggest')
+        future = Future()
+        future.set_result((0, {(1, True): []}))
+        speculations[key] = (time.monotonic() - 1, None, 1, None, future)
+
+        self.assertIsNone(get_speculation(key, {1: True}))
+
+    def test__get_speculation__limit__only_answers_smaller_limits(self):
+        key = ('session', 0, 'suggest')
+        engine = get_engine(self.options[0].ballot.id)
+        future = Future()
+        future.set_result((
+            engine.generation,
+            {(1, True): [{'id': 2, 'score': 0.5}, {'id': 3, 'score': 0.4}]}
+        ))
+
+        for limit, expected in [(1, [{'id': 2, 'score': 0.5}]), (3, None), (None, None)]:
+            with self.subTest(limit=limit):
+                speculations[key] = (time.monotonic() + 60, 2, 1, engine, future)
+                self.assertEqual(get_speculation(key, {1: True}, limit), expected)
+
+    def test__other_sessions_voted__speculation_kept(self):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        UserVoteFactory.create(session=session, option=self.options[0], polarity=True)
+
+        suggestion = self.get_suggestions(session, 'suggest', limit=3)[0]
+        self.wait_for_speculation(session, 1, 'suggest')
+        # Another session's votes load into the engine before this session votes, which the
+        # speculation leaves to its time to live
+        other = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        for option in self.options:
+            UserVoteFactory.create(session=other, option=option, polarity=True)
+        get_engine(self.options[0].ballot.id)
+
+        self.assertIsNotNone(get_speculation(
+            (session.id, 1, 'suggest'),
+            {self.options[0].id: True, suggestion['id']: True},
+            3
+        ))
+
+    def test__options_loaded_again__falls_back(self):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        UserVoteFactory.create(session=session, option=self.options[0], polarity=True)
+
+        suggestion = self.get_suggestions(session, 'suggest', limit=3)[0]
+        self.wait_for_speculation(session, 1, 'suggest')
+        # A new option moves the engine's indexes
+        BallotOptionFactory.create(ballot=self.options[0].ballot)
+        get_engine(self.options[0].ballot.id)
+
+        self.assertIsNone(get_speculation(
+            (session.id, 1, 'suggest'),
+            {self.options[0].id: True, suggestion['id']: True},
+            3
+        ))
+
+    def test__engine_cleared__falls_back(self):
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+
+        suggestion = self.get_suggestions(session, 'suggest', limit=1)[0]
+        self.wait_for_speculation(session, 0, 'suggest')
+        clear_engines()
+
+        self.assertIsNone(get_speculation(
+            (session.id, 0, 'suggest'),
+            {suggestion['id']: True},
+            1
+        ))
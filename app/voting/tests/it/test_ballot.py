@@ -1,8 +1,10 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 
 from voting.factories import BallotFactory
+from voting.models import Ballot, BallotOption, OptionCorrelation
 
 
 class BallotTests(TestCase):
@@ -58,3 +60,37 @@ class BallotTests(TestCase):
 
         self.assertEqual(response.status_code,
                          status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class BallotImportTests(TestCase):
+    def test_ballot__import_anonymous__prohibited(self):
+        url = reverse('ballot-import-ballot')
+        response = self.client.post(url, {
+            'label': 'Test ballot',
+            'options': ['First', 'Second']
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Ballot.objects.exists())
+
+    def test_ballot__import_admin__success(self):
+        self.client.force_login(
+            User.objects.create_user('admin', is_staff=True)
+        )
+
+        url = reverse('ballot-import-ballot')
+        response = self.client.post(url, {
+            'label': 'Test ballot',
+            'options': ['First', 'Second', 'Third']
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ballot = Ballot.objects.get(label='Test ballot')
+        self.assertEqual(response.json(), {
+            'id': ballot.id,
+            'label': ballot.label,
+            'created_options': 3
+        })
+        self.assertEqual(BallotOption.objects.filter(ballot=ballot).count(), 3)
+        # Every ordered pair of options, for both polarities
+        self.assertEqual(OptionCorrelation.objects.count(), 3 * 2 * 2)
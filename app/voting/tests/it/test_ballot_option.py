@@ -1,8 +1,11 @@
+import json
+
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 
-from voting.factories import BallotOptionFactory
+from voting.factories import BallotFactory, BallotOptionFactory
+from voting.models import BallotOption
 
 
 class BallotOptionListTests(TestCase):
@@ -21,6 +24,109 @@ class BallotOptionListTests(TestCase):
             'label': ballot_option.label
         }])
 
+    def test_ballot_option__list_ballot__filtered(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(2, ballot=ballot)
+        BallotOptionFactory.create()
+
+        url = reverse('ballotoption-list')
+        response = self.client.get(url + f'?ballot={ballot.id}')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(result['id'] for result in response.json()['results']),
+            [option.id for option in options]
+        )
+
+    def test_ballot_option__list_ballot_pages__every_option_once(self):
+        ballot = BallotFactory.create()
+        BallotOptionFactory.create_batch(25, ballot=ballot)
+        BallotOptionFactory.create()
+
+        url = reverse('ballotoption-list') + f'?ballot={ballot.id}'
+        ids = []
+        while url is not None:
+            json = self.client.get(url).json()
+            self.assertNotIn('count', json)
+            ids.extend(result['id'] for result in json['results'])
+            url = json['next']
+
+        self.assertEqual(ids, list(
+            BallotOption.objects.filter(
+                ballot=ballot
+            ).order_by('-created', '-id').values_list('id', flat=True)
+        ))
+
+    def test_ballot_option__list_invalid_ballot__error(self):
+        url = reverse('ballotoption-list')
+        response = self.client.get(url + '?ballot=abc')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ballot_option__list_fields__projected(self):
+        ballot_option = BallotOptionFactory.create()
+
+        url = reverse('ballotoption-list')
+        response = self.client.get(url + '?fields=id,label')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [{
+            'id': ballot_option.id,
+            'label': ballot_option.label
+        }])
+
+    def test_ballot_option__list_invalid_fields__error(self):
+        url = reverse('ballotoption-list')
+        for fields in ['id,created', '', ',']:
+            with self.subTest(fields=fields):
+                response = self.client.get(url + f'?fields={fields}')
+
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BallotOptionStreamTests(TestCase):
+    def get_json(self, response):
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_ballot_option__stream__all_options(self):
+        ballot = BallotFactory.create()
+        # More options than a page holds
+        options = BallotOptionFactory.create_batch(15, ballot=ballot)
+        BallotOptionFactory.create()
+
+        url = reverse('ballotoption-all')
+        response = self.client.get(url + f'?ballot={ballot.id}')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_json(response), {'results': [
+            {'id': option.id, 'label': option.label, 'ballot': ballot.id}
+            for option in options
+        ]})
+
+    def test_ballot_option__stream_fields__projected(self):
+        ballot_option = BallotOptionFactory.create()
+
+        url = reverse('ballotoption-all')
+        response = self.client.get(url + f'?ballot={ballot_option.ballot.id}&fields=label,id')
+
+        self.assertEqual(self.get_json(response), {'results': [
+            {'label': ballot_option.label, 'id': ballot_option.id}
+        ]})
+
+    def test_ballot_option__stream_empty_ballot__no_results(self):
+        ballot = BallotFactory.create()
+
+        url = reverse('ballotoption-all')
+        response = self.client.get(url + f'?ballot={ballot.id}')
+
+        self.assertEqual(self.get_json(response), {'results': []})
+
+    def test_ballot_option__stream_no_ballot__error(self):
+        url = reverse('ballotoption-all')
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class BallotOptionGetTests(TestCase):
     def test_ballot_option__get__success(self):
@@ -1,11 +1,16 @@
-from django.test import TestCase
+import random
+
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.db.models.signals import post_save
 from rest_framework import status
 import factory
 
+from voting.engine import clear_engines, get_engine
 from voting.factories import (
+    BallotFactory,
     BallotOptionFactory,
+    RoomFactory,
     VotingSessionFactory,
     UserVoteFactory,
     OptionCorrelationFactory
@@ -33,6 +38,25 @@ class SuggestionListTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_suggestions__list_tied_at_limit__lowest_ids(self):
+        session = VotingSessionFactory.create()
+        options = BallotOptionFactory.create_batch(6, ballot=session.room.ballot)
+
+        # Without votes every option scores the same, so the ranking falls back on the ids
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={session.id}&mode=suggest&limit=3')
+
+        self.assertEqual(
+            [result['id'] for result in response.json()['results']],
+            [option.id for option in options[:3]]
+        )
+
+    def test_suggestions__list_invalid_token__error(self):
+        url = reverse('suggest-list')
+        response = self.client.get(url + '?token=abc&mode=suggest')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_suggestions__list_invalid_mode__error(self):
         session = VotingSessionFactory.create()
 
@@ -41,6 +65,14 @@ class SuggestionListTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_suggestions__list_invalid_limit__error(self):
+        session = VotingSessionFactory.create()
+
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={session.id}&mode=suggest&limit=0')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_suggestions__post__not_allowed(self):
         url = reverse('suggest-list')
         response = self.client.post(url)
@@ -150,6 +182,26 @@ class SuggestionLikelihoodTests(TestCase):
         self.assertIn('id', json['results'][1])
         self.assertEqual(json['results'][1]['id'], voted_against.option.id)
 
+    def test_suggestions__list_limit__only_best(self):
+        base_vote = UserVoteFactory.create(polarity=False)
+        voted_for = UserVoteFactory.create(
+            option__ballot=base_vote.option.ballot,
+            session=base_vote.session,
+            polarity=True
+        )
+        session = VotingSessionFactory(room__ballot=base_vote.option.ballot)
+
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={session.id}&mode=suggest&limit=1')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        json = response.json()
+        # Results are not paginated, so there is no count of every option
+        self.assertNotIn('count', json)
+        self.assertEqual(len(json['results']), 1)
+        self.assertEqual(json['results'][0]['id'], voted_for.option.id)
+
     def test_suggestions__other_session_voted_against__excluded(self):
         # Do not suggest options another session in the same room voted against
         session = VotingSessionFactory.create()
@@ -187,6 +239,11 @@ class SuggestionLikelihoodTests(TestCase):
         self.assertEqual(json['results'][0]['id'], vote.option.id)
 
 
+@override_settings(SPARSE_CORRELATIONS=True)
+class SparseSuggestionLikelihoodTests(SuggestionLikelihoodTests):
+    pass
+
+
 class SuggestionSignificanceTests(TestCase):
     @staticmethod
     def create_correlations(predicate, target, negative_correlation, positive_correlation):
@@ -317,3 +374,205 @@ class SuggestionSignificanceTests(TestCase):
         # but a 0.1 likelihood (Which decreases the score)
         self.assertLess(json['results'][0]['score'], 0.8)
         self.assertGreater(json['results'][0]['score'], 0)
+
+    @factory.django.mute_signals(post_save)
+    def test_exploration__missing_correlation__treated_as_default(self):
+        predicate = BallotOptionFactory.create()
+        target = BallotOptionFactory.create(ballot=predicate.ballot)
+        session = VotingSessionFactory.create(room__ballot=predicate.ballot)
+
+        # Only store the polarity=True correlation, the polarity=False one sits at 0.5
+        OptionCorrelationFactory.create(
+            predicate=predicate,
+            predicate_polarity=True,
+            target=target,
+            correlation=0.9
+        )
+
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={session.id}&mode=explore')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        json = response.json()
+        self.assertIn('results', json)
+        self.assertEqual(len(json['results']), 2)
+        self.assertEqual(json['results'][0]['id'], predicate.id)
+        # The predicate has a 0.4 spread against the default correlation, and with no
+        # correlations targeting it, a perfect 0.5 likelihood
+        self.assertAlmostEqual(json['results'][0]['score'], 0.4)
+        self.assertEqual(json['results'][1]['id'], target.id)
+        self.assertEqual(json['results'][1]['score'], 0)
+
+
+class EngineTestMixin:
+    def setUp(self):
+        super().setUp()
+        # Engines are kept warm across requests, so do not let them outlive a test's data
+        clear_engines()
+
+
+@override_settings(SCORING_ENGINE='numpy')
+class EngineSuggestionListTests(EngineTestMixin, SuggestionListTests):
+    pass
+
+
+@override_settings(SCORING_ENGINE='numpy')
+class EngineSuggestionLikelihoodTests(EngineTestMixin, SuggestionLikelihoodTests):
+    pass
+
+
+@override_settings(SCORING_ENGINE='numpy')
+class EngineSuggestionSignificanceTests(EngineTestMixin, SuggestionSignificanceTests):
+    pass
+
+
+@override_settings(SCORING_ENGINE='sql')
+class SqlSuggestionListTests(SuggestionListTests):
+    pass
+
+
+@override_settings(SCORING_ENGINE='sql')
+class SqlSuggestionLikelihoodTests(SuggestionLikelihoodTests):
+    pass
+
+
+@override_settings(SCORING_ENGINE='sql')
+class SqlSuggestionSignificanceTests(SuggestionSignificanceTests):
+    pass
+
+
+class SqlSuggestionOrderingTests(TestCase):
+    """The set-based query should rank options exactly as the annotations do."""
+
+    def create_votes(self):
+        random.seed(1)
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(12, ballot=ballot)
+        room = RoomFactory.create(ballot=ballot)
+
+        for index in range(10):
+            session = VotingSessionFactory.create(
+                room=room if index % 3 == 0 else RoomFactory.create(ballot=ballot)
+            )
+            for option in random.sample(options, random.randint(2, 8)):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+        self.session = VotingSessionFactory.create(room=room)
+        for option in random.sample(options, 3):
+            UserVoteFactory.create(
+                session=self.session,
+                option=option,
+                polarity=random.random() < 0.5
+            )
+
+    def get_results(self, mode):
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={self.session.id}&mode={mode}&limit=100')
+        return response.json()['results']
+
+    def assert_same_ordering(self, mode):
+        self.create_votes()
+        expected = self.get_results(mode)
+        with self.settings(SCORING_ENGINE='sql'):
+            actual = self.get_results(mode)
+
+        # The annotations leave ties in no particular order, the query orders them by id
+        expected.sort(key=lambda result: (-round(result['score'], 9), result['id']))
+        self.assertGreater(len(expected), 1)
+        self.assertEqual([result['id'] for result in actual], [result['id'] for result in expected])
+        for actual_result, expected_result in zip(actual, expected):
+            self.assertAlmostEqual(actual_result['score'], expected_result['score'], places=9)
+
+    def test__likelihood__same_ordering(self):
+        self.assert_same_ordering('suggest')
+
+    def test__significance__same_ordering(self):
+        self.assert_same_ordering('explore')
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__sparse_likelihood__same_ordering(self):
+        self.assert_same_ordering('suggest')
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__sparse_significance__same_ordering(self):
+        self.assert_same_ordering('explore')
+
+
+class SampledSuggestionTests(EngineTestMixin, TestCase):
+    def create_votes(self):
+        random.seed(2)
+        ballot = BallotFactory.create()
+        self.options = BallotOptionFactory.create_batch(12, ballot=ballot)
+
+        for _ in range(8):
+            session = VotingSessionFactory.create(room=RoomFactory.create(ballot=ballot))
+            for option in random.sample(self.options, random.randint(2, 8)):
+                UserVoteFactory.create(
+                    session=session,
+                    option=option,
+                    polarity=random.random() < 0.5
+                )
+
+        self.session = VotingSessionFactory.create(room=RoomFactory.create(ballot=ballot))
+        for option in self.options[:2]:
+            UserVoteFactory.create(session=self.session, option=option, polarity=True)
+
+    def get_json(self, mode, budget):
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={self.session.id}&mode={mode}&budget_ms={budget}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def get_exact_results(self, mode):
+        url = reverse('suggest-list')
+        with self.settings(SCORING_ENGINE='numpy'):
+            response = self.client.get(url + f'?token={self.session.id}&mode={mode}&limit=100')
+        return response.json()['results']
+
+    def test_sampled__invalid_budget__error(self):
+        session = VotingSessionFactory.create()
+
+        url = reverse('suggest-list')
+        response = self.client.get(url + f'?token={session.id}&mode=suggest&budget_ms=-5')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def assert_large_budget_exact(self, mode):
+        self.create_votes()
+
+        json = self.get_json(mode, 10000)
+
+        self.assertEqual(json['sample_size'], 12)
+        self.assertEqual(json['option_count'], 12)
+        expected = self.get_exact_results(mode)
+        self.assertEqual(
+            [result['id'] for result in json['results']],
+            [result['id'] for result in expected]
+        )
+        for result, expected_result in zip(json['results'], expected):
+            self.assertAlmostEqual(result['score'], expected_result['score'], places=5)
+            self.assertEqual(result['interval'], [result['score'], result['score']])
+
+    def test_sampled__large_budget_likelihood__exact(self):
+        self.assert_large_budget_exact('suggest')
+
+    def test_sampled__large_budget_significance__exact(self):
+        self.assert_large_budget_exact('explore')
+
+    def test_sampled__small_budget__estimated_from_sample(self):
+        self.create_votes()
+        get_engine(self.session.room.ballot.id).SAMPLE_BATCH_SIZE = 3
+
+        json = self.get_json('suggest', 0.001)
+
+        self.assertEqual(json['sample_size'], 3)
+        self.assertEqual(len(json['results']), 10)
+        for result in json['results']:
+            lower, upper = result['interval']
+            self.assertLessEqual(lower, result['score'])
+            self.assertLessEqual(result['score'], upper)
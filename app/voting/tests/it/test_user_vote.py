@@ -1,9 +1,16 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
 
+from voting import session_context
+from voting.engine import clear_engines
 from voting.factories import UserVoteFactory, BallotOptionFactory, VotingSessionFactory
-from voting.models import UserVote, OptionCorrelation
+from voting.models import BallotOption, UserVote, OptionCorrelation, PendingCorrelationUpdate
+from voting.serializers import UserVoteSerializer
+from voting.session_context import clear_session_contexts, get_session_context
 
 
 class UserVoteListTests(TestCase):
@@ -40,6 +47,56 @@ class UserVoteListTests(TestCase):
         self.assertIn('results', json)
         self.assertEqual(json['results'], [])
 
+    def test_user_vote__list_pages__every_vote_once(self):
+        session = VotingSessionFactory.create()
+        UserVoteFactory.create_batch(25, session=session)
+        # Votes created at the same time are still paged in a stable order
+        UserVote.objects.filter(id__in=UserVote.objects.order_by('id')[5:15].values('id')).update(
+            created=timezone.now()
+        )
+
+        url = reverse('uservote-list') + f'?token={session.id}'
+        ids = []
+        while url is not None:
+            with CaptureQueriesContext(connection) as queries:
+                json = self.client.get(url).json()
+            # Pages are found from the cursor alone, without counting every vote
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            ids.extend(result['id'] for result in json['results'])
+            url = json['next']
+
+        self.assertEqual(ids, list(
+            UserVote.objects.order_by('-created', '-id').values_list('id', flat=True)
+        ))
+
+    def test_user_vote__list_pages_same_created__positioned_by_id(self):
+        session = VotingSessionFactory.create()
+        UserVoteFactory.create_batch(25, session=session)
+        UserVote.objects.update(created=timezone.now())
+        expected = list(UserVote.objects.order_by('-id').values_list('id', flat=True))
+
+        url = reverse('uservote-list') + f'?token={session.id}'
+        first = self.client.get(url).json()
+        self.assertEqual([result['id'] for result in first['results']], expected[:10])
+        self.assertIsNone(first['previous'])
+
+        # A vote deleted from an earlier page does not shift the pages after it
+        UserVote.objects.filter(id=expected[0]).delete()
+        pages = [self.client.get(first['next']).json()]
+        while pages[-1]['next'] is not None:
+            pages.append(self.client.get(pages[-1]['next']).json())
+        self.assertEqual(
+            [[result['id'] for result in page['results']] for page in pages],
+            [expected[10:20], expected[20:]]
+        )
+
+        # Going back gives the same pages, up to the first
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual([result['id'] for result in previous['results']], expected[10:20])
+        previous = self.client.get(previous['previous']).json()
+        self.assertEqual([result['id'] for result in previous['results']], expected[1:10])
+        self.assertIsNone(previous['previous'])
+
 
 class UserVoteGetTests(TestCase):
     def test_user_vote__get_no_token__error(self):
@@ -96,6 +153,38 @@ class UserVoteCreateTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_user_vote__create_duplicate__error(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+        UserVoteFactory.create(session=session, option=option, polarity=False)
+
+        url = reverse('uservote-list')
+        response = self.client.post(url + f'?token={session.id}', {
+            'option': option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {
+            'non_field_errors': ['The fields session, option must make a unique set.']
+        })
+        self.assertEqual(UserVote.objects.get().polarity, False)
+
+    def test_user_vote__create_deleted_session__error(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+        get_session_context(session.id)
+        session_id = session.id
+        session.delete()
+
+        url = reverse('uservote-list')
+        response = self.client.post(url + f'?token={session_id}', {
+            'option': option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_user_vote__create_token_wrong_room__missing(self):
         option = BallotOptionFactory.create()
         invalid_session = VotingSessionFactory()
@@ -108,6 +197,94 @@ class UserVoteCreateTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_user_vote__create_unknown_token__error(self):
+        option = BallotOptionFactory.create()
+
+        url = reverse('uservote-list')
+        response = self.client.post(url + '?token=0', {
+            'option': option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_vote__create_cached_session__validated_without_queries(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+        get_session_context(session.id)
+
+        serializer = UserVoteSerializer(
+            data={'option': option.id, 'polarity': True},
+            context={'session_token': str(session.id)}
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(serializer.is_valid())
+
+    def test_user_vote__create_option_added_elsewhere__success(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+        get_session_context(session.id)
+        # Created without signals, as another process' cache would not have heard of it
+        BallotOption.objects.bulk_create([
+            BallotOption(ballot=option.ballot, label='New', ordinal=1)
+        ])
+        new_option = BallotOption.objects.get(label='New')
+
+        url = reverse('uservote-list')
+        response = self.client.post(url + f'?token={session.id}', {
+            'option': new_option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class SessionContextTests(TestCase):
+    def setUp(self):
+        clear_session_contexts()
+
+    def test__get_session_context__resolves_token(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+
+        self.assertEqual(
+            get_session_context(str(session.id)),
+            (session.id, session.room.id, option.ballot.id, frozenset([option.id]))
+        )
+        self.assertIsNone(get_session_context('unknown'))
+        self.assertIsNone(get_session_context(session.id + 1))
+
+    def test__get_session_context__cached(self):
+        session = VotingSessionFactory.create()
+        context = get_session_context(session.id)
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_session_context(session.id), context)
+
+    def test__option_created__seen_by_cached_context(self):
+        session = VotingSessionFactory.create()
+        get_session_context(session.id)
+
+        option = BallotOptionFactory.create(ballot=session.room.ballot)
+
+        self.assertIn(option.id, get_session_context(session.id).option_ids)
+
+    @override_settings(SESSION_CONTEXT_TTL=0)
+    def test__ttl_elapsed__read_again(self):
+        session = VotingSessionFactory.create()
+        get_session_context(session.id)
+
+        with self.assertNumQueries(2):
+            get_session_context(session.id)
+
+    @override_settings(SESSION_CONTEXT_CACHE_SIZE=1)
+    def test__cache_size__evicts_least_recently_used(self):
+        sessions = VotingSessionFactory.create_batch(2)
+        for session in sessions:
+            get_session_context(session.id)
+
+        self.assertEqual(list(session_context.contexts), [sessions[1].id])
+
 
 class UserVoteUpdateTests(TestCase):
     def test_user_vote__update_no_token__error(self):
@@ -213,3 +390,181 @@ class UserVoteDeleteTests(TestCase):
         response = self.client.delete(url + f'?token={invalid_session.id}')
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class UserVoteBulkCreateTests(TestCase):
+    def post_votes(self, session, votes):
+        url = reverse('uservote-bulk')
+        return self.client.post(url + f'?token={session.id}', [
+            {'option': option.id, 'polarity': polarity}
+            for option, polarity in votes
+        ], content_type='application/json')
+
+    def test_user_vote__bulk_create_no_token__error(self):
+        option = BallotOptionFactory.create()
+        url = reverse('uservote-bulk')
+        response = self.client.post(url, [
+            {'option': option.id, 'polarity': True}
+        ], content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_vote__bulk_create_with_token__success(self):
+        session = VotingSessionFactory.create()
+        first, second = BallotOptionFactory.create_batch(2, ballot=session.room.ballot)
+
+        response = self.post_votes(session, [(first, True), (second, False)])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [(vote['option'], vote['polarity']) for vote in response.json()],
+            [(first.id, True), (second.id, False)]
+        )
+        self.assertEqual(UserVote.objects.filter(session=session).count(), 2)
+
+    def test_user_vote__bulk_create_token_wrong_room__error(self):
+        session = VotingSessionFactory.create()
+        valid = BallotOptionFactory.create(ballot=session.room.ballot)
+        invalid = BallotOptionFactory.create()
+
+        response = self.post_votes(session, [(valid, True), (invalid, True)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserVote.objects.exists())
+
+    def test_user_vote__bulk_create_duplicate_option__error(self):
+        session = VotingSessionFactory.create()
+        option = BallotOptionFactory.create(ballot=session.room.ballot)
+
+        response = self.post_votes(session, [(option, True), (option, False)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserVote.objects.exists())
+
+    def test_user_vote__bulk_create_already_voted__error(self):
+        user_vote = UserVoteFactory.create()
+
+        response = self.post_votes(user_vote.session, [(user_vote.option, True)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def cast_votes(self, bulk):
+        """Cast the same votes on a new ballot, returning its correlations by option index."""
+        session = VotingSessionFactory.create()
+        options = BallotOptionFactory.create_batch(4, ballot=session.room.ballot)
+
+        # Correlations already moved by another session and an earlier vote of this one
+        earlier = VotingSessionFactory.create(room=session.room)
+        UserVoteFactory.create(session=earlier, option=options[0], polarity=True)
+        UserVoteFactory.create(session=earlier, option=options[1], polarity=False)
+        UserVoteFactory.create(session=session, option=options[0], polarity=False)
+
+        votes = [(options[1], True), (options[2], False), (options[3], True)]
+        if bulk:
+            response = self.post_votes(session, votes)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        else:
+            for option, polarity in votes:
+                UserVoteFactory.create(session=session, option=option, polarity=polarity)
+
+        index = {option.id: i for i, option in enumerate(options)}
+        return {
+            (index[predicate], polarity, index[target]): correlation
+            for predicate, polarity, target, correlation in OptionCorrelation.objects.filter(
+                target__in=options
+            ).values_list('predicate', 'predicate_polarity', 'target', 'correlation')
+        }
+
+    def test_user_vote__bulk_create__matches_sequential(self):
+        self.assertEqual(self.cast_votes(bulk=True), self.cast_votes(bulk=False))
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test_user_vote__bulk_create_sparse__matches_sequential(self):
+        self.assertEqual(self.cast_votes(bulk=True), self.cast_votes(bulk=False))
+
+    @override_settings(CORRELATION_UPDATES='queue')
+    def test_user_vote__bulk_create_queue__queued(self):
+        session = VotingSessionFactory.create()
+        options = BallotOptionFactory.create_batch(2, ballot=session.room.ballot)
+
+        self.post_votes(session, [(option, True) for option in options])
+
+        self.assertEqual(PendingCorrelationUpdate.objects.count(), 2)
+
+
+class UserVoteCreateAndSuggestTests(TestCase):
+    def post_vote(self, session, option, mode='suggest'):
+        url = reverse('uservote-next')
+        return self.client.post(url + f'?token={session.id}&mode={mode}', {
+            'option': option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+    def test_user_vote__create_and_suggest_no_token__error(self):
+        option = BallotOptionFactory.create()
+        url = reverse('uservote-next')
+        response = self.client.post(url + '?mode=suggest', {
+            'option': option.id,
+            'polarity': True
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_vote__create_and_suggest_duplicate__error(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+        self.post_vote(session, option)
+
+        response = self.post_vote(session, option)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UserVote.objects.count(), 1)
+
+    def test_user_vote__create_and_suggest_invalid_mode__error(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+
+        response = self.post_vote(session, option, mode='invalid')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserVote.objects.exists())
+
+    def test_user_vote__create_and_suggest_wrong_room__error(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create()
+
+        response = self.post_vote(session, option)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_vote__create_and_suggest__success(self):
+        session = VotingSessionFactory.create()
+        voted, remaining = BallotOptionFactory.create_batch(2, ballot=session.room.ballot)
+
+        for mode in ['suggest', 'explore']:
+            with self.subTest(mode=mode):
+                UserVote.objects.all().delete()
+                response = self.post_vote(session, voted, mode)
+
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                json = response.json()
+                self.assertEqual(json['vote']['option'], voted.id)
+                self.assertTrue(json['vote']['polarity'])
+                self.assertEqual(json['suggestion']['id'], remaining.id)
+                self.assertTrue(UserVote.objects.filter(session=session, option=voted).exists())
+
+    def test_user_vote__create_and_suggest_last_option__no_suggestion(self):
+        option = BallotOptionFactory.create()
+        session = VotingSessionFactory.create(room__ballot=option.ballot)
+
+        response = self.post_vote(session, option)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.json()['suggestion'])
+
+
+@override_settings(SCORING_ENGINE='numpy')
+class EngineUserVoteCreateAndSuggestTests(UserVoteCreateAndSuggestTests):
+    def setUp(self):
+        super().setUp()
+        clear_engines()
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from voting.factories import BallotOptionFactory, BallotFactory
 from voting.models import OptionCorrelation
@@ -31,3 +31,19 @@ class InitializeCorrelationsTests(TestCase):
             predicate=second,
             target=first
         ).count(), 2)
+
+    def test__create_option__correlations_on_option_ballot(self):
+        ballot = BallotFactory.create()
+        BallotOptionFactory.create(ballot=ballot)
+        BallotOptionFactory.create(ballot=ballot)
+        BallotOptionFactory.create_batch(2, ballot=BallotFactory.create())
+
+        self.assertEqual(OptionCorrelation.objects.filter(ballot=ballot).count(), 4)
+
+    @override_settings(SPARSE_CORRELATIONS=True)
+    def test__create_option_sparse__creates_no_correlations(self):
+        ballot = BallotFactory.create()
+        BallotOptionFactory.create(ballot=ballot)
+        BallotOptionFactory.create(ballot=ballot)
+
+        self.assertEqual(OptionCorrelation.objects.all().count(), 0)
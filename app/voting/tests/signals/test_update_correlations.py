@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from voting.factories import UserVoteFactory, VotingSessionFactory, BallotFactory
 from voting.models import OptionCorrelation
@@ -107,3 +107,61 @@ class UpdateCorrelationsTests(TestCase):
             ).correlation,
             0.5
         )
+
+
+@override_settings(SPARSE_CORRELATIONS=True)
+class SparseUpdateCorrelationsTests(UpdateCorrelationsTests):
+    def test__user_vote_wrong_polarity__no_effect(self):
+        # A vote should not store correlations for the other polarity
+        session = VotingSessionFactory.create()
+        first = UserVoteFactory.create(session=session)
+        second = UserVoteFactory.create(session=session)
+
+        self.assertFalse(
+            OptionCorrelation.objects.filter(
+                predicate=first.option,
+                predicate_polarity=not first.polarity,
+                target=second.option
+            ).exists()
+        )
+
+    def test__user_vote_wrong_polarity__no_effect_inverse(self):
+        # A vote should not store correlations for the other polarity made before
+        session = VotingSessionFactory.create()
+        first = UserVoteFactory.create(session=session)
+        second = UserVoteFactory.create(session=session)
+
+        self.assertFalse(
+            OptionCorrelation.objects.filter(
+                predicate=second.option,
+                predicate_polarity=not second.polarity,
+                target=first.option
+            ).exists()
+        )
+
+    def test__different_session_user_vote__no_effect(self):
+        # Votes from different sessions should not store any correlation between them
+        ballot = BallotFactory.create()
+        UserVoteFactory.create(session__room__ballot=ballot, polarity=False)
+        UserVoteFactory.create(session__room__ballot=ballot)
+
+        self.assertFalse(OptionCorrelation.objects.exists())
+
+    def test__different_session_user_vote__no_effect_inverse(self):
+        # Votes from different sessions should not store any correlation between them
+        ballot = BallotFactory.create()
+        UserVoteFactory.create(session__room__ballot=ballot)
+        UserVoteFactory.create(session__room__ballot=ballot, polarity=False)
+
+        self.assertFalse(OptionCorrelation.objects.exists())
+
+    def test__user_vote__stores_only_updated_correlations(self):
+        session = VotingSessionFactory.create()
+        UserVoteFactory.create(session=session)
+        UserVoteFactory.create(session=session)
+        UserVoteFactory.create(session=session, polarity=True)
+
+        # Each pair of votes stores one correlation in each direction
+        self.assertEqual(OptionCorrelation.objects.count(), 6)
+        self.assertFalse(OptionCorrelation.objects.filter(correlation=0.5).exists())
+        self.assertFalse(OptionCorrelation.objects.exclude(ballot=session.room.ballot).exists())
@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from voting.bitmaps import get_ordinals
+from voting.factories import BallotOptionFactory, UserVoteFactory, VotingSessionFactory
+from voting.models import UserVote
+from voting.session_votes import get_session_bitmaps, get_session_votes
+from voting.signals import votes_bulk_created
+
+
+class UpdateSessionVotesTests(TestCase):
+    def setUp(self):
+        self.session = VotingSessionFactory.create()
+        self.options = BallotOptionFactory.create_batch(12, ballot=self.session.room.ballot)
+
+    def get_voted(self):
+        voted_for, voted_against = get_session_bitmaps(self.session.id)
+        return set(get_ordinals(voted_for).tolist()), set(get_ordinals(voted_against).tolist())
+
+    def test__votes__set_bitmaps(self):
+        UserVoteFactory.create(session=self.session, option=self.options[10], polarity=True)
+        UserVoteFactory.create(session=self.session, option=self.options[2], polarity=False)
+        # Votes of other sessions in the room are not included
+        other = VotingSessionFactory.create(room=self.session.room)
+        UserVoteFactory.create(session=other, option=self.options[3], polarity=True)
+
+        self.assertEqual(
+            self.get_voted(),
+            ({self.options[10].ordinal}, {self.options[2].ordinal})
+        )
+        self.assertEqual(
+            get_session_votes(self.session.id),
+            {self.options[2].id: False, self.options[10].id: True}
+        )
+
+    def test__vote_changed__bit_moved(self):
+        vote = UserVoteFactory.create(session=self.session, option=self.options[4], polarity=True)
+
+        vote.polarity = False
+        vote.save()
+
+        self.assertEqual(self.get_voted(), (set(), {self.options[4].ordinal}))
+
+    def test__vote_deleted__bits_cleared(self):
+        vote = UserVoteFactory.create(session=self.session, option=self.options[4], polarity=False)
+
+        vote.delete()
+
+        self.assertEqual(self.get_voted(), (set(), set()))
+        self.assertEqual(get_session_votes(self.session.id), {})
+
+    def test__bulk_votes__set_bitmaps(self):
+        votes = UserVote.objects.bulk_create([
+            UserVote(session=self.session, option=option, polarity=index % 2 == 0)
+            for index, option in enumerate(self.options[:4])
+        ])
+        votes_bulk_created.send(sender=UserVote, votes=votes)
+
+        self.assertEqual(get_session_votes(self.session.id), {
+            option.id: index % 2 == 0 for index, option in enumerate(self.options[:4])
+        })
+
+    def test__unknown_session__no_votes(self):
+        self.assertIsNone(get_session_bitmaps(self.session.id + 1))
+        self.assertEqual(get_session_votes(self.session.id + 1), {})
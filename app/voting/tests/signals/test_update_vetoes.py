@@ -0,0 +1,143 @@
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from voting.factories import (
+    BallotFactory,
+    BallotOptionFactory,
+    UserVoteFactory,
+    VotingSessionFactory
+)
+from voting.models import UserVote
+from voting.signals import votes_bulk_created
+from voting.bitmaps import get_bits, get_ordinals, set_bits
+from voting.vetoes import get_room_vetoes
+
+
+class UpdateVetoesTests(TestCase):
+    def setUp(self):
+        self.session = VotingSessionFactory.create()
+        self.options = BallotOptionFactory.create_batch(10, ballot=self.session.room.ballot)
+
+    def get_vetoed(self, session=None):
+        room_id = (session or self.session).room_id
+        return set(get_ordinals(get_room_vetoes(room_id)).tolist())
+
+    def test__vote_against__vetoes_option(self):
+        UserVoteFactory.create(session=self.session, option=self.options[9], polarity=False)
+        UserVoteFactory.create(session=self.session, option=self.options[1], polarity=True)
+
+        self.assertEqual(self.get_vetoed(), {self.options[9].ordinal})
+        # Other rooms on the ballot are not affected
+        other = VotingSessionFactory.create()
+        self.assertEqual(self.get_vetoed(other), set())
+
+    def test__vote_changed_to_for__veto_cleared(self):
+        vote = UserVoteFactory.create(session=self.session, option=self.options[2], polarity=False)
+
+        vote.polarity = True
+        vote.save()
+
+        self.assertEqual(self.get_vetoed(), set())
+        self.assertEqual(get_room_vetoes(self.session.room_id), b'')
+
+    def test__vote_deleted__veto_kept_while_room_votes_against(self):
+        vote = UserVoteFactory.create(session=self.session, option=self.options[2], polarity=False)
+        other = VotingSessionFactory.create(room=self.session.room)
+        other_vote = UserVoteFactory.create(session=other, option=self.options[2], polarity=False)
+
+        vote.delete()
+        self.assertEqual(self.get_vetoed(), {self.options[2].ordinal})
+
+        other_vote.delete()
+        self.assertEqual(self.get_vetoed(), set())
+
+    def test__bulk_votes__veto_options_against(self):
+        votes = UserVote.objects.bulk_create([
+            UserVote(session=self.session, option=option, polarity=index % 2 == 0)
+            for index, option in enumerate(self.options[:4])
+        ])
+        votes_bulk_created.send(sender=UserVote, votes=votes)
+
+        self.assertEqual(self.get_vetoed(), {self.options[1].ordinal, self.options[3].ordinal})
+
+    def test__session_deleted__vetoes_set_from_other_sessions(self):
+        other = VotingSessionFactory.create(room=self.session.room)
+        for option in self.options[:3]:
+            UserVoteFactory.create(session=self.session, option=option, polarity=False)
+        UserVoteFactory.create(session=other, option=self.options[1], polarity=False)
+
+        self.session.delete()
+
+        self.assertEqual(self.get_vetoed(other), {self.options[1].ordinal})
+
+    def test__session_deleted__queries_not_per_vote(self):
+        def count_delete_queries(vote_count):
+            session = VotingSessionFactory.create(room=self.session.room)
+            for option in self.options[:vote_count]:
+                UserVoteFactory.create(session=session, option=option, polarity=False)
+            with CaptureQueriesContext(connection) as queries:
+                session.delete()
+            return len(queries.captured_queries)
+
+        self.assertEqual(count_delete_queries(10), count_delete_queries(2))
+        self.assertEqual(self.get_vetoed(), set())
+
+    def test__session_delete_rolled_back__votes_update_session_again(self):
+        vote = UserVoteFactory.create(session=self.session, option=self.options[2], polarity=False)
+
+        def fail(**kwargs):
+            raise RuntimeError("Delete failed")
+
+        post_delete.connect(fail, sender=UserVote, dispatch_uid='fail_vote_delete')
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.session.delete()
+        finally:
+            post_delete.disconnect(sender=UserVote, dispatch_uid='fail_vote_delete')
+
+        # The session was not deleted, so its votes still update the room's vetoes
+        vote.delete()
+        self.assertEqual(self.get_vetoed(), set())
+
+    def test__room_deleted__votes_deleted(self):
+        UserVoteFactory.create(session=self.session, option=self.options[2], polarity=False)
+
+        self.session.room.delete()
+
+        self.assertFalse(UserVote.objects.exists())
+        # Votes deleted afterwards update their session again
+        session = VotingSessionFactory.create(room__ballot=self.options[0].ballot)
+        vote = UserVoteFactory.create(session=session, option=self.options[2], polarity=False)
+        vote.delete()
+        self.assertEqual(self.get_vetoed(session), set())
+
+
+class OrdinalTests(TestCase):
+    def test__options__numbered_per_ballot(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(3, ballot=ballot)
+        other = BallotOptionFactory.create(ballot=BallotFactory.create())
+
+        self.assertEqual([option.ordinal for option in options], [0, 1, 2])
+        self.assertEqual(other.ordinal, 0)
+
+    def test__deleted_option__ordinal_not_reused(self):
+        ballot = BallotFactory.create()
+        options = BallotOptionFactory.create_batch(3, ballot=ballot)
+        options[1].delete()
+
+        self.assertEqual(BallotOptionFactory.create(ballot=ballot).ordinal, 3)
+
+
+class BitmapTests(TestCase):
+    def test__set_bits__sets_and_clears(self):
+        bitmap = set_bits(b'', [0, 9], [True, True])
+        self.assertEqual(bitmap, b'\x01\x02')
+
+        bitmap = set_bits(bitmap, [9, 3], [False, True])
+        self.assertEqual(bitmap, b'\x09')
+
+    def test__get_bits__past_end_unset(self):
+        self.assertEqual(get_bits(b'\x05', [0, 1, 2, 40]).tolist(), [True, False, True, False])
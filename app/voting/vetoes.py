@@ -0,0 +1,114 @@
+from django.db import connection, transaction
+
+from .bitmaps import set_bits
+from .models import Room, UserVote
+from .ordinals import get_option_ordinals
+
+
+def get_room_vetoes(room_id):
+    """Bitmap of the options any session in a room voted against, by ordinal."""
+    bitmap = Room.objects.filter(id=room_id).values_list('vetoed', flat=True).first()
+    return bytes(bitmap) if bitmap is not None else b''
+
+
+def update_room_vetoes(session_id, option_ids, vetoed=None):
+    """Update the veto bits of options in the room of a session.
+
+    New votes against options veto them without looking further. When votes are changed or
+    deleted, `vetoed` is left as None and whether each option is still vetoed is read from the
+    votes of the room.
+    """
+    option_ids = list(option_ids)
+    if not option_ids:
+        return
+
+    if vetoed and connection.vendor == 'postgresql':
+        set_room_vetoes(session_id, option_ids)
+        return
+
+    with transaction.atomic():
+        # Lock the room so that concurrent votes do not overwrite each other's bits
+        room = Room.objects.select_for_update(of=('self',)).filter(
+            votingsession=session_id
+        ).values_list('id', 'ballot', 'vetoed').first()
+        if room is None:
+            return
+        room_id, ballot_id, bitmap = room
+
+        # Skip options that no longer exist
+        ordinals = {
+            option_id: ordinal
+            for option_id, ordinal in zip(
+                option_ids,
+                get_option_ordinals(ballot_id, option_ids).tolist()
+            )
+            if ordinal >= 0
+        }
+        if vetoed is None:
+            vetoed_ids = set(UserVote.objects.filter(
+                session__room=room_id,
+                option__in=option_ids,
+                polarity=False
+            ).values_list('option', flat=True))
+        else:
+            vetoed_ids = set(option_ids) if vetoed else set()
+
+        updated = set_bits(
+            bitmap,
+            list(ordinals.values()),
+            [option_id in vetoed_ids for option_id in ordinals]
+        )
+        if updated != bytes(bitmap):
+            Room.objects.filter(id=room_id).update(vetoed=updated)
+
+
+def set_room_vetoes(session_id, option_ids):
+    """Veto options in the room of a session with a single UPDATE, rather than locking the room
+    while its bitmap is read and written back.
+
+    PostgreSQL numbers the bits of a bytea from the lowest bit of its first byte, as the
+    bitmaps do. The bitmap is first padded to hold the highest ordinal set.
+    """
+    room = Room.objects.filter(votingsession=session_id).values_list('id', 'ballot').first()
+    if room is None:
+        return
+    room_id, ballot_id = room
+
+    ordinals = get_option_ordinals(ballot_id, option_ids)
+    ordinals = sorted(set(ordinals[ordinals >= 0].tolist()))
+    if not ordinals:
+        return
+
+    bitmap = "vetoed || decode(repeat('00', greatest(%s - length(vetoed), 0)), 'hex')"
+    for _ in ordinals:
+        bitmap = f'set_bit({bitmap}, %s, 1)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {Room._meta.db_table} SET vetoed = {bitmap} WHERE id = %s",
+            [ordinals[-1] // 8 + 1] + ordinals + [room_id]
+        )
+
+
+def rebuild_room_vetoes(room_id):
+    """Set the veto bits of a room from the votes of its sessions, in one read of the votes.
+
+    Used once sessions are deleted along with their votes, rather than updating the vetoes for
+    each of the votes.
+    """
+    with transaction.atomic():
+        room = Room.objects.select_for_update().filter(
+            id=room_id
+        ).values_list('ballot', 'vetoed').first()
+        if room is None:
+            return
+        ballot_id, bitmap = room
+
+        ordinals = get_option_ordinals(ballot_id, list(UserVote.objects.filter(
+            session__room=room_id,
+            polarity=False
+        ).values_list('option', flat=True).distinct()))
+        ordinals = ordinals[ordinals >= 0].tolist()
+
+        updated = set_bits(b'', ordinals, [True] * len(ordinals))
+        if updated != bytes(bitmap):
+            Room.objects.filter(id=room_id).update(vetoed=updated)
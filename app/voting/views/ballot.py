@@ -1,8 +1,35 @@
+from voting.ballots import import_ballot
 from voting.models import Ballot
-from voting.serializers import BallotSerializer
-from rest_framework import viewsets
+from voting.pagination import CreatedCursorPagination
+from voting.serializers import BallotSerializer, BallotImportSerializer
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
 
 class BallotViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ballot.objects.all().order_by('-created')
     serializer_class = BallotSerializer
+    pagination_class = CreatedCursorPagination
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        permission_classes=[IsAdminUser],
+        serializer_class=BallotImportSerializer
+    )
+    def import_ballot(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        ballot, created = import_ballot(
+            serializer.validated_data['label'],
+            serializer.validated_data['options']
+        )
+
+        return Response({
+            **BallotSerializer(ballot).data,
+            'created_options': created
+        }, status=status.HTTP_201_CREATED)
@@ -1,9 +1,73 @@
+import json
+
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.serializers import ValidationError
 
 from voting.models import BallotOption
+from voting.pagination import CreatedCursorPagination
 from voting.serializers import BallotOptionSerializer
 
 
 class BallotOptionViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = BallotOption.objects.all().order_by('-created')
     serializer_class = BallotOptionSerializer
+    pagination_class = CreatedCursorPagination
+
+    # Number of options read from the database at a time when streaming a ballot
+    STREAM_CHUNK_SIZE = 2000
+
+    def get_queryset(self):
+        queryset = self.queryset
+        ballot_id = self.get_ballot_id()
+        if ballot_id is not None:
+            # Served by the ballot, created and id index, in page order
+            queryset = queryset.filter(ballot=ballot_id)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        return super().get_serializer(*args, fields=self.get_fields(), **kwargs)
+
+    def get_ballot_id(self):
+        ballot_id = self.request.query_params.get('ballot')
+        if ballot_id is None:
+            return None
+
+        try:
+            return int(ballot_id)
+        except ValueError:
+            raise ValidationError("param 'ballot' must be an integer")
+
+    def get_fields(self):
+        fields = self.request.query_params.get('fields')
+        if fields is None:
+            return None
+
+        fields = [field for field in fields.split(',') if field]
+        allowed = BallotOptionSerializer.Meta.fields
+        if not fields or any(field not in allowed for field in fields):
+            raise ValidationError(
+                f"param 'fields' must be a comma separated list of {', '.join(allowed)}")
+        return fields
+
+    @action(detail=False, url_path='all', url_name='all')
+    def stream(self, request):
+        """Stream every option of a ballot in one unpaginated response, ordered by id."""
+        if self.get_ballot_id() is None:
+            raise ValidationError("param 'ballot' is required")
+
+        fields = self.get_fields() or BallotOptionSerializer.Meta.fields
+        # The serializer fields map straight onto columns, so skip building model instances
+        columns = ['ballot_id' if field == 'ballot' else field for field in fields]
+        rows = self.get_queryset().order_by('id').values_list(*columns).iterator(
+            chunk_size=self.STREAM_CHUNK_SIZE
+        )
+
+        def generate():
+            yield '{"results": ['
+            for index, row in enumerate(rows):
+                yield (',' if index else '') + json.dumps(dict(zip(fields, row)))
+            yield ']}'
+
+        return StreamingHttpResponse(generate(), content_type='application/json')
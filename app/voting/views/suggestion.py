@@ -1,119 +1,128 @@
-from django.db.models import F, Avg, OuterRef, Subquery, FloatField
-from django.db.models.functions import Abs
+import time
+
 from rest_framework import viewsets
+from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
-from voting.models import BallotOption, OptionCorrelation
-from voting.serializers import SuggestionSerializer
+from voting.backends import (
+    LIKELIHOOD, SIGNIFICANCE, get_session_ballot, get_session_vetoes, get_suggestions
+)
+from voting.engine import get_engine
+from voting.models import BallotOption
+from voting.serializers import SampledSuggestionSerializer, SuggestionSerializer
+from voting.session_votes import get_session_votes
 from .utils import get_voting_session_token
 
 
 class SuggestionViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = BallotOption.objects.all()
     serializer_class = SuggestionSerializer
-    LIKELIHOOD = 'suggest'
-    SIGNIFICANCE = 'explore'
+    LIKELIHOOD = LIKELIHOOD
+    SIGNIFICANCE = SIGNIFICANCE
 
     def get_queryset(self):
         session_token = get_voting_session_token(self.request)
-        mode = self.request.query_params.get('mode')
-
-        queryset = self.queryset.filter(
-            ballot__room__votingsession=session_token
-        ).exclude(
-            # Do not offer suggestions that have already been voted on
-            uservote__session=session_token
-        ).annotate(
-            score=self.get_score_annotation(mode, session_token)
-        )
-
-        if mode == self.LIKELIHOOD:
-            # In likelihood mode, do not include suggestions that another session has voted against.
-            # This isn't a problem in explore mode, since even if we know an option can't be a
-            # consensus choice, suggesting it can provide us with information about the user
-            queryset = queryset.exclude(
-                uservote__polarity=False,
-                uservote__session__room__votingsession=session_token
-            )
+        mode = self.get_mode()
+
+        return self.get_suggestions(mode, session_token, self.get_limit())
+
+    def get_suggestions(self, mode, session_token, limit=None, ballot_id=None):
+        """Rank the options to suggest to a session, best first.
+
+        The session's ballot is looked up when needed and not given.
+        """
+        return get_suggestions(mode, session_token, limit, ballot_id)
 
-        return queryset.values(
-            'id',
-            'score'
-        ).order_by('-score')
+    def list(self, request, *args, **kwargs):
+        budget = self.get_budget()
+        if budget is not None:
+            # Sampled scores change from one request to the next, so they cannot be paged
+            return Response(self.get_sampled_suggestions(
+                self.get_mode(),
+                get_voting_session_token(request),
+                budget,
+                self.get_limit()
+            ))
+
+        if self.get_limit() is None:
+            return super().list(request, *args, **kwargs)
+
+        # Only the best options were asked for, so skip pagination and the count it needs
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return Response({'results': serializer.data})
+
+    def get_limit(self):
+        limit = self.request.query_params.get('limit')
+        if limit is None:
+            return None
 
-    def get_score_annotation(self, mode, session_token):
         try:
-            func = {
-                self.LIKELIHOOD: self.get_likelihood_annotation,
-                self.SIGNIFICANCE: self.get_significance_annotation
-            }[mode]
-        except KeyError:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise ValidationError("param 'limit' must be a positive integer")
+        return limit
+
+    def get_budget(self):
+        budget = self.request.query_params.get('budget_ms')
+        if budget is None:
+            return None
+
+        try:
+            budget = float(budget)
+        except ValueError:
+            budget = 0
+        if not budget > 0:
+            raise ValidationError("param 'budget_ms' must be a positive number")
+        return budget / 1000
+
+    def get_mode(self):
+        return self.validate_mode(self.request.query_params.get('mode'))
+
+    @classmethod
+    def validate_mode(cls, mode):
+        if mode not in (cls.LIKELIHOOD, cls.SIGNIFICANCE):
             raise ValidationError(
-               f"param 'mode' must be either '{self.LIKELIHOOD}' or '{self.SIGNIFICANCE}'")
-        else:
-            return func(session_token)
-
-    def get_likelihood_annotation(self, session_token):
-        # Average the correlation value over all rows for predicates this session has not excluded
-        # That is either has not voted on or has voted matching the row
-        # This is equivalent to there not being a vote for the wrong polarity
-
-        likelihood_correlations = Subquery(
-            OptionCorrelation.objects.filter(
-                target=OuterRef('pk')
-            ).exclude(
-                predicate__uservote__session=session_token,
-                predicate_polarity=not F(
-                        'predicate__uservote__polarity'
-                    )
-            ).values('correlation')[:1],
-            output_field=FloatField()
-        )
-
-        return Avg(likelihood_correlations)
-
-    def get_significance_annotation(self, session_token):
-        # Calculate the absolute difference in correlation of the two polarities for a given target.
-        # Exclude any correlation that this session has voted for, either as predicate or target.
-        # (Exclude already voted predicates as they cannot be suggestions, and already
-        # voted targets as we want to maximize effect on future suggestions)
-        # e.g., if A has a 0.3 correlation with B, and ~A has a 0.8 correlation with B, then A has
-        # a significance of 0.5 with B
-
-        # We want to weigh the raw significance score by the likelihood of the option being chosen.
-        # This centers around 0.5, so that a likelihood of 0.5 is a 1x multiplier, and drops off to
-        #  0x for 100% or 0% likelihood.
-        # This way, options that may have high impact but are unlikely to provide information about
-        #  the user will be ranked below options that have a more moderate impact, but are more
-        # likely to reveal something about the user's preferences.
-        likelihood_score = (1 - 2 * Abs(
-            0.5 - self.get_likelihood_annotation(session_token)))
-
-        # Build a subquery of all correlations for relevant options
-        # Since we want the difference, start getting all with polarity=True
-        correlation_change = Subquery(OptionCorrelation.objects.filter(
-            predicate=OuterRef('pk'),
-            predicate_polarity=True
-        ).exclude(
-            # Exclude options that the session has voted on, either as the predicate or target,
-            # since we want options that are likely to affect future votes
-            target__uservote__session=session_token
-        ).annotate(
-            # Next, annotate a new column called correlation_false for the same options,
-            # but with polarity=False
-            correlation_false=Subquery(
-                OptionCorrelation.objects.filter(
-                    predicate=OuterRef('predicate'),
-                    predicate_polarity=False,
-                    target=OuterRef('target')
-                ).values('correlation')[:1]
-            )
-        ).values(
-            # Then collapse the rows to just the absolute difference up or down
-            correlation_change=Abs(
-                F('correlation')-F('correlation_false')
+                f"param 'mode' must be either '{cls.LIKELIHOOD}' or '{cls.SIGNIFICANCE}'")
+        return mode
+
+    def get_sampled_suggestions(self, mode, session_token, budget, limit=None):
+        """Rank the options from scores estimated within a time budget, in seconds.
+
+        Scores are estimated by the in-memory engine whatever the scoring engine, from as many
+        options as can be drawn before the budget runs out. Each suggestion comes with the
+        confidence interval of its score, and the response with the number of options drawn.
+        """
+        deadline = time.perf_counter() + budget
+
+        ballot_id = get_session_ballot(session_token)
+        if ballot_id is None:
+            return {'results': [], 'sample_size': 0, 'option_count': 0}
+
+        votes = get_session_votes(session_token)
+        engine = get_engine(ballot_id)
+        # As for exact scores, only exclude vetoed options in likelihood mode
+        vetoes = get_session_vetoes(session_token) if mode == self.LIKELIHOOD else None
+        with engine.lock:
+            vetoed = engine.get_vetoed(vetoes) if vetoes is not None else None
+            scores, errors, sample_size = engine.estimate_scores(
+                votes,
+                significance=mode == self.SIGNIFICANCE,
+                deadline=deadline
             )
-        )[:1], output_field=FloatField())
+            suggestions = engine.rank(scores, set(votes), limit, vetoed)
+            indexes = engine.get_indexes([suggestion['id'] for suggestion in suggestions])
+            option_count = engine.option_count
+
+        for suggestion, index in zip(suggestions, indexes):
+            suggestion['interval'] = [
+                round(float(scores[index] - errors[index]), 6),
+                round(float(scores[index] + errors[index]), 6)
+            ]
 
-        # Finally, average the absolute differences for all targets of a given predicate
-        return likelihood_score * Avg(correlation_change)
+        return {
+            'results': SampledSuggestionSerializer(suggestions, many=True).data,
+            'sample_size': sample_size,
+            'option_count': option_count
+        }
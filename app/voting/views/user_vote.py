@@ -1,31 +1,138 @@
-from rest_framework import viewsets
+from django.db import IntegrityError, transaction
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
 from voting.models import UserVote
-from voting.serializers import UserVoteSerializer
+from voting.pagination import CreatedCursorPagination
+from voting.serializers import UserVoteSerializer, BulkUserVoteSerializer, SuggestionSerializer
+from voting.session_context import get_session_context, is_valid_option
+from voting.signals import votes_bulk_created
+from .suggestion import SuggestionViewSet
 from .utils import get_voting_session_token
 
 
+# Returned when a session votes on an option twice, as the unique validator of a model serializer
+DUPLICATE_VOTE_ERROR = {
+    'non_field_errors': ['The fields session, option must make a unique set.']
+}
+
+
 class UserVoteViewSet(viewsets.ModelViewSet):
     queryset = UserVote.objects.all().order_by('-created')
     serializer_class = UserVoteSerializer
+    pagination_class = CreatedCursorPagination
 
     def get_queryset(self):
         return self.queryset.filter(
             session=get_voting_session_token(self.request)
         )
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Options of new votes are checked against the session's ballot
+        if 'token' in self.request.query_params:
+            context['session_token'] = get_voting_session_token(self.request)
+        return context
+
+    def get_session(self):
+        session = get_session_context(get_voting_session_token(self.request))
+        if session is None:
+            raise ValidationError('Token is not valid')
+        return session
+
     def create(self, request, *args, **kwargs):
-        self.request.data['session'] = get_voting_session_token(self.request)
+        self.get_session()
         return super().create(request, *args, **kwargs)
 
-    def update(self, request, *args, **kwargs):
+    def perform_create(self, serializer):
+        session_id = self.get_session().session_id
         try:
-            del self.request.data['session']
-        except KeyError:
-            pass
+            # In a savepoint, so that a duplicate vote leaves the request's transaction usable
+            with transaction.atomic():
+                serializer.save(session_id=session_id)
+        except IntegrityError:
+            if not UserVote.objects.filter(
+                session=session_id,
+                option=serializer.validated_data['option_id']
+            ).exists():
+                raise
+            raise ValidationError(DUPLICATE_VOTE_ERROR)
 
+    def update(self, request, *args, **kwargs):
         if 'option' in self.request.data:
             raise ValidationError('Option is read-only')
 
         return super().update(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], url_path='next', url_name='next')
+    def create_and_suggest(self, request):
+        """Record a vote and return the next suggestion for the session in one request."""
+        mode = SuggestionViewSet.validate_mode(request.query_params.get('mode'))
+        session = self.get_session()
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            self.perform_create(serializer)
+            # The session context already resolved the ballot, so the suggestion can skip it
+            suggestion = next(iter(SuggestionViewSet().get_suggestions(
+                mode,
+                session.session_id,
+                limit=1,
+                ballot_id=session.ballot_id
+            )), None)
+
+        return Response({
+            'vote': serializer.data,
+            'suggestion': SuggestionSerializer(suggestion).data if suggestion else None
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        session = self.get_session()
+
+        serializer = BulkUserVoteSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        option_ids = [vote['option'] for vote in serializer.validated_data]
+
+        if len(set(option_ids)) != len(option_ids):
+            raise ValidationError('Options must be unique')
+
+        if not all(is_valid_option(session, option_id) for option_id in option_ids):
+            raise ValidationError('Option not valid for token')
+
+        if UserVote.objects.filter(session=session.session_id, option__in=option_ids).exists():
+            raise ValidationError('Option already voted on')
+
+        try:
+            with transaction.atomic():
+                UserVote.objects.bulk_create(
+                    UserVote(
+                        session_id=session.session_id,
+                        option_id=vote['option'],
+                        polarity=vote['polarity']
+                    )
+                    for vote in serializer.validated_data
+                )
+                # Not every database returns the ids of bulk created rows, so read the votes back
+                votes = list(UserVote.objects.filter(
+                    session=session.session_id,
+                    option__in=option_ids
+                ).order_by('id'))
+                votes_bulk_created.send(sender=UserVote, votes=votes)
+        except IntegrityError:
+            # Another request voted on one of the options since they were checked
+            if not UserVote.objects.filter(
+                session=session.session_id,
+                option__in=option_ids
+            ).exists():
+                raise
+            raise ValidationError(DUPLICATE_VOTE_ERROR)
+
+        return Response(
+            UserVoteSerializer(votes, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
@@ -2,7 +2,15 @@ from rest_framework.serializers import ValidationError
 
 
 def get_voting_session_token(request):
+    """The id of the session a request is made for, from its token.
+
+    Returned as an int, so that the caches keyed by session, such as the engines' session
+    scores and the speculations, see one key for a session however its token is written.
+    """
     token = request.query_params.get('token')
     if token is None:
         raise ValidationError('Token is required')
-    return token
+    try:
+        return int(token)
+    except ValueError:
+        raise ValidationError('Token is not valid')
@@ -1,47 +1,59 @@
-import requests
+import argparse
+import json
+import math
+import os
 import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-HOSTNAME = 'http://localhost:8000'
-
+import requests
 
-def count(start=0):
-    while True:
-        yield start
-        start += 1
+HOSTNAME = os.environ.get('SUGGESTION_API_HOST', 'http://localhost:8000')
 
+# Number of hidden traits options have and users weigh, for the 'traits' preference model
+TRAIT_COUNT = 4
 
-def load_all_data(path, params=None):
-    if params is None:
-        params = {}
 
-    for page in count(start=1):
-        params['page'] = page
+def load_all_data(path, params=None, http=requests):
+    data = load_data(path, params, http)
+    yield from data['results']
 
-        data = load_data(path, params)
+    # Follow the cursor of each page to the next one
+    while data['next'] is not None:
+        response = http.get(data['next'])
+        response.raise_for_status()
+        data = response.json()
         yield from data['results']
 
-        if data['next'] is None:
-            return
 
-
-def load_data(path, params=None):
+def load_data(path, params=None, http=requests):
     url = f"{HOSTNAME}/{path}"
-    response = requests.get(url, params=params)
+    response = http.get(url, params=params)
     response.raise_for_status()
 
     return response.json()
 
 
-def perform_post(path, payload):
+def perform_post(path, payload, http=requests):
     url = f"{HOSTNAME}/{path}"
-    response = requests.post(url, json=payload)
+    response = http.post(url, json=payload)
     response.raise_for_status()
     return response.json()
 
 
-def create_voting_session(ballot):
-    room = perform_post('room/', {'ballot': ballot['id']})
-    session = perform_post('session/', {'room': room['id']})
+def load_ballot_options(ballot, fields=None, http=requests):
+    # Every option of the ballot in a single unpaginated response
+    params = {'ballot': ballot['id']}
+    if fields is not None:
+        params['fields'] = ','.join(fields)
+    return load_data('ballotoption/all/', params, http)['results']
+
+
+def create_voting_session(ballot, http=requests):
+    room = perform_post('room/', {'ballot': ballot['id']}, http)
+    session = perform_post('session/', {'room': room['id']}, http)
     return session
 
 
@@ -60,44 +72,278 @@ def choose_option(options, label_key=None):
             print("Please select an option from the list")
 
 
-def get_suggestions(session):
+def random_mode():
+    return random.choice(['explore', 'suggest'])
+
+
+def get_first_suggestion(session, http=requests):
+    data = load_data('suggest/', {
+        'token': session['id'],
+        'mode': random_mode(),
+        'limit': 1
+    }, http)
+    return data['results'][0] if data['results'] else None
+
+
+def vote_suggestion(session, suggestion, polarity, http=requests):
+    # Cast the vote and get the next suggestion back in the same request
+    path = f'vote/next/?token={session["id"]}&mode={random_mode()}'
+    data = perform_post(path, {
+        'option': suggestion['id'],
+        'polarity': polarity
+    }, http)
+    return data['suggestion']
+
+
+def run_interactive():
+    ballot = choose_option(
+        load_all_data('ballot/'),
+        'label'
+    )
+
     options = {
         option['id']: option
         for option in
-        load_all_data('ballotoption/', {'ballot': ballot['id']})
+        load_ballot_options(ballot, ['id', 'label'])
     }
-    while True:
-        data = load_data('suggest', {
-            'token': session['id'],
-            'mode': random.choice(['explore', 'suggest'])
-        })
-        yield options[
-            data['results'][0]['id']
+    session = create_voting_session(ballot)
+
+    suggestion = get_first_suggestion(session)
+    while suggestion is not None:
+        option = options[suggestion['id']]
+        print(f'== {option["label"]} ==')
+        polarity = choose_option(['Yes', 'No']) == 'Yes'
+
+        suggestion = vote_suggestion(
+            session,
+            option,
+            polarity
+        )
+
+
+class LoadStats:
+    """Latencies and errors of the requests made by simulated users, per endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, http, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = http.request(method, f"{HOSTNAME}/{path}", **kwargs)
+            response.raise_for_status()
+        except requests.RequestException:
+            with self.lock:
+                self.errors[endpoint] += 1
+            raise
+        finally:
+            latency = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.latencies[endpoint].append(latency)
+        return response.json()
+
+    def report(self, duration):
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'duration_s': round(duration, 3),
+            'requests': total,
+            'throughput_rps': round(total / duration, 3) if duration else 0.0,
+            'endpoints': {
+                endpoint: {
+                    'requests': len(latencies),
+                    'errors': self.errors[endpoint],
+                    'error_rate': self.errors[endpoint] / len(latencies),
+                    **{
+                        f'p{percentile}_ms': round(get_percentile(latencies, percentile), 3)
+                        for percentile in (50, 95, 99)
+                    }
+                }
+                for endpoint, latencies in sorted(self.latencies.items())
+            }
+        }
+
+
+def get_percentile(values, percentile):
+    # Nearest-rank percentile
+    values = sorted(values)
+    return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+
+def get_preference_model(name, option_ids, yes_rate, rng):
+    """Return a function creating a user's chance of voting yes on each option.
+
+    'random' users vote yes at the same rate on every option. 'traits' users weigh random
+    traits of the options with their own tastes, so their votes correlate like real
+    preferences.
+    """
+    if name == 'random':
+        return lambda: lambda option_id: yes_rate
+
+    traits = {
+        option_id: [rng.gauss(0, 1) for _ in range(TRAIT_COUNT)]
+        for option_id in option_ids
+    }
+    # Shift affinities so that the average user votes yes at about the given rate
+    bias = math.log(yes_rate / (1 - yes_rate))
+    # Users are created from several threads, but share the seeded generator
+    lock = threading.Lock()
+
+    def create_user():
+        with lock:
+            taste = [rng.gauss(0, 1) for _ in range(TRAIT_COUNT)]
+
+        def preference(option_id):
+            affinity = sum(t * w for t, w in zip(traits[option_id], taste)) + bias
+            return 1 / (1 + math.exp(-affinity))
+        return preference
+
+    return create_user
+
+
+def simulate_user(stats, room, create_preference, votes, seed):
+    rng = random.Random(seed)
+    preference = create_preference()
+
+    # Keep the connection open across the user's requests, as a browser would
+    with requests.Session() as http:
+        session = stats.request(http, 'session', 'post', 'session/', json={'room': room['id']})
+
+        for _ in range(votes):
+            data = stats.request(http, 'suggest', 'get', 'suggest/', params={
+                'token': session['id'],
+                'mode': rng.choice(['explore', 'suggest']),
+                'limit': 1
+            })
+            if not data['results']:
+                return
+
+            option_id = data['results'][0]['id']
+            stats.request(http, 'vote', 'post', f'vote/?token={session["id"]}', json={
+                'option': option_id,
+                'polarity': rng.random() < preference(option_id)
+            })
+
+
+def run_load(args):
+    rng = random.Random(args.seed)
+
+    with requests.Session() as http:
+        if args.ballot is not None:
+            ballot = load_data(f'ballot/{args.ballot}/', http=http)
+        else:
+            ballot = rng.choice(list(load_all_data('ballot/', http=http)))
+        option_ids = [
+            option['id']
+            for option in load_ballot_options(ballot, ['id'], http)
+        ]
+        rooms = [
+            perform_post('room/', {'ballot': ballot['id']}, http)
+            for _ in range(math.ceil(args.users / args.room_size))
         ]
 
+    create_preference = get_preference_model(args.preference, option_ids, args.yes_rate, rng)
+    stats = LoadStats()
 
-def vote_suggestion(session, suggestion, polarity):
-    path = f'vote/?token={session["id"]}'
-    perform_post(path, {
-        'option': suggestion['id'],
-        'polarity': polarity
-    })
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(
+                simulate_user,
+                stats,
+                rooms[index // args.room_size],
+                create_preference,
+                args.votes,
+                rng.random()
+            )
+            for index in range(args.users)
+        ]
+        failed_users = sum(1 for future in futures if future.exception() is not None)
+    duration = time.perf_counter() - start
+
+    report = stats.report(duration)
+    report['ballot'] = ballot['id']
+    report['users'] = args.users
+    report['failed_users'] = failed_users
+    report['concurrency'] = args.concurrency
 
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            report_file.write(output)
+    else:
+        print(output)
 
-ballot = choose_option(
-    load_all_data('ballot/'),
-    'label'
-)
 
-session = create_voting_session(ballot)
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
 
-for suggestion in get_suggestions(session):
-    print(f'== {suggestion["label"]} ==')
-    polarity = choose_option(['Yes', 'No']) == 'Yes'
 
-    vote_suggestion(
-        session,
-        suggestion,
-        polarity
+def rate(value):
+    number = float(value)
+    # The traits model takes the log odds of the rate, which are infinite at 0 and 1
+    if not 0 < number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not strictly between 0 and 1')
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Vote on suggestions, or simulate many voters')
+    parser.add_argument(
+        '--host',
+        default=HOSTNAME,
+        help='Base URL of the API, also read from SUGGESTION_API_HOST'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    load = subparsers.add_parser('load', help='Simulate concurrent voting sessions')
+    load.add_argument('--ballot', type=int, help='Ballot to vote on, instead of a random one')
+    load.add_argument('--users', type=positive_int, default=100, help='Number of simulated users')
+    load.add_argument(
+        '--concurrency',
+        type=positive_int,
+        default=20,
+        help='Number of users voting at the same time'
     )
+    load.add_argument(
+        '--votes',
+        type=positive_int,
+        default=20,
+        help='Number of votes cast by each user'
+    )
+    load.add_argument(
+        '--room-size',
+        type=positive_int,
+        default=3,
+        help='Number of users sharing each room'
+    )
+    load.add_argument(
+        '--preference',
+        choices=['random', 'traits'],
+        default='traits',
+        help='How users decide their votes'
+    )
+    load.add_argument(
+        '--yes-rate',
+        type=rate,
+        default=0.5,
+        help='Average chance of a user voting yes'
+    )
+    load.add_argument('--seed', type=int, default=0, help='Seed of the simulated users')
+    load.add_argument('--report', help='File to write the JSON report to instead of stdout')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    HOSTNAME = args.host.rstrip('/')
 
+    if args.command == 'load':
+        run_load(args)
+    else:
+        run_interactive()